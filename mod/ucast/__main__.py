@@ -16,27 +16,101 @@
 # You should have received a copy of the GNU General Public License
 # along with `ucast`.  If not, see <http://www.gnu.org/licenses/>.
 
-from os       import path
+import sys
+
+from os       import path, makedirs, remove
 from glob     import glob
-from datetime import datetime
+from datetime import datetime, timedelta
 
 import requests
 import click
+import pandas as pd
 
 import ucast as uc
 from ucast.utils import forced_symlink  as symlink
 from ucast.utils import ucast_dataframe as mkdf
-from ucast.utils import valid, regroup
+from ucast.utils import ucast_dataframes as mkdfs
+from ucast.utils import plan_dataframes as plandfs
+from ucast.utils import plan_profiles
+from ucast.utils import valid, gaps, fill, record, regroup, forecast_hrs, am
 from ucast.io    import dt_fmt
+from ucast.fetch import MAX_IN_FLIGHT, RATE
+from ucast.radtran.am.tune import CONFIG, SOLVES, combinations
+from ucast.radtran.am.tune import calibrate as calibrate_am
+from ucast.radtran.am.tune import save      as save_setting
+from ucast.radtran.am.emulator import DEGREE, HOLDOUT
+from ucast.request import transport
+from ucast.cache   import GribCache, MAX_SIZE, SolutionCache, MAX_SOLUTIONS
+from ucast.archive import Archive
+from ucast.archive import NAME as ARCHIVE
+from ucast.loader  import Loader, CACHE as TABLE_CACHE
 from ucast.io    import save_tsv as save
-from ucast.io    import read_tsv as read
+from ucast.io    import read_table as read
+from ucast.io    import save_npy, binary
 from ucast.plot  import plot_site, plot_all
 from ucast.bokeh import static_vis
 
 
+def open_cache(cache, cache_size):
+    return None if cache is None else GribCache(cache, cache_size * 1024**2)
+
+
+def open_loader(table_cache, no_table_cache):
+    return Loader(None if no_table_cache else table_cache)
+
+
+def save_table(outfile, cycle, df):
+    save(outfile, df)
+    save_npy(binary(outfile), df)
+    record(outfile, cycle, df)
+
+
+def open_emulator(emulator):
+    return None if emulator is None else uc.am.Emulator.load(emulator)
+
+
+def print_metrics(cache=None, emulator=None):
+    m = transport.summary()
+    print(f'{m["requests"]} requests in {m["attempts"]} attempts ({m["retries"]} retries); '
+          f'{m["bytes"]/1e6:.2f} MB downloaded')
+    print(f'latency: {m["latency"]:.1f} s total, {m["mean"]:.3f} s mean, {m["max"]:.3f} s max')
+    print('status: ' + ', '.join(f'{k}: {v}' for k, v in m['status'].items()))
+    if cache is not None:
+        c = cache.summary()
+        print(f'cache: {c["hits"]} hits, {c["misses"]} misses ({100*c["rate"]:.1f}%); '
+              f'{c["size"]/1024**2:.1f} MiB used')
+    if am.memo is not None:
+        c = am.memo.summary()
+        print(f'am memo: {c["hits"]} hits, {c["misses"]} misses ({100*c["rate"]:.1f}%); '
+              f'{c["size"]} solutions stored')
+    if emulator is not None:
+        e = emulator.summary()
+        print(f'emulator: {e["hits"]} emulated, {e["misses"]} solved by am ({100*e["rate"]:.1f}%); '
+              'error bound: ' + ', '.join(f'{k} {v:.3g}' for k, v in e['error'].items()))
+
+
 @click.group()
-def ucast():
+@click.option("--decoder", default=None, help="GRIB2 decoder: pygrib or builtin.", envvar="UCAST_GRIB",
+              type=click.Choice(sorted(uc.gfs.grib.decoders)))
+@click.option("--memo",    default=None, help="SQLite file to memoize `am` solutions.", envvar="UCAST_MEMO")
+@click.option("--memo-size", default=MAX_SOLUTIONS, help="Maximum number of memoized `am` solutions.")
+@click.option("--bands",   default=None, help="Comma-separated extra frequencies in GHz, e.g. 345,690.", envvar="UCAST_BANDS")
+@click.option("--jacobians", default=False, help="Store per-layer sensitivities of tau and Tb next to the tables.", is_flag=True)
+def ucast(decoder, memo, memo_size, bands, jacobians):
     """µcast: micro-weather forecasting for astronomy"""
+    uc.gfs.grib.use(decoder)
+    if memo is not None:
+        am.memo = SolutionCache(memo, memo_size)
+    if bands:
+        try:
+            bands = [float(f) for f in bands.split(',')]
+        except ValueError:
+            raise click.UsageError('"--bands" should be comma-separated frequencies in GHz')
+        try:
+            am.bands = bands
+        except ValueError as e:
+            raise click.UsageError(str(e))
+    am.jacobians = jacobians
 
 @ucast.command()
 @click.argument("site")
@@ -48,7 +122,15 @@ def ucast():
 @click.option("--stencil_size",    default=1,  help="distance of stencil point from site")
 @click.option("--all_directions",    default=True, help="Creates default", is_flag=True)
 @click.option("--direction",    default=None, help="direction ofindividual stencil point")
-def mkgrid(lag, site, data, link, no_link, test,stencil_size,all_directions,direction):
+@click.option("--jobs",    default=MAX_IN_FLIGHT, help="Maximum number of concurrent downloads.")
+@click.option("--rate",    default=RATE,          help="Maximum download rate in requests per second.")
+@click.option("--procs",   default=None, type=int, help="Maximum number of concurrent `am` processes.")
+@click.option("--columns-only", default=False, help="Only integrate water and ozone columns; skip `am`.", is_flag=True)
+@click.option("--emulator", default=None,  help="Emulator file from `ucast emulate`; `am` solves only what it cannot.")
+@click.option("--metrics", default=False, help="Print download metrics when done.",   is_flag=True)
+@click.option("--cache",   default=None,  help="GRIB cache directory.", envvar="UCAST_CACHE")
+@click.option("--cache-size", default=MAX_SIZE//1024**2, help="Size cap of the GRIB cache in MiB.")
+def mkgrid(lag, site, data, link, no_link, test,stencil_size,all_directions,direction, jobs, rate, procs, columns_only, emulator, metrics, cache, cache_size):
     """Pull weather for telescope SITE, process with `am`, and make tables """
 
     if no_link and link is not None:
@@ -60,43 +142,70 @@ def mkgrid(lag, site, data, link, no_link, test,stencil_size,all_directions,dire
 
     if link is None:
         link = data
+
+    cache    = open_cache(cache, cache_size)
+    emulator = open_emulator(emulator)
+
     if direction!=None:
         all_directions=False
     
     
     main_site         = getattr(uc.site, site)
+    stencil_sites     = [main_site]
     if all_directions:
-        stencil_sites=[]
-        stencil_sites.append(main_site)
         #change range(1 to range(0 for origin
         for i in range(1,stencil_size+1):
             stencil_sites.extend(uc.site.get_sites([main_site],stencil_size=stencil_size))
         
         print(stencil_sites)
-    for site in stencil_sites:
-        print("site is:",site)
-        print(type(site))
-        latest_cycle = uc.gfs.latest_cycle(lag=lag)
 
-        for hr_ago in range(0, 48+1, 6):
-            cycle   = uc.gfs.relative_cycle(latest_cycle, hr_ago)
-            outfile = path.join(data, cycle.strftime(dt_fmt)+'.tsv')
+    # The main site goes to `data`; stencil points to subdirectories
+    dirs = {s: data if s == main_site else path.join(data, s.name) for s in stencil_sites}
+    for d in dirs.values():
+        makedirs(d, exist_ok=True)
+        if not no_link:
+            makedirs(path.join(link, path.relpath(d, data)), exist_ok=True)
 
-            if valid(outfile):
-                print(f'Skip "{outfile}"', end='')
-            else:
-                print(f'Creating "{outfile}" ...', end='')
-                save(outfile, mkdf(site, cycle, test))
+    latest_cycle = uc.gfs.latest_cycle(lag=lag)
+    cycles       = [uc.gfs.relative_cycle(latest_cycle, hr_ago) for hr_ago in range(0, 48+1, 6)]
+    outfiles     = {(s, c): path.join(dirs[s], c.strftime(dt_fmt)+'.tsv')
+                    for s in stencil_sites for c in cycles}
+
+    # Plan all missing hours at once, so stencil points sharing a
+    # grid cell share their downloads
+    hrs  = range(2) if test else forecast_hrs
+    todo = {p: gaps(f, hrs) for p, f in outfiles.items()}
+    todo = {p: t for p, t in todo.items() if t}
+    dfs  = plandfs(list(todo), test, jobs=jobs, rate=rate, procs=procs, cache=cache,
+                   columns_only=columns_only, emulator=emulator, hrs=todo) if todo else {}
+
+    for site in stencil_sites:
+        print("site is:",site)
+        for hr_ago, cycle in zip(range(0, 48+1, 6), cycles):
+            outfile = outfiles[site, cycle]
+
+            if (site, cycle) in dfs:
+                df = dfs[site, cycle]
+                if len(todo[site, cycle]) < len(hrs):
+                    print(f'Filling {len(todo[site, cycle])} hours of "{outfile}" ...', end='')
+                    df = fill(outfile, df)
+                else:
+                    print(f'Creating "{outfile}" ...', end='')
+                save_table(outfile, cycle, df)
                 print(" DONE", end='')
+            else:
+                print(f'Skip "{outfile}"', end='')
 
             if no_link:
                 print()
             else:
-                target = path.join(link,
+                target = path.join(link if site == main_site else path.join(link, site.name),
                     "latest.tsv" if hr_ago == 0 else f"latest-{hr_ago:02d}.tsv")
                 print(f'; linked as "{target}"')
                 symlink(outfile, target)
-        
+
+    if metrics:
+        print_metrics(cache, emulator)
 
 @ucast.command()
 @click.argument("site")
@@ -105,7 +214,16 @@ def mkgrid(lag, site, data, link, no_link, test,stencil_size,all_directions,dire
 @click.option("--link",    default=None,  help="Directory with latest links.")
 @click.option("--no-link", default=False, help="Disable latest links.",               is_flag=True)
 @click.option("--test",    default=False, help="Pull two forecasts for fast testing", is_flag=True)
-def mktab(lag, site, data, link, no_link, test):
+@click.option("--jobs",    default=MAX_IN_FLIGHT, help="Maximum number of concurrent downloads.")
+@click.option("--rate",    default=RATE,          help="Maximum download rate in requests per second.")
+@click.option("--procs",   default=None, type=int, help="Maximum number of concurrent `am` processes.")
+@click.option("--columns-only", default=False, help="Only integrate water and ozone columns; skip `am`.", is_flag=True)
+@click.option("--emulator", default=None,  help="Emulator file from `ucast emulate`; `am` solves only what it cannot.")
+@click.option("--metrics", default=False, help="Print download metrics when done.",   is_flag=True)
+@click.option("--cache",   default=None,  help="GRIB cache directory.", envvar="UCAST_CACHE")
+@click.option("--cache-size", default=MAX_SIZE//1024**2, help="Size cap of the GRIB cache in MiB.")
+@click.option("--archive", default=None,  help="Also add the tables to this site archive; see `ucast compact`.")
+def mktab(lag, site, data, link, no_link, test, jobs, rate, procs, columns_only, emulator, metrics, cache, cache_size, archive):
     """Pull weather for telescope SITE, process with `am`, and make tables """
 
     if no_link and link is not None:
@@ -118,18 +236,36 @@ def mktab(lag, site, data, link, no_link, test):
     if link is None:
         link = data
 
+    cache    = open_cache(cache, cache_size)
+    emulator = open_emulator(emulator)
+    archive  = None if archive is None else Archive(archive)
+
     site         = getattr(uc.site, site)
+    hrs          = range(2) if test else forecast_hrs
     latest_cycle = uc.gfs.latest_cycle(lag=lag)
 
     for hr_ago in range(0, 48+1, 6):
         cycle   = uc.gfs.relative_cycle(latest_cycle, hr_ago)
         outfile = path.join(data, cycle.strftime(dt_fmt)+'.tsv')
 
-        if valid(outfile):
+        todo = gaps(outfile, hrs)
+        if not todo:
             print(f'Skip "{outfile}"', end='')
         else:
-            print(f'Creating "{outfile}" ...', end='')
-            save(outfile, mkdf(site, cycle, test))
+            # Checkpoint solved hours so an interrupted run can resume
+            part = outfile + '.part'
+            if len(todo) < len(hrs):
+                print(f'Filling {len(todo)} hours of "{outfile}" ...', end='')
+            else:
+                print(f'Creating "{outfile}" ...', end='')
+            df = mkdf(site, cycle, test, jobs=jobs, rate=rate, procs=procs, cache=cache, hrs=todo,
+                      columns_only=columns_only, emulator=emulator, part=part)
+            df = df if len(todo) == len(hrs) else fill(outfile, df)
+            save_table(outfile, cycle, df)
+            if archive is not None:
+                archive.add(cycle, df)
+            if path.isfile(part):
+                remove(part)
             print(" DONE", end='')
 
         if no_link:
@@ -140,6 +276,145 @@ def mktab(lag, site, data, link, no_link, test):
             print(f'; linked as "{target}"')
             symlink(outfile, target)
 
+    if metrics:
+        print_metrics(cache, emulator)
+
+
+@ucast.command()
+@click.argument("sites", nargs=-1, required=True)
+@click.option("--lag",     default=5.25,  help="Lag hour for weather forecast.")
+@click.option("--data",    default=None,  help="Data archive directory containing one directory per site.")
+@click.option("--link",    default=None,  help="Directory containing one directory of latest links per site.")
+@click.option("--no-link", default=False, help="Disable latest links.",               is_flag=True)
+@click.option("--test",    default=False, help="Pull two forecasts for fast testing", is_flag=True)
+@click.option("--jobs",    default=MAX_IN_FLIGHT, help="Maximum number of concurrent downloads.")
+@click.option("--rate",    default=RATE,          help="Maximum download rate in requests per second.")
+@click.option("--procs",   default=None, type=int, help="Maximum number of concurrent `am` processes.")
+@click.option("--metrics", default=False, help="Print download metrics when done.",   is_flag=True)
+@click.option("--cache",   default=None,  help="GRIB cache directory.", envvar="UCAST_CACHE")
+@click.option("--cache-size", default=MAX_SIZE//1024**2, help="Size cap of the GRIB cache in MiB.")
+@click.option("--bulk",    default=False, help="Read full pgrb2 files by byte ranges instead of subsets.", is_flag=True)
+@click.option("--mirror",  default=None,  help="Local mirror of the full pgrb2 files; implies --bulk.")
+def mkall(lag, sites, data, link, no_link, test, jobs, rate, procs, metrics, cache, cache_size, bulk, mirror):
+    """Pull weather for all telescope SITES with shared requests, and make tables"""
+
+    if no_link and link is not None:
+        raise click.UsageError(
+            '"--link" should not be specified if "--no-link" is set')
+
+    if data is None:
+        data = '.'
+
+    if link is None:
+        link = data
+
+    cache = open_cache(cache, cache_size)
+
+    sites        = [getattr(uc.site, s) for s in sites]
+    hrs          = range(2) if test else forecast_hrs
+    latest_cycle = uc.gfs.latest_cycle(lag=lag)
+
+    for s in sites:
+        makedirs(path.join(data, s.name), exist_ok=True)
+        if not no_link:
+            makedirs(path.join(link, s.name), exist_ok=True)
+
+    for hr_ago in range(0, 48+1, 6):
+        cycle    = uc.gfs.relative_cycle(latest_cycle, hr_ago)
+        outfiles = {s: path.join(data, s.name, cycle.strftime(dt_fmt)+'.tsv') for s in sites}
+
+        # Only pull the hours missing from any of the tables
+        todo = {s: gaps(outfiles[s], hrs) for s in sites}
+        todo = {s: t for s, t in todo.items() if t}
+        for s in sites:
+            if s not in todo:
+                print(f'Skip "{outfiles[s]}"')
+        if todo:
+            need = sorted(set().union(*todo.values()))
+            print(f'Creating {len(todo)} tables for {cycle.strftime(dt_fmt)} ({len(need)} hours) ...')
+            dfs = mkdfs(list(todo), cycle, test, jobs=jobs, rate=rate, procs=procs, cache=cache,
+                        hrs=need, bulk=bulk, mirror=mirror)
+            for s, df in zip(todo, dfs):
+                df = df if len(todo[s]) == len(hrs) else fill(outfiles[s], df)
+                save_table(outfiles[s], cycle, df)
+
+        if not no_link:
+            name = "latest.tsv" if hr_ago == 0 else f"latest-{hr_ago:02d}.tsv"
+            for s in sites:
+                target = path.join(link, s.name, name)
+                print(f'"{outfiles[s]}" linked as "{target}"')
+                symlink(outfiles[s], target)
+
+    if metrics:
+        print_metrics(cache)
+
+
+@ucast.command()
+@click.argument("site")
+@click.option("--data",    default=None,  help="Data archive directory.")
+@click.option("--link",    default=None,  help="Directory with latest links.")
+@click.option("--no-link", default=False, help="Disable latest links.",               is_flag=True)
+@click.option("--test",    default=False, help="Pull two forecasts for fast testing", is_flag=True)
+@click.option("--once",    default=False, help="Exit after processing one cycle.",    is_flag=True)
+@click.option("--poll",    default=uc.gfs.watch.POLL_DELAY, help="Delay between NOMADS probes in seconds.")
+@click.option("--jobs",    default=MAX_IN_FLIGHT, help="Maximum number of concurrent downloads.")
+@click.option("--rate",    default=RATE,          help="Maximum download rate in requests per second.")
+@click.option("--procs",   default=None, type=int, help="Maximum number of concurrent `am` processes.")
+@click.option("--cache",   default=None,  help="GRIB cache directory.", envvar="UCAST_CACHE")
+@click.option("--cache-size", default=MAX_SIZE//1024**2, help="Size cap of the GRIB cache in MiB.")
+def watch(site, data, link, no_link, test, once, poll, jobs, rate, procs, cache, cache_size):
+    """Process weather for SITE as soon as GFS forecast hours are published"""
+
+    if no_link and link is not None:
+        raise click.UsageError(
+            '"--link" should not be specified if "--no-link" is set')
+
+    if data is None:
+        data = site if path.isdir(site) else '.'
+
+    if link is None:
+        link = data
+
+    cache = open_cache(cache, cache_size)
+
+    site  = getattr(uc.site, site)
+    hrs   = range(2) if test else forecast_hrs
+    cycle = uc.gfs.latest_cycle(lag=0)
+
+    def relink(cycle):
+        for hr_ago in range(0, 48+1, 6):
+            prev   = path.join(data, uc.gfs.relative_cycle(cycle, hr_ago).strftime(dt_fmt)+'.tsv')
+            target = path.join(link,
+                "latest.tsv" if hr_ago == 0 else f"latest-{hr_ago:02d}.tsv")
+            if path.isfile(prev):
+                print(f'"{prev}" linked as "{target}"')
+                symlink(prev, target)
+
+    while True:
+        outfile = path.join(data, cycle.strftime(dt_fmt)+'.tsv')
+
+        # Resume from the manifest of a partial table, e.g., after a restart
+        todo = gaps(outfile, hrs)
+        if not todo:
+            print(f'Skip "{outfile}"')
+        else:
+            print(f'Watching cycle {cycle.strftime(dt_fmt)} ...')
+            for batch in uc.gfs.published(cycle, todo, poll=poll):
+                print(f'Processing {len(batch)} published hours from f{batch[0]:03d} to f{batch[-1]:03d}')
+                new = mkdf(site, cycle, test, jobs=jobs, rate=rate, procs=procs, cache=cache, hrs=batch)
+                df  = fill(outfile, new) if path.isfile(outfile) else new
+
+                # Save and link as each batch of hours is solved, so
+                # the latest forecast is served without waiting for
+                # the whole cycle
+                save_table(outfile, cycle, df)
+                if not no_link:
+                    relink(cycle)
+
+        if once:
+            break
+        cycle += timedelta(hours=6)
+
 
 @ucast.command()
 @click.argument("site")
@@ -182,11 +457,163 @@ def link(lag, no_lag, site, data, link):
             print(f'"{outfile}" is missing; skipped')
 
 
+@ucast.command()
+@click.argument("site")
+@click.option("--data",    default=None,  help="Data archive directory.")
+@click.option("--link",    default=None,  help="Directory with latest links.")
+@click.option("--archive", default=None,  help=f"Site archive; default DATA/{ARCHIVE}.")
+@click.option("--prune",   default=False, help="Remove the folded tables, except the linked ones.", is_flag=True)
+def compact(site, data, link, archive, prune):
+    """Fold the tables of SITE into its forecast archive"""
+
+    if data is None:
+        data = site if path.isdir(site) else '.'
+
+    if link is None:
+        link = data
+
+    if archive is None:
+        archive = path.join(data, ARCHIVE)
+
+    archive = Archive(archive)
+    linked  = {path.realpath(p) for p in glob(path.join(link, 'latest*.tsv'))}
+    tables  = sorted(glob(path.join(data, '????-??-??_??.??.??.tsv')))
+
+    n = 0
+    for f in tables:
+        cycle = datetime.strptime(path.splitext(path.basename(f))[0], dt_fmt)
+        n    += archive.add(cycle, read(f))
+        if prune and path.realpath(f) not in linked:
+            stem = path.splitext(f)[0]
+            for g in [f] + [stem + ext for ext in ('.npy', '.done', '.jac.npz')]:
+                if path.isfile(g):
+                    remove(g)
+
+    print(f'Folded {len(tables)} tables ({n} rows) into "{archive.path}"')
+
+
+@ucast.command()
+@click.argument("archive")
+@click.option("--valid", default=None, nargs=2, help="Valid time range, e.g. 2021-01-01 2021-01-08.")
+@click.option("--cycle", default=None, nargs=2, help="Issue cycle range.")
+@click.option("--lead",  default=None, type=int, help="Lead time in hours.")
+@click.option("--out",   default=None, help="Output table; default standard output.")
+def query(archive, valid, cycle, lead, out):
+    """Query forecasts by valid time, issue cycle, and lead time from ARCHIVE"""
+
+    def span(r):
+        return None if not r else tuple(pd.Timestamp(t).to_pydatetime() for t in r)
+
+    df = Archive(archive).query(valid=span(valid), cycle=span(cycle), lead=lead)
+    for k in ('cycle', 'date'):
+        df[k] = df[k].dt.strftime(dt_fmt)
+    df.to_csv(out if out is not None else sys.stdout, index=False, sep='\t')
+
+
+@ucast.command()
+@click.option("--procs",   default=None,   help="Comma-separated process counts to try, e.g. 1,2,4; default 1 if --threads is set.")
+@click.option("--threads", default=None,   help="Comma-separated OpenMP thread counts to try; default 1 if --procs is set.")
+@click.option("--solves",  default=SOLVES, help="Number of `am` solves per benchmark.")
+@click.option("--config",  default=CONFIG, help="File to store the best setting; see UCAST_AM_CONFIG.")
+@click.option("--dry-run", default=False,  help="Only report; do not store the setting.", is_flag=True)
+def calibrate(procs, threads, solves, config, dry_run):
+    """Benchmark `am` processes vs OpenMP threads and store the best setting"""
+
+    try:
+        ps = [1] if procs   is None else [int(p) for p in procs.split(',')]
+        ts = [1] if threads is None else [int(t) for t in threads.split(',')]
+    except ValueError:
+        raise click.UsageError('"--procs" and "--threads" should be comma-separated integers')
+
+    if procs is None and threads is None:
+        combos = combinations()
+    else:
+        combos = [(p, t) for p in ps for t in ts]
+
+    def report(p, t, rate):
+        print(f'{p:4d} procs x {t:3d} threads: {rate:8.2f} solves/s')
+
+    am = uc.am.AM(procs=1, threads=1)
+    best, _ = calibrate_am(am, combos, n=solves, report=report)
+    print(f'Best: {best["procs"]} procs x {best["threads"]} threads ({best["rate"]:.2f} solves/s)')
+
+    if not dry_run:
+        save_setting(best, config)
+        print(f'Saved to "{config}"')
+
+
+@ucast.command()
+@click.argument("sites", nargs=-1, required=True)
+@click.option("--lag",     default=5.25,    help="Lag hour for weather forecast.")
+@click.option("--cycles",  default=4,       help="Number of latest cycles to train on.")
+@click.option("--degree",  default=DEGREE,  help="Degree of the polynomials.")
+@click.option("--holdout", default=HOLDOUT, help="Fraction of profiles held out to estimate the error.")
+@click.option("--out",     default="emulator.npz", help="File to store the emulator.")
+@click.option("--test",    default=False, help="Pull two forecasts per cycle for fast testing", is_flag=True)
+@click.option("--jobs",    default=MAX_IN_FLIGHT, help="Maximum number of concurrent downloads.")
+@click.option("--rate",    default=RATE,          help="Maximum download rate in requests per second.")
+@click.option("--cache",   default=None,  help="GRIB cache directory.", envvar="UCAST_CACHE")
+@click.option("--cache-size", default=MAX_SIZE//1024**2, help="Size cap of the GRIB cache in MiB.")
+def emulate(sites, lag, cycles, degree, holdout, out, test, jobs, rate, cache, cache_size):
+    """Train an emulator of `am` on forecasts for SITES"""
+
+    cache  = open_cache(cache, cache_size)
+    sites  = [getattr(uc.site, s) for s in sites]
+    latest = uc.gfs.latest_cycle(lag=lag)
+    pairs  = [(s, uc.gfs.relative_cycle(latest, 6*k)) for s in sites for k in range(cycles)]
+
+    gfss = plan_profiles(pairs, test, jobs=jobs, rate=rate, cache=cache)
+    try:
+        emulator = uc.am.Emulator.train(am, gfss, degree=degree, holdout=holdout)
+    except ValueError as e:
+        raise click.ClickException(str(e))
+    emulator.save(out)
+
+    print(f'Trained on {len(gfss)} profiles; error bound: ' +
+          ', '.join(f'{k} {v:.3g}' for k, v in emulator.error.items()))
+    print(f'Saved to "{out}"')
+
+
+@ucast.command()
+@click.option("--host",      default="127.0.0.1", help="Host to bind.")
+@click.option("--port",      default=8080,  help="Port to listen on.")
+@click.option("--latency",   default=0.0,   help="Delay of each response in seconds.")
+@click.option("--jitter",    default=0.0,   help="Maximum random extra delay in seconds.")
+@click.option("--error",     default=None,  help="Inject errors, e.g. 503:0.05 for 5% of responses.", multiple=True)
+@click.option("--bandwidth", default=0.0,   help="Throttle responses to this many bytes per second.")
+@click.option("--fixtures",  default=None,  help="GRIB cache directory with recorded responses.")
+@click.option("--strict",    default=False, help="Return 404 instead of synthesizing missing fixtures.", is_flag=True)
+@click.option("--seed",      default=None,  help="Random seed for jitter and errors.", type=int)
+def serve(host, port, latency, jitter, error, bandwidth, fixtures, strict, seed):
+    """Run a local stand-in for NOMADS for offline runs and benchmarks"""
+
+    from ucast.weather.gfs.standin import StandIn
+
+    try:
+        errors = {int(c): float(p) for c, p in (e.split(':') for e in error)}
+    except ValueError:
+        raise click.UsageError('"--error" should be formatted as CODE:PROBABILITY')
+
+    server = StandIn((host, port), latency=latency, jitter=jitter, errors=errors,
+                     bandwidth=bandwidth or None,
+                     fixtures=None if fixtures is None else GribCache(fixtures),
+                     synthesize=not strict, seed=seed, verbose=True)
+
+    print(f'Serving NOMADS stand-in at {server.url}; use it with')
+    print(f'    export UCAST_NOMADS_URL={server.url}')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
 @ucast.command()
 @click.argument("site")
 @click.option("--link", default=None, help="Directory with latest links.")
 @click.option("--out",  default=None, help="File name of the plot.")
-def psite(site, link, out):
+@click.option("--table-cache", default=TABLE_CACHE, help="Directory to keep parsed tables between runs; empty to disable.", envvar="UCAST_TABLE_CACHE")
+@click.option("--no-table-cache", default=False, help="Do not keep parsed tables between runs.", is_flag=True)
+def psite(site, link, out, table_cache, no_table_cache):
     """Read weather tables from SITE and create summary plot for one site"""
 
     if link is None:
@@ -201,11 +628,8 @@ def psite(site, link, out):
     latest_fname = path.basename(path.realpath(path.join(link, "latest.tsv")))
     latest_cycle = datetime.strptime(path.splitext(latest_fname)[0], dt_fmt)
 
-    dfs = []
-    for hr_ago in range(0, 48+1, 6):
-        target = path.join(link,
-            "latest.tsv" if hr_ago == 0 else f"latest-{hr_ago:02d}.tsv")
-        dfs.append(read(target))
+    dfs = open_loader(table_cache, no_table_cache).read_many([path.join(link,
+        "latest.tsv" if hr_ago == 0 else f"latest-{hr_ago:02d}.tsv") for hr_ago in range(0, 48+1, 6)])
 
     title = f'{site.name} ({site.lat},{site.lon},{site.alt}) forecasted from {latest_cycle}'
     plot_site(dfs, title, fname=out, color='k')
@@ -216,7 +640,9 @@ def psite(site, link, out):
 @click.option("--link", default=None, help="Directory with latest links.")
 @click.option("--set",  default=None, help="Input dataset, e.g. latest, latest-06, ...")
 @click.option("--out",  default=None, help="File name of the plot.")
-def pall(sites, link, set, out):
+@click.option("--table-cache", default=TABLE_CACHE, help="Directory to keep parsed tables between runs; empty to disable.", envvar="UCAST_TABLE_CACHE")
+@click.option("--no-table-cache", default=False, help="Do not keep parsed tables between runs.", is_flag=True)
+def pall(sites, link, set, out, table_cache, no_table_cache):
     """Read weather tables from SITES and create summary plot for all sites"""
 
     if link is None:
@@ -242,7 +668,7 @@ def pall(sites, link, set, out):
     title = f'Full array forecasted from {latest_cycle}'
 
     sites = regroup(sites)
-    dfs   = [read(f'{s}/{set}.tsv') for s in sites]
+    dfs   = open_loader(table_cache, no_table_cache).read_many([f'{s}/{set}.tsv' for s in sites])
     sites = list(sites.values())
     plot_all(dfs, sites, title, fname=out)
 
@@ -254,7 +680,9 @@ def pall(sites, link, set, out):
 @click.option("--out",  default=None, help="File name of the plot.")
 @click.option('--browser/--no-browser',
                         default=True, help="Open visualization in a browser.")
-def vis(sites, link, set, out, browser):
+@click.option("--table-cache", default=TABLE_CACHE, help="Directory to keep parsed tables between runs; empty to disable.", envvar="UCAST_TABLE_CACHE")
+@click.option("--no-table-cache", default=False, help="Do not keep parsed tables between runs.", is_flag=True)
+def vis(sites, link, set, out, browser, table_cache, no_table_cache):
     """ Creates a bokeh html file containing forecast of all sites."""
 
     if link is None:
@@ -276,7 +704,7 @@ def vis(sites, link, set, out, browser):
             return 0
 
     sites = regroup(sites)
-    dfs   = [read(f'{s}/{set}.tsv') for s in sites]
+    dfs   = open_loader(table_cache, no_table_cache).read_many([f'{s}/{set}.tsv' for s in sites])
     sites = list(sites.values())
     static_vis(dfs, sites, fname=out, browser=browser)
 
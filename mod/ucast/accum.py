@@ -0,0 +1,170 @@
+# Copyright (C) 2021 Chi-kwan Chan
+# Copyright (C) 2021 Steward Observatory
+#
+# This file is part of `ucast`.
+#
+# `Ucast` is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# `Ucast` is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with `ucast`.  If not, see <http://www.gnu.org/licenses/>.
+
+import json
+
+from os       import path, rename
+from datetime import timedelta
+
+import numpy  as np
+import pandas as pd
+
+from .io import dt_fmt
+
+
+def pack_jacobians(jacs):
+    """Pack (date, sol["jacobian"]) pairs into df.attrs["jacobians"]
+    format: the dates and, for each quantity and variable, an array of
+    derivatives with shape (row, layer), padded with NaN."""
+    nlayer = max(len(l) for _, j in jacs for l in j['tau'].values())
+
+    def pad(l):
+        return [np.nan if v is None else v for v in l] + [np.nan] * (nlayer - len(l))
+
+    return {
+        'date': [d for d, _ in jacs],
+        **{q: {v: np.array([pad(j[q][v]) for _, j in jacs]) for v in jacs[0][1][q]}
+           for q in jacs[0][1]},
+    }
+
+
+def unpack_jacobians(jac):
+    """Inverse of `pack_jacobians()`."""
+    return [(d, {q: {v: list(a[i]) for v, a in jac[q].items()} for q in jac if q != 'date'})
+            for i, d in enumerate(jac['date'])]
+
+
+class Accumulator:
+    """Preallocated table for the forecast hours of one cycle.
+
+    Solutions are stored in a NumPy buffer allocated once for all
+    hours, so adding a row costs O(1) instead of copying the table.
+    With a `part` file, each row is also appended to it as soon as it
+    is added; a new accumulator on the same `part` file resumes from
+    the rows stored there, so an interrupted run only needs to solve
+    the hours in `todo`.  `am` Jacobians are checkpointed as a JSON
+    field after the values of their row.  Rows checkpointed with other
+    columns or another solver `mode` are not resumed.
+
+    Args:
+        cycle: Forecast cycle.
+        hrs: Forecast hours of the table.
+        columns: Table columns, starting with "date".
+        part: Optional partial file to checkpoint to and resume from.
+        mode: Tag of the solver, e.g., with the `am` version.
+
+    """
+    def __init__(self, cycle, hrs, columns, part=None, mode=''):
+        self.cycle   = cycle
+        self.hrs     = list(hrs)
+        self.columns = list(columns)
+        self.index   = {hr: i for i, hr in enumerate(self.hrs)}
+        self.values  = np.full((len(self.hrs), len(self.columns) - 1), np.nan)
+        self.done    = np.zeros(len(self.hrs), dtype=bool)
+        self.jacs    = {}
+        self.part    = part
+        self.mode    = mode
+        self.file    = None
+
+        if part is not None:
+            self.resume()
+
+    @property
+    def heading(self):
+        return f'# {self.mode}\n' + '\t'.join(['hr'] + self.columns[1:]) + '\n'
+
+    def resume(self):
+        """Load the rows checkpointed in `part`, if it matches."""
+        if not path.isfile(self.part):
+            return
+        with open(self.part) as f:
+            if f.readline() + f.readline() != self.heading:
+                return # different columns or solver; start over
+            n = len(self.columns)
+            for l in f:
+                v = l.split('\t')
+                if len(v) not in (n, n+1) or not l.endswith('\n'):
+                    break # interrupted while writing the last row
+                hr = int(v[0])
+                if hr in self.index:
+                    self.values[self.index[hr]] = [float(x) for x in v[1:n]]
+                    self.done  [self.index[hr]] = True
+                    if len(v) > n:
+                        self.jacs[hr] = json.loads(v[n])
+
+    @property
+    def resumed(self):
+        return int(self.done.sum())
+
+    @property
+    def todo(self):
+        """Forecast hours not solved yet."""
+        return [hr for hr, d in zip(self.hrs, self.done) if not d]
+
+    def add(self, hr, sol):
+        i = self.index[hr]
+        self.values[i] = [sol.get(c, np.nan) for c in self.columns[1:]]
+        self.done  [i] = True
+        if 'jacobian' in sol:
+            self.jacs[hr] = sol['jacobian']
+
+        if self.part is not None:
+            if self.file is None:
+                self.start(skip=hr)
+            self.file.write(self.row(hr, self.values[i]))
+            self.file.flush()
+
+    def start(self, skip=None):
+        """Rewrite `part` with the rows solved so far, dropping any
+        truncated row, and keep it open for appending."""
+        tmp = self.part + '.tmp'
+        with open(tmp, 'w') as f:
+            f.write(self.heading)
+            for h, v, d in zip(self.hrs, self.values, self.done):
+                if d and h != skip:
+                    f.write(self.row(h, v))
+        rename(tmp, self.part)
+        self.file = open(self.part, 'a')
+
+    def row(self, hr, v):
+        jac = [json.dumps(self.jacs[hr])] if hr in self.jacs else []
+        return '\t'.join([str(hr)] + [repr(float(x)) for x in v] + jac) + '\n'
+
+    def table(self):
+        """The solved rows as a table, sorted by forecast hour."""
+        hrs  = [hr for hr, d in zip(self.hrs, self.done) if d]
+        date = lambda hr: (self.cycle + timedelta(hours=hr)).strftime(dt_fmt)
+
+        df = pd.DataFrame(self.values[self.done], columns=self.columns[1:])
+        df.insert(0, 'date', [date(hr) for hr in hrs])
+
+        jacs = [(date(hr), self.jacs[hr]) for hr in hrs if hr in self.jacs]
+        if jacs:
+            df.attrs['jacobians'] = pack_jacobians(jacs)
+        return df
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
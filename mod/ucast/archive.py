@@ -0,0 +1,135 @@
+# Copyright (C) 2021 Chi-kwan Chan
+# Copyright (C) 2021 Steward Observatory
+#
+# This file is part of `ucast`.
+#
+# `Ucast` is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# `Ucast` is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with `ucast`.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import re
+import sqlite3
+
+from threading import Lock
+from datetime  import datetime
+
+import numpy  as np
+import pandas as pd
+
+from .io import dt_fmt
+
+NAME = "archive.sqlite"  # Default file name in a site directory
+
+def epoch(t):
+    """Seconds since the epoch of datetime(s) or `dt_fmt` string(s)."""
+    if not isinstance(t, (datetime, np.datetime64)) and not pd.api.types.is_datetime64_any_dtype(t):
+        t = pd.to_datetime(t, format=dt_fmt)
+    return np.asarray(t, dtype='datetime64[s]').astype(np.int64)
+
+class Archive:
+    """Per-site forecast archive in an SQLite database.
+
+    Each row of each table is stored once under its issue cycle and
+    valid time, with the lead time in hours, so years of forecasts
+    live in one file instead of one table file per cycle.  Indices on
+    valid time and on (lead, cycle) make range queries such as "all
+    forecasts valid between t0 and t1" or "all 24-hour forecasts
+    issued this month" fast.  Adding a cycle again replaces its rows,
+    e.g., after filling the gaps of its table.
+
+    """
+    def __init__(self, path):
+        d = os.path.dirname(os.path.abspath(path))
+        os.makedirs(d, exist_ok=True)
+
+        self.path = path
+        self.lock = Lock()
+        self.db   = sqlite3.connect(path, timeout=60, check_same_thread=False)
+        with self.lock, self.db:
+            self.db.execute("CREATE TABLE IF NOT EXISTS forecasts "
+                            "(cycle INTEGER, valid INTEGER, lead INTEGER, "
+                            "PRIMARY KEY (cycle, valid))")
+            self.db.execute("CREATE INDEX IF NOT EXISTS valid ON forecasts (valid)")
+            self.db.execute("CREATE INDEX IF NOT EXISTS lead  ON forecasts (lead, cycle)")
+            self.columns = [r[1] for r in self.db.execute("PRAGMA table_info(forecasts)")][3:]
+
+    def add(self, cycle, df):
+        """Add the table `df` of `cycle`; returns the number of rows."""
+        cols = [k for k in df.columns if k != 'date']
+        for k in cols:
+            if not re.match(r'^[A-Za-z_][A-Za-z0-9_.]*$', k):
+                raise ValueError(f'Invalid column name "{k}"')
+
+        c    = int(epoch(cycle))
+        rows = [(c, int(v), int(v - c) // 3600, *[None if np.isnan(x) else float(x) for x in r])
+                for v, r in zip(epoch(df.date), df[cols].to_numpy(dtype=float))]
+
+        with self.lock, self.db:
+            for k in cols:
+                if k not in self.columns: # e.g., extra `am` bands
+                    self.db.execute(f'ALTER TABLE forecasts ADD COLUMN "{k}" REAL')
+                    self.columns.append(k)
+            self.db.execute("DELETE FROM forecasts WHERE cycle = ?", (c,))
+            names = ', '.join(f'"{k}"' for k in ['cycle', 'valid', 'lead'] + cols)
+            marks = ', '.join('?' * (3 + len(cols)))
+            self.db.executemany(f"INSERT INTO forecasts ({names}) VALUES ({marks})", rows)
+        return len(rows)
+
+    def query(self, valid=None, cycle=None, lead=None):
+        """Forecasts with valid times and issue cycles within the
+        (start, stop) ranges `valid` and `cycle`, inclusively, and lead
+        hours in `lead`, which is an int, a (min, max) range, or None
+        for all leads.
+
+        Returns:
+            A table with "cycle" and "date" (the valid time) columns,
+            "lead" in hours, and the forecast columns; sorted by cycle
+            and valid time.
+
+        """
+        where, args = [], []
+        for k, r in (('valid', valid), ('cycle', cycle)):
+            if r is not None:
+                where.append(f"{k} BETWEEN ? AND ?")
+                args += [int(epoch(r[0])), int(epoch(r[1]))]
+        if isinstance(lead, int):
+            where.append("lead = ?")
+            args.append(lead)
+        elif lead is not None:
+            where.append("lead BETWEEN ? AND ?")
+            args += list(lead)
+
+        sql = "SELECT * FROM forecasts"
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        sql += " ORDER BY cycle, valid"
+
+        with self.lock:
+            cur  = self.db.execute(sql, args)
+            rows = cur.fetchall()
+            cols = [d[0] for d in cur.description]
+
+        df = pd.DataFrame(rows, columns=cols).rename(columns={'valid':'date'})
+        for k in ('cycle', 'date'):
+            df[k] = df[k].to_numpy(dtype=np.int64).astype('datetime64[s]')
+        df[cols[3:]] = df[cols[3:]].astype(float)
+        return df
+
+    def cycles(self):
+        with self.lock:
+            rows = self.db.execute("SELECT DISTINCT cycle FROM forecasts ORDER BY cycle").fetchall()
+        return list(pd.to_datetime([r[0] for r in rows], unit='s').to_pydatetime())
+
+    def close(self):
+        with self.lock:
+            self.db.close()
@@ -0,0 +1,227 @@
+# Copyright (C) 2020 Chi-kwan Chan
+# Copyright (C) 2020 Steward Observatory
+#
+# This file is part of `ucast`.
+#
+# `Ucast` is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# `Ucast` is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with `ucast`.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import time
+import json
+import sqlite3
+
+from hashlib      import sha256
+from tempfile     import mkstemp
+from threading    import Lock
+from urllib.parse import urlsplit, parse_qsl, urlencode
+
+MAX_SIZE = 1024**3  # Default size cap of the cache in bytes
+SUFFIX   = '.grb2'
+
+MAX_SOLUTIONS = 1000000  # Default number of `am` solutions to keep
+
+def normalize(url):
+    """Normalize a data URL so equivalent requests share a cache key.
+
+    The scheme and host are dropped so mirrors of the NOMADS CGI share
+    entries, and the query parameters (cycle, product, grid,
+    subregion, variables, and levels) are sorted.  A "#bytes=a-b"
+    fragment of a byte-range request is kept.
+
+    """
+    u = urlsplit(url)
+    q = sorted(parse_qsl(u.query, keep_blank_values=True))
+    k = '?'.join([u.path, urlencode(q)])
+    return f'{k}#{u.fragment}' if u.fragment else k
+
+def touch(path):
+    # File systems stamp files with a coarse clock; set the time
+    # explicitly so the LRU order is resolved within a run
+    t = time.time()
+    os.utime(path, (t, t))
+
+class GribCache:
+    """Content-addressed on-disk cache of raw GRIB payloads.
+
+    Entries are stored under `root` in files named by the SHA-256 hash
+    of the normalized data URL.  Writes go to a temporary file that is
+    atomically renamed into place, so multiple processes (e.g., cron
+    jobs) can share the same directory.  The access time of an entry
+    is tracked by its modification time, which is used to evict the
+    least recently used entries once the cache grows beyond
+    `maxsize` bytes.
+
+    """
+    def __init__(self, root, maxsize=MAX_SIZE):
+        os.makedirs(root, exist_ok=True)
+
+        self.root    = root
+        self.maxsize = maxsize
+        self.hits    = 0
+        self.misses  = 0
+        self.lock    = Lock()
+        self.size    = sum(s for _, s, _ in self.entries())
+
+    def path(self, url):
+        h = sha256(normalize(url).encode()).hexdigest()
+        return os.path.join(self.root, h[:2], h + SUFFIX)
+
+    def entries(self):
+        """Iterate over (path, size, mtime) of all cache entries."""
+        for d in os.scandir(self.root):
+            if not d.is_dir():
+                continue
+            for e in os.scandir(d.path):
+                if not e.name.endswith(SUFFIX):
+                    continue
+                try:
+                    s = e.stat()
+                except FileNotFoundError:
+                    continue # removed by another process
+                yield e.path, s.st_size, s.st_mtime
+
+    def get(self, url):
+        """Return the cached content of `url`, or None on a miss."""
+        p = self.path(url)
+        try:
+            with open(p, 'rb') as f:
+                content = f.read()
+            touch(p) # mark as recently used
+        except FileNotFoundError:
+            with self.lock:
+                self.misses += 1
+            return None
+
+        with self.lock:
+            self.hits += 1
+        return content
+
+    def put(self, url, content):
+        """Atomically store `content` of `url` in the cache."""
+        p = self.path(url)
+        d = os.path.dirname(p)
+        os.makedirs(d, exist_ok=True)
+
+        fd, tmp = mkstemp(dir=d, prefix='.tmp-')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(content)
+            touch(tmp)
+            os.replace(tmp, p)
+        except BaseException:
+            os.unlink(tmp)
+            raise
+
+        with self.lock:
+            self.size += len(content)
+            full = self.size > self.maxsize
+        if full:
+            self.evict()
+
+    def evict(self):
+        """Remove the least recently used entries until within `maxsize`."""
+        entries = sorted(self.entries(), key=lambda e: e[2])
+        size    = sum(s for _, s, _ in entries)
+        for p, s, _ in entries:
+            if size <= self.maxsize:
+                break
+            try:
+                os.unlink(p)
+            except FileNotFoundError:
+                pass # evicted by another process
+            size -= s
+
+        with self.lock:
+            self.size = size
+
+    def summary(self):
+        with self.lock:
+            n = self.hits + self.misses
+            return {
+                'hits'  : self.hits,
+                'misses': self.misses,
+                'rate'  : self.hits / n if n else 0.0,
+                'size'  : self.size,
+            }
+
+
+class SolutionCache:
+    """Persistent memoization of `am` solutions in an SQLite database.
+
+    `am` is deterministic given its configuration text and version, so
+    solutions are stored under the SHA-256 hash of both.  Each lookup
+    updates the access time of the entry, which is used to evict the
+    least recently used entries once there are more than `maxsize`.
+    SQLite handles locking, so multiple processes can share the file.
+
+    """
+    def __init__(self, path, maxsize=MAX_SOLUTIONS):
+        d = os.path.dirname(os.path.abspath(path))
+        os.makedirs(d, exist_ok=True)
+
+        self.path    = path
+        self.maxsize = maxsize
+        self.hits    = 0
+        self.misses  = 0
+        self.lock    = Lock()
+        self.db      = sqlite3.connect(path, timeout=60, check_same_thread=False)
+        with self.lock, self.db:
+            self.db.execute("CREATE TABLE IF NOT EXISTS solutions "
+                            "(key TEXT PRIMARY KEY, sol TEXT, atime REAL)")
+            self.db.execute("CREATE INDEX IF NOT EXISTS atime ON solutions (atime)")
+            self.size = self.db.execute("SELECT COUNT(*) FROM solutions").fetchone()[0]
+
+    @staticmethod
+    def key(config, version):
+        return sha256('\0'.join([version, config]).encode()).hexdigest()
+
+    def get(self, config, version):
+        """Return the cached solution of `config`, or None on a miss."""
+        k = self.key(config, version)
+        with self.lock, self.db:
+            row = self.db.execute("SELECT sol FROM solutions WHERE key = ?", (k,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.db.execute("UPDATE solutions SET atime = ? WHERE key = ?", (time.time(), k))
+            self.hits += 1
+        return json.loads(row[0])
+
+    def put(self, config, version, sol):
+        k = self.key(config, version)
+        with self.lock, self.db:
+            n = self.db.execute("INSERT OR REPLACE INTO solutions VALUES (?, ?, ?)",
+                                (k, json.dumps(sol), time.time())).rowcount
+            self.size += n
+            full = self.size > self.maxsize
+        if full:
+            self.evict()
+
+    def evict(self):
+        """Remove the least recently used entries until within `maxsize`."""
+        with self.lock, self.db:
+            self.db.execute("DELETE FROM solutions WHERE key IN "
+                            "(SELECT key FROM solutions ORDER BY atime LIMIT "
+                            "max(0, (SELECT COUNT(*) FROM solutions) - ?))", (self.maxsize,))
+            self.size = self.db.execute("SELECT COUNT(*) FROM solutions").fetchone()[0]
+
+    def summary(self):
+        with self.lock:
+            n = self.hits + self.misses
+            return {
+                'hits'  : self.hits,
+                'misses': self.misses,
+                'rate'  : self.hits / n if n else 0.0,
+                'size'  : self.size,
+            }
@@ -0,0 +1,327 @@
+# Copyright (C) 2020 Chi-kwan Chan
+# Copyright (C) 2020 Steward Observatory
+#
+# This file is part of `ucast`.
+#
+# `Ucast` is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# `Ucast` is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with `ucast`.  If not, see <http://www.gnu.org/licenses/>.
+
+import asyncio
+import time
+import requests
+
+from collections        import deque
+from concurrent.futures import ThreadPoolExecutor
+from queue              import Queue
+from threading          import Thread, Lock
+
+from .request import request, transport, errln
+from .request import CONN_TIMEOUT, READ_TIMEOUT, RETRY_DELAY, NODATA_DELAY
+from .request import MAX_DOWNLOAD_TRIES, RETRYABLE
+
+# Concurrency and rate limits.  NOMADS blocks clients that exceed 120
+# hits per minute, so the sustained rate defaults to 2 requests per
+# second with a small burst allowance.
+MAX_IN_FLIGHT = 8    # Maximum number of concurrent downloads
+RATE          = 2.0  # Sustained request rate [1/s]
+BURST         = 4    # Token bucket capacity
+
+# Retry budget: besides a small reserve, only a fraction of the
+# requests may be retried, so an outage cannot multiply the load on
+# NOMADS by `MAX_DOWNLOAD_TRIES`.
+BUDGET_RATIO   = 0.2  # Retries earned per request
+BUDGET_RESERVE = 10   # Initial (and minimum useful) number of retries
+BUDGET_MAX     = 100  # Maximum number of saved retries
+
+# Circuit breaker: stop sending requests when too many of the recent
+# ones failed, and probe again after a cool-down.
+BREAKER_WINDOW   = 20   # Number of recent attempts to consider
+BREAKER_RATIO    = 0.5  # Failure rate that opens the breaker
+BREAKER_COOLDOWN = RETRY_DELAY # Initial cool-down in seconds; doubles on each trip
+BREAKER_TRIPS    = 5    # Give up after this many consecutive trips
+
+# Outcomes of a single download attempt
+OK, NODATA, RETRY, FAIL = range(4)
+
+class TokenBucket:
+    """Token-bucket rate limiter for asyncio tasks.
+
+    Tokens are refilled continuously at `rate` per second up to
+    `burst`.  Each call to `acquire()` consumes one token, waiting for
+    the bucket to refill if it is empty.
+
+    """
+    def __init__(self, rate=RATE, burst=BURST):
+        if rate <= 0:
+            raise ValueError("Rate must be positive")
+
+        self.rate   = rate
+        self.burst  = max(burst, 1)
+        self.tokens = self.burst
+        self.last   = time.monotonic()
+        self.lock   = None # created lazily inside the running event loop
+
+    def refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.last) * self.rate)
+        self.last   = now
+
+    async def acquire(self):
+        if self.lock is None:
+            self.lock = asyncio.Lock()
+
+        async with self.lock:
+            self.refill()
+            while self.tokens < 1:
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+                self.refill()
+            self.tokens -= 1
+
+class RetryBudget:
+    """Retry budget shared by all downloads of a process.
+
+    Every first attempt deposits `ratio` retries, and every retry
+    withdraws one.  Retries are refused once the budget is spent.
+
+    """
+    def __init__(self, ratio=BUDGET_RATIO, reserve=BUDGET_RESERVE, cap=BUDGET_MAX):
+        self.ratio  = ratio
+        self.cap    = cap
+        self.tokens = reserve
+        self.lock   = Lock()
+
+    def deposit(self):
+        with self.lock:
+            self.tokens = min(self.cap, self.tokens + self.ratio)
+
+    def withdraw(self):
+        with self.lock:
+            if self.tokens < 1:
+                return False
+            self.tokens -= 1
+            return True
+
+class CircuitBreaker:
+    """Circuit breaker that stops requests when the failure rate spikes.
+
+    The breaker is closed while the failure rate of the last `window`
+    attempts stays below `ratio`.  Once it opens, no request is sent
+    until the cool-down ends; then a single probe is let through
+    ("half-open").  A successful probe closes the breaker, and a
+    failed one reopens it with twice the cool-down.  After `trips`
+    consecutive trips the server is considered down: pending downloads
+    fail fast, but a probe is still let through after each maximum
+    cool-down, so the breaker closes again once the server is back.
+
+    """
+    def __init__(self, window=BREAKER_WINDOW, ratio=BREAKER_RATIO,
+                 cooldown=BREAKER_COOLDOWN, trips=BREAKER_TRIPS):
+        self.results  = deque(maxlen=window)
+        self.ratio    = ratio
+        self.cooldown = cooldown
+        self.maxtrips = trips
+        self.trips    = 0
+        self.until    = None  # end of the cool-down if open
+        self.probing  = False
+
+    @property
+    def broken(self):
+        return self.trips >= self.maxtrips
+
+    def trip(self):
+        self.trips  += 1
+        self.until   = time.monotonic() + self.cooldown * 2**(min(self.trips, self.maxtrips)-1)
+        self.probing = False
+        self.results.clear()
+        errln(f"Too many failed downloads; pausing for {self.until - time.monotonic():.0f} s.")
+
+    def success(self):
+        self.results.append(True)
+        self.trips   = 0
+        self.until   = None
+        self.probing = False
+
+    def failure(self):
+        self.results.append(False)
+        if self.probing:
+            self.trip() # failed probe
+        elif self.until is None:
+            n = len(self.results)
+            if n == self.results.maxlen and self.results.count(False) >= self.ratio * n:
+                self.trip()
+
+    async def wait(self):
+        """Wait until a request may be sent."""
+        while True:
+            if self.until is None:
+                return
+            t = self.until - time.monotonic()
+            if t <= 0 and not self.probing:
+                self.probing = True
+                return
+            if self.broken:
+                raise requests.exceptions.RetryError(
+                    "Too many consecutive failures; NOMADS seems to be down")
+            await asyncio.sleep(max(t, 1))
+
+def split(url):
+    """URL and headers of `url`, which may end with a "#bytes=a-b"
+    fragment to request only that byte range."""
+    u, _, r = url.partition('#')
+    return u, ({'Range': r} if r.startswith('bytes=') else None)
+
+def attempt(url, retry=0, ctime=CONN_TIMEOUT, rtime=READ_TIMEOUT):
+    """Make a single, non-blocking download attempt of `url`.
+
+    Returns:
+        Tuple of the outcome (`OK`, `NODATA`, `RETRY`, or `FAIL`) and
+        the content or a message describing the failure.
+
+    """
+    url, headers = split(url)
+    try:
+        r = transport.get(url, retry=retry, timeout=(ctime, rtime), headers=headers)
+    except requests.exceptions.ConnectTimeout:
+        return RETRY, "Connection timed out."
+    except requests.exceptions.ReadTimeout:
+        return RETRY, "Data download timed out."
+    except requests.exceptions.ConnectionError:
+        return RETRY, "Connection failed."
+
+    if r.status_code in {requests.codes.ok, requests.codes.partial_content}:
+        return OK, r.content
+    elif r.status_code == 404:
+        return NODATA, "Data not available (404)."
+    elif r.status_code in RETRYABLE:
+        return RETRY, f"Received retryable status {r.status_code}."
+    else:
+        return FAIL, f"Download failed with status code {r.status_code}."
+
+# Shared by all downloads, so an outage seen by one cycle also holds
+# back the next one
+budget  = RetryBudget()
+breaker = CircuitBreaker()
+
+def download(url, cache=None):
+    """Return the content of `url`, looking it up in `cache` first."""
+    content = None if cache is None else cache.get(url)
+    if content is None:
+        u, headers = split(url)
+        content = request(u, headers=headers).content
+        if cache is not None:
+            cache.put(url, content)
+    return content
+
+async def afetch(urls, put, jobs=MAX_IN_FLIGHT, rate=RATE, burst=BURST, cache=None,
+                 delay=RETRY_DELAY, retry=MAX_DOWNLOAD_TRIES,
+                 budget=budget, breaker=breaker):
+    """Download `urls` concurrently and pass `(i, content)` to `put`.
+
+    At most `jobs` downloads are in flight at any time, and new
+    downloads are started no faster than allowed by a token bucket
+    with `rate` and `burst`.  URLs found in `cache` are served without
+    touching the network or the rate limit.  A URL ending with a
+    "#bytes=a-b" fragment downloads only that byte range.
+
+    A failed attempt does not block: the download is deferred by
+    `delay` seconds (`NODATA_DELAY` after a 404) while the others keep
+    going, and is retried up to `retry` times in total as long as the
+    shared retry `budget` allows and the circuit `breaker` is closed.
+    A download that finally fails passes a `RetryError` instead of
+    the content.
+
+    """
+    loop   = asyncio.get_event_loop()
+    sem    = asyncio.Semaphore(jobs)
+    bucket = TokenBucket(rate, burst)
+
+    with ThreadPoolExecutor(max_workers=jobs) as pool:
+
+        async def one(i, url):
+            try:
+                if cache is not None:
+                    content = await loop.run_in_executor(pool, cache.get, url)
+                    if content is not None:
+                        put((i, content))
+                        return
+
+                budget.deposit()
+                for tries in range(retry):
+                    await breaker.wait()
+                    async with sem:
+                        await bucket.acquire()
+                        outcome, value = await loop.run_in_executor(pool, attempt, url, tries)
+
+                    if outcome == OK:
+                        breaker.success()
+                        if cache is not None:
+                            await loop.run_in_executor(pool, cache.put, url, value)
+                        put((i, value))
+                        return
+
+                    if outcome == NODATA: # the server is up; the hour is just missing
+                        breaker.success()
+                    else:
+                        breaker.failure()
+                    if outcome == FAIL or tries + 1 == retry or not budget.withdraw():
+                        errln(f"{value}  Giving up.")
+                        break
+
+                    errln(f"{value}  Deferring retry...")
+                    await asyncio.sleep(NODATA_DELAY if outcome == NODATA else delay)
+
+                errln(f'Failed URL was: "{url}".')
+                raise requests.exceptions.RetryError(
+                    f'Tried downloading "{url}" {tries+1} times but failed')
+
+            except Exception as e:
+                put((i, e))
+
+        await asyncio.gather(*[one(i, u) for i, u in enumerate(urls)])
+
+def ifetch(urls, **kwargs):
+    """Iterate over `(i, content)` of `urls` in the order of completion.
+
+    The event loop runs in a background thread so the caller can
+    process (e.g., decode and solve) each download while the others
+    are still in flight.  Keyword arguments are passed to `afetch()`.
+
+    """
+    urls = list(urls)
+    q    = Queue()
+
+    def run():
+        loop = asyncio.new_event_loop()
+        try:
+            loop.run_until_complete(afetch(urls, q.put, **kwargs))
+        finally:
+            loop.close()
+
+    t = Thread(target=run, daemon=True)
+    t.start()
+    for _ in urls:
+        yield q.get()
+    t.join()
+
+def fetch(urls, **kwargs):
+    """Download `urls` concurrently; return contents in input order.
+
+    Failed downloads are returned as exception instances instead of
+    raised, so one bad URL does not cancel the rest of the batch.
+
+    """
+    urls = list(urls)
+    out  = [None] * len(urls)
+    for i, c in ifetch(urls, **kwargs):
+        out[i] = c
+    return out
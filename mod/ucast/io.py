@@ -16,6 +16,10 @@
 # You should have received a copy of the GNU General Public License
 # along with `ucast`.  If not, see <http://www.gnu.org/licenses/>.
 
+import re
+
+from os import path, remove
+
 import numpy  as np
 import pandas as pd
 
@@ -25,19 +29,76 @@ heading = "#            date       tau225        Tb[K]      pwv[mm] lwp[kg*m^-2]
 out_fmt = "%16s %12.4e %12.4e %12.4e %12.4e %12.4e %12.4e %12.4e %12.4e"
 dt_fmt  = "%Y-%m-%d_%H.%M.%S"
 
+# Labels of the columns in the text format; extra `am` bands, e.g.,
+# "tau345" and "Tb345", are labeled as "tau345" and "Tb345[K]"
+labels = dict(zip(names, heading[1:].split()))
+band   = re.compile(r'^(tau|Tb)([0-9.]+)$')
+
+
+def label(name):
+    if name in labels:
+        return labels[name]
+    m = band.match(name)
+    if m is None:
+        raise ValueError(f'Unknown column "{name}"')
+    return name + ('[K]' if m.group(1) == 'Tb' else '')
+
+def unlabel(l):
+    for n, m in labels.items():
+        if m == l:
+            return n
+    return l[:-len('[K]')] if l.endswith('[K]') else l
+
+
+def jacobians_path(fname):
+    return path.splitext(fname)[0] + '.jac.npz'
+
+def save_jacobians(fname, df):
+    """Store the `am` Jacobians of a table, if any, next to the table
+    file `fname`, as arrays named, e.g., "Tb_RH" of shape (row, layer).
+    Without Jacobians, a stale file of an earlier table is removed."""
+    jac = df.attrs.get('jacobians')
+    if jac is None:
+        if path.isfile(jacobians_path(fname)):
+            remove(jacobians_path(fname))
+        return
+    np.savez_compressed(jacobians_path(fname), date=np.array(jac['date']),
+        **{f'{q}_{v}': a for q, d in jac.items() if q != 'date' for v, a in d.items()})
+
+def read_jacobians(fname):
+    """Read the Jacobians stored next to the table file `fname` in the
+    format of df.attrs["jacobians"], or None if there are none."""
+    try:
+        f = np.load(jacobians_path(fname))
+    except FileNotFoundError:
+        return None
+    with f:
+        jac = {'date': list(f['date'])}
+        for k in f.files:
+            if k != 'date':
+                q, v = k.split('_', 1)
+                jac.setdefault(q, {})[v] = f[k]
+    return jac
+
 
 def save_txt(fname, df):
+    save_jacobians(fname, df)
+    extra = [n for n in df.columns if n not in names]
     with open(fname, "w") as f:
-        f.write(heading)
-        np.savetxt(f, df.fillna(0).values, fmt=out_fmt)
+        f.write(heading[:-1] + ''.join(f" {label(n):>12s}" for n in extra) + "\n")
+        np.savetxt(f, df[names + extra].fillna(0).values,
+                   fmt=out_fmt + " %12.4e" * len(extra))
 
 def read_txt(fname):
-    d = pd.read_csv(fname, delim_whitespace=True, skiprows=1, names=names)
+    with open(fname) as f:
+        cols = [unlabel(l) for l in f.readline()[1:].split()]
+    d = pd.read_csv(fname, sep=r'\s+', skiprows=1, names=cols)
     d.date = pd.to_datetime(d.date, format=dt_fmt)
     return d
 
 
 def save_csv(fname, df):
+    save_jacobians(fname, df)
     df.to_csv(fname, index=False)
 
 def read_csv(fname):
@@ -47,9 +108,51 @@ def read_csv(fname):
 
 
 def save_tsv(fname, df):
+    save_jacobians(fname, df)
     df.to_csv(fname, index=False, sep='\t')
 
 def read_tsv(fname):
     d = pd.read_csv(fname, sep='\t')
     d.date = pd.to_datetime(d.date, format=dt_fmt)
     return d
+
+
+def save_npy(fname, df):
+    """Save a table as a self-describing NumPy structured array, with
+    dates as int64 seconds since the epoch and values as float64."""
+    date = df.date
+    if not pd.api.types.is_datetime64_any_dtype(date):
+        date = pd.to_datetime(date, format=dt_fmt)
+
+    cols = [c for c in df.columns if c != 'date']
+    a    = np.empty(len(df), dtype=[('date', '<i8')] + [(c, '<f8') for c in cols])
+    a['date'] = np.asarray(date, dtype='datetime64[s]').astype(np.int64)
+    for c in cols:
+        a[c] = df[c].astype(float)
+
+    with open(fname, 'wb') as f: # `np.save()` would append ".npy" to other names
+        np.save(f, a)
+
+def read_npy(fname):
+    a = np.load(fname)
+    d = pd.DataFrame(a)
+    d['date'] = a['date'].astype('datetime64[s]')
+    return d
+
+
+def binary(fname):
+    """Binary sidecar of the table `fname`, following symlinks, e.g.,
+    "2021-01-01_00.00.00.npy" for "latest.tsv"."""
+    return path.splitext(path.realpath(fname))[0] + '.npy'
+
+def fresh(fname):
+    """Whether the binary sidecar is at least as new as the table."""
+    try:
+        return path.getmtime(binary(fname)) >= path.getmtime(fname)
+    except OSError:
+        return False
+
+def read_table(fname):
+    """Read the table `fname` from its binary sidecar if it is fresh,
+    or from the TSV file otherwise."""
+    return read_npy(binary(fname)) if fresh(fname) else read_tsv(fname)
@@ -0,0 +1,153 @@
+# Copyright (C) 2021 Chi-kwan Chan
+# Copyright (C) 2021 Steward Observatory
+#
+# This file is part of `ucast`.
+#
+# `Ucast` is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# `Ucast` is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with `ucast`.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+
+from concurrent.futures import ThreadPoolExecutor, Future
+from hashlib            import sha256
+from threading          import Lock
+
+from .io import read_table, read_npy, save_npy, fresh
+
+JOBS       = 8     # Default number of tables read concurrently
+MAX_TABLES = 4096  # Default number of parsed tables kept on disk
+CACHE      = os.environ.get("UCAST_TABLE_CACHE",
+                            os.path.join(os.path.expanduser("~"), ".cache", "ucast", "tables")) or None
+
+class Loader:
+    """Concurrent table reader with a parsed-table cache.
+
+    Tables are cached under their resolved path, so all the `latest*`
+    links to a cycle share an entry, and are reread only when the
+    modification time or size of the file changes.  Concurrent reads
+    of the same table wait for a single parse.  Parsed tables are kept
+    in memory and as binary tables in a `cache` directory, so repeated
+    plots across invocations do not parse the text tables again.
+    Tables with a fresh binary sidecar are read from it and not copied
+    to `cache`.
+
+    Args:
+        cache: Directory for parsed tables; None or "" to disable.
+        jobs: Number of tables read concurrently.
+        maxsize: Number of parsed tables kept in `cache`.
+
+    """
+    def __init__(self, cache=CACHE, jobs=JOBS, maxsize=MAX_TABLES):
+        cache = cache or None
+        if cache is not None:
+            os.makedirs(cache, exist_ok=True)
+
+        self.cache   = cache
+        self.jobs    = jobs
+        self.maxsize = maxsize
+        self.memory  = {}
+        self.pending = {} # in-flight reads by key
+        self.hits    = 0
+        self.misses  = 0
+        self.lock    = Lock()
+
+    @staticmethod
+    def key(fname):
+        real = os.path.realpath(fname)
+        st   = os.stat(real)
+        return real, st.st_mtime_ns, st.st_size
+
+    def stored(self, key):
+        return os.path.join(self.cache, sha256(repr(key).encode()).hexdigest() + '.npy')
+
+    def read(self, fname):
+        k = self.key(fname)
+        with self.lock:
+            hit = self.memory.get(k[0])
+            if hit is not None and hit[0] == k:
+                self.hits += 1
+                return hit[1].copy()
+
+            f     = self.pending.get(k)
+            owner = f is None
+            if owner:
+                f = self.pending[k] = Future()
+            else:
+                self.hits += 1
+        if not owner:
+            return f.result().copy() # parsed by another thread
+
+        try:
+            df = self.load(k)
+            f.set_result(df)
+        except BaseException as e:
+            f.set_exception(e)
+            raise
+        finally:
+            with self.lock:
+                del self.pending[k]
+        return df.copy()
+
+    def load(self, k):
+        df = None
+        if self.cache is not None:
+            try:
+                df = read_npy(self.stored(k))
+            except (OSError, ValueError):
+                pass
+
+        with self.lock:
+            if df is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+
+        if df is None:
+            df = read_table(k[0])
+            if self.cache is not None and not fresh(k[0]):
+                self.store(k, df)
+
+        with self.lock:
+            self.memory[k[0]] = (k, df)
+        return df
+
+    def store(self, key, df):
+        f   = self.stored(key)
+        tmp = f'{f}.{os.getpid()}.tmp'
+        save_npy(tmp, df)
+        os.replace(tmp, f)
+
+        # Entries of older versions of the tables are never hit again
+        entries = [e for e in os.scandir(self.cache) if e.name.endswith('.npy')]
+        if len(entries) > self.maxsize:
+            entries.sort(key=lambda e: e.stat().st_mtime)
+            for e in entries[:len(entries) - self.maxsize]:
+                try:
+                    os.remove(e.path)
+                except FileNotFoundError:
+                    pass # removed by another process
+
+    def read_many(self, fnames):
+        """Read the tables `fnames` concurrently, in order."""
+        with ThreadPoolExecutor(max_workers=self.jobs) as pool:
+            return list(pool.map(self.read, fnames))
+
+    def summary(self):
+        with self.lock:
+            n = self.hits + self.misses
+            return {
+                'hits'  : self.hits,
+                'misses': self.misses,
+                'rate'  : self.hits / n if n else 0.0,
+                'size'  : len(self.memory),
+            }
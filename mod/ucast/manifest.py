@@ -0,0 +1,101 @@
+# Copyright (C) 2021 Chi-kwan Chan
+# Copyright (C) 2021 Steward Observatory
+#
+# This file is part of `ucast`.
+#
+# `Ucast` is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# `Ucast` is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with `ucast`.  If not, see <http://www.gnu.org/licenses/>.
+
+import json
+
+from os       import path, rename
+from datetime import datetime
+
+import pandas as pd
+
+from .io    import dt_fmt, read_tsv, read_table, read_jacobians
+from .accum import pack_jacobians, unpack_jacobians
+
+
+def manifest(fname):
+    """Completion manifest of the table `fname`: a JSON list of the
+    forecast hours in the table."""
+    return path.splitext(fname)[0] + '.done'
+
+
+def hours(cycle, dates):
+    """Forecast hours of the table `dates` for `cycle`."""
+    if not pd.api.types.is_datetime64_any_dtype(dates):
+        dates = pd.to_datetime(dates, format=dt_fmt)
+    return [int(round((d - cycle).total_seconds() / 3600)) for d in dates]
+
+
+def record(fname, cycle, df):
+    """Write the manifest of the table `df` saved as `fname`."""
+    tmp = manifest(fname) + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(sorted(hours(cycle, df.date)), f)
+    rename(tmp, manifest(fname))
+
+
+def done(fname):
+    """Forecast hours in the table `fname`, read from its manifest.
+
+    A table written before manifests existed is read once to find its
+    hours, and its manifest is written for the next time.  Returns an
+    empty set if there is no table.
+
+    """
+    if not path.isfile(fname):
+        return set()
+    try:
+        with open(manifest(fname)) as f:
+            return set(json.load(f))
+    except (OSError, ValueError):
+        pass
+
+    cycle = datetime.strptime(path.splitext(path.basename(fname))[0], dt_fmt)
+    df    = read_tsv(fname)
+    try:
+        record(fname, cycle, df)
+    except OSError:
+        pass # e.g., a read-only archive
+    return set(hours(cycle, df.date))
+
+
+def gaps(fname, hrs):
+    """Forecast hours `hrs` missing from the table `fname`."""
+    d = done(fname)
+    return [hr for hr in hrs if hr not in d]
+
+
+def fill(fname, new):
+    """Merge the `new` rows into the saved table `fname`, e.g., to fill
+    the hours `gaps()` found missing.  Rows of `new` replace the saved
+    rows of the same dates."""
+    old = read_table(fname)
+    old['date'] = old.date.dt.strftime(dt_fmt)
+
+    jacs = {}
+    for jac in (read_jacobians(fname), new.attrs.get('jacobians')):
+        if jac is not None:
+            jacs.update(unpack_jacobians(jac))
+
+    new = new.copy()
+    new.attrs = {} # concatenate without comparing the Jacobians
+
+    df = pd.concat([old, new], ignore_index=True)
+    df = df.drop_duplicates('date', keep='last').sort_values('date', ignore_index=True)
+    if jacs:
+        df.attrs['jacobians'] = pack_jacobians([(d, jacs[d]) for d in df.date if d in jacs])
+    return df
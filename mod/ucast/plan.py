@@ -0,0 +1,92 @@
+# Copyright (C) 2020 Chi-kwan Chan
+# Copyright (C) 2020 Steward Observatory
+#
+# This file is part of `ucast`.
+#
+# `Ucast` is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# `Ucast` is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with `ucast`.  If not, see <http://www.gnu.org/licenses/>.
+
+from collections import namedtuple
+
+from .fetch              import ifetch
+from .weather.gfs        import GRIDSZ, group
+from .weather.gfs.nomads import data_url
+
+Job = namedtuple('Job', ['site', 'cycle', 'hr'])
+
+class Plan:
+    """Fetch planner that deduplicates downloads across sites.
+
+    Sites in the same GFS grid cell (e.g., JCMT and SMA, or nearby
+    stencil points) need the identical NOMADS subregion for a given cycle and
+    forecast hour.  A plan collapses the (site, cycle, hour) jobs to
+    unique (grid cell, cycle, hour) downloads, fetches each of them
+    once, decodes it once, and fans the profiles back out to all the
+    jobs that need it.
+
+    Args:
+        jobs: Iterable of `Job`s or (site, cycle, hr) tuples.
+        gridsz: Grid spacing in degrees.
+
+    """
+    def __init__(self, jobs, gridsz=GRIDSZ):
+        self.jobs   = [Job(*j) for j in jobs]
+        self.gridsz = gridsz
+        self.urls   = []  # unique download URLs
+        self.fanout = []  # job indices served by each download
+
+        # The subregion URL encodes the grid cell, cycle, product, and
+        # grid spacing, so identical URLs mean identical downloads
+        index = {}
+        for k, j in enumerate(self.jobs):
+            url = data_url(j.site, j.cycle, j.hr, gridsz)
+            if url not in index:
+                index[url] = len(self.urls)
+                self.urls.append(url)
+                self.fanout.append([])
+            self.fanout[index[url]].append(k)
+
+    @property
+    def saved(self):
+        """Number of requests saved by deduplication."""
+        return len(self.jobs) - len(self.urls)
+
+    def summary(self):
+        return (f"{len(self.jobs)} jobs need {len(self.urls)} downloads; "
+                f"{self.saved} requests saved")
+
+    def run(self, **kwargs):
+        """Fetch and decode all unique downloads.
+
+        Keyword arguments are passed to `ucast.fetch.ifetch()`.
+
+        Yields:
+            (job, gfs) in the order the downloads complete, where
+            `gfs` is a `GFS` instance, or the exception if the
+            download failed.
+
+        """
+        for i, content in ifetch(self.urls, **kwargs):
+            jobs = [self.jobs[k] for k in self.fanout[i]]
+            if isinstance(content, Exception):
+                for j in jobs:
+                    yield j, content
+                continue
+
+            # One decode for all sites in the cell; distinct sites
+            # still get their own interpolation weights
+            j     = jobs[0]
+            sites = list(dict.fromkeys(j.site for j in jobs))
+            gfss  = {g.site: g for g in group(sites, j.cycle, j.hr, self.gridsz, content=content)}
+            for j in jobs:
+                yield j, gfss[j.site]
@@ -16,4 +16,6 @@
 # You should have received a copy of the GNU General Public License
 # along with `ucast`.  If not, see <http://www.gnu.org/licenses/>.
 
-from .core import AM
+from .core      import AM, PROCS
+from .integrals import columns, columns_batch
+from .emulator  import Emulator
@@ -16,6 +16,7 @@
 # You should have received a copy of the GNU General Public License
 # along with `ucast`.  If not, see <http://www.gnu.org/licenses/>.
 
+import re
 import numpy as np
 
 from ...weather.gfs.nomads import levels
@@ -96,9 +97,16 @@ def delta(arr, n, u):
     arr = base(arr, n, u)
     return np.r_[arr[0], arr[1:]-arr[:-1]]
 
-def config(gfs, debug=False):
+def layers(gfs):
+    """Regrid the GFS profile onto `am` layers ending at the site.
 
-    p = f"{gfs.product:03d} hour forecast" if isinstance(gfs.product, int) else "analysis"
+    Returns:
+        Dictionary of per-layer arrays: base pressures "Pb", heights
+        "zb", temperatures "Tb", and relative humidities "RHb"; layer
+        averages "T", "o3_vmr", "RH", "cloud_lmr", and "cloud_imr";
+        layer masses "m"; and cloud liquid water "ctw" and ice "cti".
+
+    """
     z = gfs.site.alt
 
     # Prepare for regriding
@@ -136,13 +144,24 @@ def config(gfs, debug=False):
     # Convert mass mixing ratio to volume mixing ratio
     o3_vmr = o3_mmr * (M_AIR/M_O3)
 
+    return {'Pb':Pb, 'zb':zb, 'Tb':Tb, 'RHb':RHb, 'T':T, 'o3_vmr':o3_vmr, 'RH':RH,
+            'cloud_lmr':cloud_lmr, 'cloud_imr':cloud_imr, 'm':m, 'ctw':ctw, 'cti':cti}
+
+def config(gfs, debug=False):
+
+    p = f"{gfs.product:03d} hour forecast" if isinstance(gfs.product, int) else "analysis"
+    z = gfs.site.alt
+
+    d = layers(gfs)
+    Pb, zb, Tb, RHb, T, o3_vmr, RH, ctw, cti = (d[k] for k in [
+        'Pb', 'zb', 'Tb', 'RHb', 'T', 'o3_vmr', 'RH', 'ctw', 'cti'])
+
     # Dump arrays to debug
     if debug:
         import pandas as pd
-        loc = locals()
         org = pd.DataFrame({k:getattr(gfs, k) for k in [
             'P', 'z', 'T', 'o3_mmr', 'RH', 'cloud_lmr', 'cloud_imr']})
-        der = pd.DataFrame({k:loc[k] for k in [
+        der = pd.DataFrame({k:d[k] for k in [
             'Pb', 'zb', 'Tb', 'T', 'o3_vmr', 'RH', 'cloud_lmr', 'cloud_imr', 'm', 'ctw', 'cti']})
         org.to_csv('debug-org.csv', index=False)
         der.to_csv('debug-der.csv', index=False)
@@ -170,3 +189,186 @@ def config(gfs, debug=False):
             T[i], o3_vmr[i], RH[i], ctw[i], cti[i]))
 
     return "\n\n".join(l), Tb, RHb
+
+# Precompiled templates for `config_batch()`
+HEADER = """#
+# Layer data below were derived from NCEP GFS model data obtained
+# from the NOAA Operational Model Archive Distribution System
+# (NOMADS).  See http://nomads.ncep.noaa.gov for more information.
+#
+#         Production date: {0:%Y%m%d}
+#                   Cycle: {0:%H} UT
+#                 Product: {1}
+#
+# Interpolated to
+#
+#                latitude: {2} deg. N
+#               longitude: {3} deg. E
+#   Geopotential altitude: {4} m
+#""".format
+PBASE   = "layer\nPbase {:.1f} mbar  # {:.1f} m\nTbase {:.1f} K\ncolumn dry_air vmr".format
+O3      = "column o3 vmr {:.3e}".format
+RH_     = "column h2o RH {:.2f}%".format
+RHI     = "column h2o RHi {:.2f}%".format
+STRAT   = column("h2o vmr", STRAT_H2O_VMR)
+LWP     = "column lwp_abs_Rayleigh {:.3e} kg*m^-2".format
+IWP     = "column iwp_abs_Rayleigh {:.3e} kg*m^-2".format
+
+def base_batch(arr, n, u, log=False):
+    """Vectorized `base()` for stacked profiles; row `r` is valid up
+    to column `n[r]` inclusive."""
+    r    = np.arange(len(arr))
+    a, b = arr[r, n-1], arr[r, n]
+    if log:
+        s = np.exp(np.log(a) + np.log(b/a) * u)
+    else:
+        c = a + (b - a) * u
+        s = np.where(c > 0.0, c, 0.0)
+
+    out = np.concatenate([arr, np.zeros((len(arr), 1))], axis=1)
+    out[r, n] = s
+    return out
+
+def average_batch(arr, n, u):
+    arr = base_batch(arr, n, u)
+    return np.concatenate([arr[:,:1], 0.5 * (arr[:,:-1]+arr[:,1:])], axis=1)
+
+def delta_batch(arr, n, u):
+    arr = base_batch(arr, n, u)
+    return np.concatenate([arr[:,:1], arr[:,1:]-arr[:,:-1]], axis=1)
+
+def layers_batch(gfss):
+    """Vectorized `layers()` for a list of GFS profiles.
+
+    The profiles are stacked into (profile, level) arrays so the
+    surface regridding, layer masses, and unit conversions are done
+    in single NumPy operations.
+
+    Returns:
+        Dictionary of the `layers()` arrays with one row per profile,
+        padded to the same length, plus the number of valid layers
+        "N" of each row and a mask "scalar" of the rows that need
+        `layers()` instead: profiles with the site above the top
+        level (an error), below the bottom level, or exactly on a
+        level.
+
+    """
+    P    = np.stack([g.P         for g in gfss]).astype(float)
+    Z    = np.stack([g.z         for g in gfss]).astype(float)
+    T    = np.stack([g.T         for g in gfss]).astype(float)
+    RH   = np.stack([g.RH        for g in gfss]).astype(float)
+    O3MR = np.stack([g.o3_mmr    for g in gfss]).astype(float)
+    LMR  = np.stack([g.cloud_lmr for g in gfss]).astype(float)
+    IMR  = np.stack([g.cloud_imr for g in gfss]).astype(float)
+    z    = np.array([g.site.alt  for g in gfss], dtype=float)
+    r    = np.arange(len(gfss))
+
+    # Surface regridding, as in `layers()`; the rows that need the
+    # scalar path may produce junk, which is discarded
+    with np.errstate(all='ignore'):
+        n  = np.argmax(Z < z[:,None], axis=1)
+        m  = np.maximum(n, 1)
+        u  = (Z[r,m-1]-z) / (Z[r,m-1]-Z[r,m])
+
+        Pb  = base_batch(P,  m, u, log=True)
+        zb  = base_batch(Z,  m, u)
+        Tb  = base_batch(T,  m, u)
+        RHb = base_batch(RH, m, u)
+
+        u2 = (P[r,m-1]-Pb[r,m]) / (P[r,m-1]-P[r,m])
+
+        Ta   = average_batch(T,    m, u2)
+        o3   = average_batch(O3MR, m, u2) * (M_AIR/M_O3)
+        RHa  = average_batch(RH,   m, u2)
+        lmr  = average_batch(LMR,  m, u2)
+        imr  = average_batch(IMR,  m, u2)
+        mass = delta_batch(Pb, m, u2)[:,:-1] * (PASCAL_ON_MBAR/G_STD)
+
+    return {'Pb':Pb, 'zb':zb, 'Tb':Tb, 'RHb':RHb, 'T':Ta, 'o3_vmr':o3, 'RH':RHa,
+            'cloud_lmr':lmr, 'cloud_imr':imr, 'm':mass, 'ctw':lmr * mass, 'cti':imr * mass,
+            'N':n + 1, 'scalar':(z > Z[:,0]) | (n == 0) | (u == 0.0) | (u2 == 0.0)}
+
+def config_batch(gfss):
+    """Vectorized `config()` for a batch of GFS profiles.
+
+    The layers are computed by `layers_batch()` and the configuration
+    texts are formatted with precompiled templates.  The results are
+    identical to `config()`, which is still used for the rare
+    profiles that `layers_batch()` cannot handle.
+
+    Returns:
+        List of (config text, Tb, RHb) tuples as returned by
+        `config()`, or the exception raised for a bad profile.
+
+    """
+    gfss = list(gfss)
+    if not gfss:
+        return []
+
+    d = layers_batch(gfss)
+    Pb, zb, Tb, RHb, Ta, o3, RHa, ctw, cti, scalar = (d[k] for k in [
+        'Pb', 'zb', 'Tb', 'RHb', 'T', 'o3_vmr', 'RH', 'ctw', 'cti', 'scalar'])
+
+    out = []
+    for k, g in enumerate(gfss):
+        if scalar[k]:
+            try:
+                out.append(config(g))
+            except ValueError as e:
+                out.append(e)
+            continue
+
+        N = d['N'][k]
+        p = f"{g.product:03d} hour forecast" if isinstance(g.product, int) else "analysis"
+        l = [HEADER(g.cycle, p, g.site.lat, g.site.lon, g.site.alt)]
+        for Pb_, zb_, Tb_, T_, o3_, RH_a, ctw_, cti_ in zip(
+                Pb[k,:N].tolist(), zb[k,:N].tolist(), Tb[k,:N].tolist(), Ta[k,:N].tolist(),
+                o3[k,:N].tolist(), RHa[k,:N].tolist(), ctw[k,:N].tolist(), cti[k,:N].tolist()):
+            warm = T_ > H2O_SUPERCOOL_LIMIT
+            s    = [PBASE(Pb_, zb_, Tb_)]
+            if o3_ > 0:
+                s.append(O3(o3_))
+            if not Pb_ > RH_TOP_PLEVEL:
+                s.append(STRAT)
+            elif RH_a > 0:
+                s.append(RH_(RH_a) if warm else RHI(RH_a))
+            if ctw_ > 0:
+                s.append(LWP(ctw_) if warm else IWP(ctw_))
+            if cti_ > 0:
+                s.append(IWP(cti_))
+            l.append('\n'.join(s))
+
+        out.append(("\n\n".join(l), Tb[k,:N], RHb[k,:N]))
+
+    return out
+
+# Differentiation variables for `am` Jacobians: per-layer temperature,
+# relative humidity, and cloud liquid water, with their steps
+JACOBIAN = {
+    'T'  : (re.compile(r'^Tbase \S+ K$'),                         '1 K'         ),
+    'RH' : (re.compile(r'^column h2o RHi? \S+%$'),                 '1%'          ),
+    'lwp': (re.compile(r'^column lwp_abs_Rayleigh \S+ kg\*m\^-2$'), '1e-3 kg*m^-2'),
+}
+
+def differentiate(layers):
+    """Tag variables in the `layers` text from `config()` or
+    `config_batch()` as `am` differentiation variables.
+
+    Stratospheric water vapor and layers without cloud liquid water
+    have no such variables to tag.
+
+    Returns:
+        The tagged layers text, and the (variable, layer index) of
+        each differentiation variable in the order `am` outputs them.
+
+    """
+    lines, tags, k = [], [], -1
+    for l in layers.split('\n'):
+        if l == 'layer':
+            k += 1
+        for v, (p, step) in JACOBIAN.items():
+            if p.match(l):
+                l = f'{l} {step}'
+                tags.append((v, k))
+        lines.append(l)
+    return '\n'.join(lines), tags
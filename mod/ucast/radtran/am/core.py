@@ -16,11 +16,32 @@
 # You should have received a copy of the GNU General Public License
 # along with `ucast`.  If not, see <http://www.gnu.org/licenses/>.
 
+import os
 import shutil
 import subprocess
+import threading
 import re
 
-from .config import config
+from concurrent.futures import ThreadPoolExecutor, Future
+from hashlib            import sha256
+from math               import gcd
+from functools          import reduce
+
+from .config import config, config_batch, differentiate, JACOBIAN
+from .       import tune
+
+PROCS = os.cpu_count() or 1  # Default number of concurrent `am` processes
+FREQ  = 225                  # Frequency of the "tau" and "Tb" columns in GHz
+GRID  = 1024                 # Maximum number of frequencies of the `am` grid
+
+def resolved(x):
+    """Future already resolved to `x`, or to the exception `x`."""
+    f = Future()
+    if isinstance(x, Exception):
+        f.set_exception(x)
+    else:
+        f.set_result(x)
+    return f
 
 class AM:
 
@@ -29,13 +50,10 @@ class AM:
     KG_ON_M2 = 3.3427e21
     DU       = 2.6868e16
 
-    header = """#
+    preamble = """#
 # This header is prepended to the atmospheric layers generated by
 # gfs16_to_am10.py to generate a complete am configuration file.
 #
-f 225 GHz 225 GHz 1 GHz
-output f GHz tau Tb K
-T0 2.7 K
 """
 
     cmap = {
@@ -45,30 +63,135 @@ T0 2.7 K
         'o3' : (re.compile('^#.*o3'              ), DU      ),
     }
 
-    def __init__(self, path=None):
+    def __init__(self, path=None, procs=None, threads=None, memo=None, bands=(), jacobians=False):
         if path is None:
             path = shutil.which('am')
         if path is None:
             raise OSError('Executable of `am` Atmospheric Model not found.')
 
-        self.am = path
+        # Use the setting from `ucast calibrate` unless specified;
+        # otherwise, split the CPUs evenly among processes to avoid
+        # oversubscribing them with OpenMP threads
+        tuned = tune.load()
+        if procs is None:
+            procs = tuned.get('procs', PROCS)
+        if threads is None:
+            threads = tuned['threads'] if procs == tuned.get('procs') and 'threads' in tuned else \
+                      max(1, PROCS // procs)
+
+        self.am        = path
+        self.procs     = procs
+        self.threads   = threads
+        self.memo      = memo      # optional `ucast.cache.SolutionCache`
+        self.bands     = bands
+        self.jacobians = jacobians # per-layer sensitivities of tau and Tb
+
+        self._version = None
+        self._local   = threading.local() # OpenMP threads of pool workers
+
+    @property
+    def bands(self):
+        """Extra frequencies in GHz solved in the same `am` run as FREQ."""
+        return self._bands
+
+    @bands.setter
+    def bands(self, bands):
+        bands        = sorted({float(f) for f in bands} - {FREQ})
+        lo, hi, step = self.grid(bands)
+        n            = (hi - lo) // step + 1
+        if n > GRID:
+            raise ValueError(
+                f'Bands {bands} need a {n}-point frequency grid (max {GRID}); '
+                'solve non-commensurate bands in separate runs')
+        self._bands = bands
+
+    @staticmethod
+    def grid(bands):
+        """Lowest and highest frequencies and step, in MHz, of the
+        uniform `am` grid that contains FREQ and `bands`.
+
+        `am` solves on a uniform frequency grid, so the grid step is
+        the greatest common divisor of the band separations.
+
+        """
+        fs = [int(round(f * 1000)) for f in [FREQ] + list(bands)] # MHz
+        lo, hi = min(fs), max(fs)
+        step   = reduce(gcd, [f - lo for f in fs], 0) or 1000
+        return lo, hi, step
+
+    @property
+    def names(self):
+        """Names of the extra solution entries, e.g., "tau345", "Tb345"."""
+        return [f'{k}{f:g}' for f in self.bands for k in ('tau', 'Tb')]
+
+    @property
+    def header(self):
+        """Configuration header that makes `am` output tau and Tb at
+        FREQ and all the extra bands.
+
+        Bands on a coarse common `grid()`, e.g., 225, 345, and 690
+        GHz, therefore cost little more than FREQ alone; the `bands`
+        setter rejects bands that need more than GRID points.
+
+        """
+        lo, hi, step = self.grid(self.bands)
+        return self.preamble + (
+            f"f {lo/1000:g} GHz {hi/1000:g} GHz {step/1000:g} GHz\n"
+            "output f GHz tau Tb K\n" +
+            ("jacobian tau Tb K\n" if self.jacobians else "") +
+            "T0 2.7 K\n")
+
+    def threads_for(self, procs):
+        """OpenMP threads per `am` process when running `procs` at once."""
+        return self.threads if procs == self.procs else max(1, PROCS // procs)
 
     def run(self, *args, **kwargs):
+        threads = getattr(self._local, 'threads', self.threads)
+        if threads:
+            kwargs.setdefault('env', {**os.environ, 'OMP_NUM_THREADS': str(threads)})
         return subprocess.run([self.am, *args], **kwargs)
 
-    def solve(self, gfs):
-        layers, Tb, RHb = config(gfs)
+    @property
+    def version(self):
+        """Hash of the `am` executable, to key memoized solutions."""
+        if self._version is None:
+            with open(self.am, 'rb') as f:
+                self._version = sha256(f.read()).hexdigest()
+        return self._version
 
-        cfg = self.header + layers
-        res = self.run('-', input=cfg, encoding='utf-8', capture_output=True)
-        sol = {
-            'Ts' : Tb [-1] - 273.15,
-            'RHs': RHb[-1],
-        }
+    def parse(self, res, tags=(), nlayer=0):
+        """Parse the output of an `am` run into a solution dictionary.
+
+        With `tags` from `differentiate()`, the Jacobians of tau and
+        Tb at FREQ, which `am` outputs after tau and Tb for all
+        differentiation variables in turn, are parsed into
+        sol["jacobian"][q][v], a list of the derivatives of the
+        quantity q with respect to the variable v for each of the
+        `nlayer` layers; None where v is not a variable of the layer.
+        A failed run raises a RuntimeError with the `am` error messages.
+
+        """
+        if res.returncode != 0:
+            raise RuntimeError(f'`am` failed with exit status {res.returncode}: {res.stderr.strip()}')
+        rows = [[float(v) for v in l.split()] for l in res.stdout.split('\n') if l.strip()]
+        if not rows:
+            raise RuntimeError(f'`am` gave no output: {res.stderr.strip()}')
 
-        l = res.stdout.split()
-        sol['tau'] = float(l[1])
-        sol['Tb' ] = float(l[2])
+        def band(f): # output row nearest to frequency `f`
+            return min(rows, key=lambda r: abs(r[0] - f))
+
+        row = band(FREQ)
+        sol = {'tau': row[1], 'Tb': row[2]}
+        for f in self.bands:
+            _, sol[f'tau{f:g}'], sol[f'Tb{f:g}'] = band(f)[:3]
+
+        if tags:
+            n   = len(tags)
+            jac = {q: {v: [None] * nlayer for v in JACOBIAN} for q in ('tau', 'Tb')}
+            for j, (v, k) in enumerate(tags):
+                jac['tau'][v][k] = row[3 + j]
+                jac['Tb' ][v][k] = row[3 + n + j]
+            sol['jacobian'] = jac
 
         for l in res.stderr.split('\n'):
             for k, (p, f) in self.cmap.items():
@@ -77,3 +200,98 @@ T0 2.7 K
                     continue
 
         return sol
+
+    def solve(self, gfs):
+        return self.solve_config(*config(gfs))
+
+    def solve_config(self, layers, Tb, RHb):
+        """Solve the layers, base temperatures, and base relative
+        humidities returned by `config()` or `config_batch()`."""
+        tags = ()
+        if self.jacobians:
+            layers, tags = differentiate(layers)
+
+        cfg = self.header + layers
+        sol = {
+            'Ts' : Tb [-1] - 273.15,
+            'RHs': RHb[-1],
+        }
+
+        # `am` is deterministic, so its output only depends on the
+        # configuration text and the executable
+        res = None if self.memo is None else self.memo.get(cfg, self.version)
+        if res is None:
+            res = self.parse(self.run('-', input=cfg, encoding='utf-8', capture_output=True),
+                             tags, len(Tb))
+            if self.memo is not None:
+                self.memo.put(cfg, self.version, res)
+
+        sol.update(res)
+        return sol
+
+    def pool(self, procs=None):
+        """Bounded pool to run up to `procs` `am` processes at once.
+
+        Each worker thread only waits for its `am` subprocess, so
+        threads are enough to keep many cores busy.  Submit
+        `self.solve` to the pool to overlap solving with, e.g.,
+        downloading.  When `procs` overrides `self.procs`, the `am`
+        runs of the pool use `threads_for(procs)` OpenMP threads.
+
+        """
+        procs = procs or self.procs
+        if procs == self.procs:
+            return ThreadPoolExecutor(max_workers=procs)
+        return Pool(self._local, procs, self.threads_for(procs))
+
+    def solve_many(self, gfss, procs=None):
+        """Solve a batch of GFS profiles in parallel.
+
+        The `am` configurations of all profiles are generated at
+        once by `config_batch()`.
+
+        Args:
+            gfss: Iterable of `GFS` instances.
+            procs: Maximum number of concurrent `am` processes;
+                defaults to `self.procs`.
+
+        Returns:
+            List of solutions in the order of `gfss`.  A job that
+            failed gives its exception instead of a solution, so one
+            bad profile does not kill the batch.
+
+        """
+        with self.pool(procs) as pool:
+            fs = self.submit_many(pool, gfss)
+        return [f.exception() or f.result() for f in fs]
+
+    def submit_many(self, pool, gfss):
+        """Submit a batch of GFS profiles to `pool`, e.g., from
+        `self.pool()`, with the `am` configurations of all profiles
+        generated at once by `config_batch()`.
+
+        Returns:
+            List of futures in the order of `gfss`.  The future of a
+            bad profile holds its exception.
+
+        """
+        return [resolved(c) if isinstance(c, Exception) else pool.submit(self.solve_config, *c)
+                for c in config_batch(gfss)]
+
+
+class Pool(ThreadPoolExecutor):
+    """Thread pool whose jobs run `am` with `threads` OpenMP threads."""
+
+    def __init__(self, local, procs, threads):
+        super().__init__(max_workers=procs)
+        self.local   = local
+        self.threads = threads
+
+    def submit(self, fn, *args, **kwargs):
+        def job():
+            self.local.threads = self.threads
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                del self.local.threads
+        return super().submit(job)
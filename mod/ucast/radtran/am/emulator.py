@@ -0,0 +1,173 @@
+# Copyright (C) 2020 Chi-kwan Chan
+# Copyright (C) 2020 Steward Observatory
+#
+# This file is part of `ucast`.
+#
+# `Ucast` is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# `Ucast` is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with `ucast`.  If not, see <http://www.gnu.org/licenses/>.
+
+from hashlib   import sha256
+from itertools import product
+from threading import Lock
+
+import numpy as np
+
+from .core      import resolved
+from .integrals import columns, columns_batch
+
+FEATURES = ('pwv', 'lwp', 'iwp', 'Ts')  # Inputs from `columns()`
+TARGETS  = ('tau', 'Tb')                # Outputs of `am`
+DEGREE   = 3                            # Degree of the polynomials
+HOLDOUT  = 0.2                          # Fraction of samples to validate
+
+def powers(nvar, degree):
+    """Exponents of all monomials of `nvar` variables up to `degree`."""
+    return np.array([p for p in product(range(degree+1), repeat=nvar) if sum(p) <= degree])
+
+def design(x, p):
+    """Monomials `p` of the scaled features `x` of shape (sample, var)."""
+    return np.prod(x[:,None,:] ** p[None,:,:], axis=-1)
+
+def scale(x, lo, hi):
+    """Scale features to [0, 1] over the training range."""
+    return (x - lo) / np.where(hi > lo, hi - lo, 1.0)
+
+class Emulator:
+    """Polynomial emulator of `am` for tau and Tb.
+
+    tau and Tb at 225 GHz are smooth functions of a few column
+    integrals of the profile, which are computed without `am` by
+    `columns()`.  The emulator fits polynomials in these features to
+    `AM.solve()` results, and reports the largest error on samples
+    held out from the fit.  Profiles outside of the range of the
+    training features are solved by `am` instead.
+
+    Args:
+        coef: Polynomial coefficients of shape (target, monomial).
+        p: Exponents of the monomials of shape (monomial, feature).
+        lo, hi: Ranges of the training features.
+        error: Largest absolute validation error of each target.
+
+    """
+    def __init__(self, coef, p, lo, hi, error):
+        self.coef   = np.asarray(coef)
+        self.p      = np.asarray(p)
+        self.lo     = np.asarray(lo)
+        self.hi     = np.asarray(hi)
+        self.error  = dict(zip(TARGETS, np.asarray(error)))
+        self.hits   = 0
+        self.misses = 0
+        self.lock   = Lock()
+
+    @classmethod
+    def train(cls, am, gfss, degree=DEGREE, holdout=HOLDOUT, seed=0):
+        """Fit an emulator to `am` solutions of the profiles `gfss`."""
+        gfss = list(gfss)
+        cols = columns_batch(gfss)
+        sols = am.solve_many(gfss)
+
+        X, Y = [], []
+        for c, s in zip(cols, sols):
+            if isinstance(c, Exception) or isinstance(s, Exception):
+                continue
+            X.append([c[k] for k in FEATURES])
+            Y.append([s[k] for k in TARGETS])
+        X, Y = np.array(X), np.array(Y)
+
+        p = powers(len(FEATURES), degree)
+        if len(X) < 2 * len(p):
+            raise ValueError(f"Need at least {2*len(p)} valid profiles to train; got {len(X)}")
+
+        lo, hi = X.min(axis=0), X.max(axis=0)
+        A = design(scale(X, lo, hi), p)
+
+        # Validate on random held-out samples, then refit on all
+        k     = np.random.default_rng(seed).permutation(len(X))
+        v, t  = k[:int(len(X) * holdout)], k[int(len(X) * holdout):]
+        coef  = np.linalg.lstsq(A[t], Y[t], rcond=None)[0]
+        error = np.abs(A[v] @ coef - Y[v]).max(axis=0) if len(v) else np.full(len(TARGETS), np.nan)
+        coef  = np.linalg.lstsq(A, Y, rcond=None)[0]
+
+        return cls(coef.T, p, lo, hi, error)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as f:
+            return cls(f['coef'], f['p'], f['lo'], f['hi'], f['error'])
+
+    def save(self, path):
+        np.savez(path, coef=self.coef, p=self.p, lo=self.lo, hi=self.hi,
+                 error=np.array([self.error[k] for k in TARGETS]))
+
+    @property
+    def version(self):
+        """Hash of the fit, to tell emulators apart."""
+        h = sha256()
+        for a in (self.coef, self.p, self.lo, self.hi):
+            h.update(np.ascontiguousarray(a, dtype=float).tobytes())
+        return h.hexdigest()
+
+    def predict(self, c):
+        """Emulated {"tau":..., "Tb":...} for the `columns()` output `c`,
+        or None if `c` is outside of the training range."""
+        x = np.array([[c[k] for k in FEATURES]])
+        if not np.all((self.lo <= x) & (x <= self.hi)):
+            return None
+        y = design(scale(x, self.lo, self.hi), self.p) @ self.coef.T
+        return dict(zip(TARGETS, y[0]))
+
+    def solver(self, am):
+        """Drop-in replacement of `am.solve` that falls back to `am`
+        for profiles outside of the training range, or for all
+        profiles if `am` has extra bands or Jacobians, which are not
+        emulated."""
+        def solve(gfs):
+            c = columns(gfs)
+            y = None if am.bands or am.jacobians else self.predict(c)
+            with self.lock:
+                if y is None:
+                    self.misses += 1
+                else:
+                    self.hits += 1
+            return am.solve(gfs) if y is None else {**c, **y}
+        return solve
+
+    def submit_many(self, am, pool, gfss):
+        """Batched `solver()`: the columns of all profiles `gfss` are
+        integrated at once by `columns_batch()`, and the profiles that
+        are not emulated are submitted to `am` on `pool` with
+        `am.submit_many()`.  Returns a future for each profile."""
+        gfss = list(gfss)
+        cs   = columns_batch(gfss)
+        ys   = [None if am.bands or am.jacobians or isinstance(c, Exception) else self.predict(c)
+                for c in cs]
+
+        miss = [g for g, c, y in zip(gfss, cs, ys) if y is None and not isinstance(c, Exception)]
+        with self.lock:
+            self.misses += len(miss)
+            self.hits   += sum(y is not None for y in ys)
+
+        fs = iter(am.submit_many(pool, miss))
+        return [resolved(c) if isinstance(c, Exception) else
+                next(fs)    if y is None else resolved({**c, **y})
+                for c, y in zip(cs, ys)]
+
+    def summary(self):
+        with self.lock:
+            n = self.hits + self.misses
+            return {
+                'hits'  : self.hits,
+                'misses': self.misses,
+                'rate'  : self.hits / n if n else 0.0,
+                'error' : dict(self.error),
+            }
@@ -0,0 +1,116 @@
+# Copyright (C) 2020 Chi-kwan Chan
+# Copyright (C) 2020 Steward Observatory
+#
+# This file is part of `ucast`.
+#
+# `Ucast` is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# `Ucast` is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with `ucast`.  If not, see <http://www.gnu.org/licenses/>.
+
+import numpy as np
+
+from .core   import AM
+from .config import layers, layers_batch
+from .config import M_AIR, PASCAL_ON_MBAR, H2O_SUPERCOOL_LIMIT, RH_TOP_PLEVEL, STRAT_H2O_VMR
+
+AVOGADRO = 6.02214076e23  # [1 / mole]
+
+def saturation(T, ice=False):
+    """Saturation vapor pressure [Pa] over liquid water or ice at
+    temperature `T` [K], by Murphy & Koop (2005), as used by `am`."""
+    with np.errstate(all='ignore'):
+        if ice:
+            return np.exp(9.550426 - 5723.265/T + 3.53068*np.log(T) - 0.00728332*T)
+        return np.exp(54.842763 - 6763.22/T - 4.210*np.log(T) + 0.000367*T +
+                      np.tanh(0.0415*(T - 218.8)) *
+                      (53.878 - 1331.22/T - 9.44523*np.log(T) + 0.014025*T))
+
+def integrate(Pb, Tb, T, o3_vmr, RH, ctw, cti, m, valid):
+    """Column integrals of (profile, layer) arrays; see `columns()`."""
+    with np.errstate(all='ignore'):
+        # Air column density [cm^-2] from the layer mass [kg / m^2]
+        N = m * (AVOGADRO / (M_AIR * 1e-3) * 1e-4)
+
+        # Layer pressures and temperatures: the tops of the layers are
+        # the bases of the layers above, starting from P = 0 and an
+        # isothermal top layer, as `am` does for the `config()` output
+        Pt   = np.concatenate([np.zeros_like(Pb[:,:1]), Pb[:,:-1]], axis=1)
+        Tt   = np.concatenate([Tb[:,:1],                Tb[:,:-1]], axis=1)
+        Pmid = 0.5 * (Pt + Pb) * PASCAL_ON_MBAR
+        Tmid = 0.5 * (Tt + Tb)
+
+        # Water vapor from RH (or RH over ice below the supercooling
+        # limit), or a fixed mixing ratio in the stratosphere
+        warm = T > H2O_SUPERCOOL_LIMIT
+        es   = np.where(warm, saturation(Tmid), saturation(Tmid, ice=True))
+        h2o  = np.where(Pb > RH_TOP_PLEVEL,
+                        np.where(RH > 0, 0.01 * RH * es / Pmid, 0.0),
+                        STRAT_H2O_VMR)
+
+        def total(x):
+            return np.where(valid & (x > 0), x, 0.0).sum(axis=1)
+
+        return {
+            'pwv': total(h2o    * N) / AM.MM_PWV,
+            'lwp': total(np.where( warm, ctw, 0.0)),
+            'iwp': total(np.where(~warm, ctw, 0.0)) + total(cti),
+            'o3' : total(o3_vmr * N) / AM.DU,
+        }
+
+def columns(gfs):
+    """Precipitable water vapor [mm], liquid and ice water paths
+    [kg / m^2], and ozone column [DU] above the site, together with
+    the surface temperature and humidity, without running `am`.
+
+    The integrals are taken over the same layers as `config()`, so
+    the cloud and ozone columns match those reported by `am`; the
+    water vapor column uses `am`'s saturation formulae evaluated at
+    the mean pressure and temperature of each layer.
+
+    """
+    d = layers(gfs)
+    c = integrate(*(d[k][None,:] for k in ['Pb', 'Tb', 'T', 'o3_vmr', 'RH', 'ctw', 'cti', 'm']),
+                  valid=np.ones((1, len(d['Pb'])), dtype=bool))
+    return {'Ts' :d['Tb' ][-1] - 273.15,
+            'RHs':d['RHb'][-1],
+            **{k:v[0] for k, v in c.items()}}
+
+def columns_batch(gfss):
+    """Vectorized `columns()` for a list of GFS profiles.
+
+    Returns:
+        List of solution dictionaries, or the exception raised for a
+        bad profile.
+
+    """
+    gfss = list(gfss)
+    if not gfss:
+        return []
+
+    d     = layers_batch(gfss)
+    r     = np.arange(len(gfss))
+    valid = np.arange(d['Pb'].shape[1])[None,:] < d['N'][:,None]
+    c     = integrate(*(d[k] for k in ['Pb', 'Tb', 'T', 'o3_vmr', 'RH', 'ctw', 'cti', 'm']),
+                      valid=valid)
+    Ts    = d['Tb' ][r, d['N']-1] - 273.15
+    RHs   = d['RHb'][r, d['N']-1]
+
+    out = []
+    for k, g in enumerate(gfss):
+        if d['scalar'][k]:
+            try:
+                out.append(columns(g))
+            except ValueError as e:
+                out.append(e)
+        else:
+            out.append({'Ts':Ts[k], 'RHs':RHs[k], **{n:v[k] for n, v in c.items()}})
+    return out
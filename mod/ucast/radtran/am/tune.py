@@ -0,0 +1,96 @@
+# Copyright (C) 2020 Chi-kwan Chan
+# Copyright (C) 2020 Steward Observatory
+#
+# This file is part of `ucast`.
+#
+# `Ucast` is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# `Ucast` is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with `ucast`.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import json
+import time
+
+from datetime import datetime
+
+CPUS   = os.cpu_count() or 1
+CONFIG = os.environ.get("UCAST_AM_CONFIG",
+                        os.path.join(os.path.expanduser("~"), ".config", "ucast", "am.json"))
+SOLVES = 32  # Number of solves per benchmark
+
+def load(path=CONFIG):
+    """Load the calibrated {"procs":..., "threads":...} setting, or an
+    empty dictionary if the host was not calibrated."""
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def save(setting, path=CONFIG):
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, 'w') as f:
+        json.dump(setting, f, indent=2)
+
+def reference():
+    """Reference GFS profile for benchmarking: a synthetic forecast
+    for KP, so calibration does not need network access."""
+    from ...site           import KP
+    from ...weather.gfs    import GFS, synthetic, grib
+    from ...weather.gfs.nomads import variables, levels
+
+    cycle   = datetime(2020, 7, 1, 0)
+    content = synthetic.subset(cycle, 0, 0.25, variables, levels,
+                               -111.75, -111.5, 32.0, 31.75)
+    return GFS(KP, cycle, 0, data=grib.load(content, KP))
+
+def combinations(cpus=CPUS):
+    """(procs, threads) pairs with powers of two that fit in `cpus`."""
+    p2 = [2**k for k in range(cpus.bit_length()) if 2**k <= cpus]
+    if cpus not in p2:
+        p2.append(cpus)
+    return [(p, t) for p in p2 for t in p2 if p * t <= cpus]
+
+def benchmark(am, procs, threads, gfs=None, n=SOLVES):
+    """Throughput of `am` in solves per second with `procs` concurrent
+    processes of `threads` OpenMP threads each."""
+    if gfs is None:
+        gfs = reference()
+
+    saved = am.procs, am.threads
+    try:
+        am.procs, am.threads = procs, threads
+        am.solve(gfs) # warm up
+        start = time.perf_counter()
+        for sol in am.solve_many([gfs] * n):
+            if isinstance(sol, Exception):
+                raise sol
+        return n / (time.perf_counter() - start)
+    finally:
+        am.procs, am.threads = saved
+
+def calibrate(am, combos=None, n=SOLVES, report=None):
+    """Benchmark all `combos` of (procs, threads) and return the best
+    setting as a dictionary together with all the measurements."""
+    if combos is None:
+        combos = combinations()
+
+    gfs     = reference()
+    results = []
+    for procs, threads in combos:
+        rate = benchmark(am, procs, threads, gfs, n)
+        results.append((procs, threads, rate))
+        if report is not None:
+            report(procs, threads, rate)
+
+    procs, threads, rate = max(results, key=lambda r: r[2])
+    return {'procs':procs, 'threads':threads, 'rate':rate}, results
@@ -20,12 +20,23 @@ import sys
 import time
 import requests
 
+from collections import namedtuple, Counter, deque
+from threading   import Lock
+
 # Timeouts and retries
 CONN_TIMEOUT        = 6    # Initial server response timeout in seconds
 READ_TIMEOUT        = 18   # Stalled download timeout in seconds
 RETRY_DELAY         = 60   # Delay before retry (NOAA requests 60 s)
 NODATA_DELAY        = 300  # Delay after a 404
 MAX_DOWNLOAD_TRIES  = 5
+RETRYABLE           = {403, 429, 500, 502, 503, 504}
+
+# Connection pool
+POOL_HOSTS          = 4    # Number of hosts to keep connection pools for
+POOL_SIZE           = 16   # Maximum number of connections per host
+
+# Metrics
+MAX_RECORDS         = 1024 # Number of recent attempts kept for inspection
 
 def errln(s):
     print(s, file=sys.stderr)
@@ -33,22 +44,96 @@ def errln(s):
 def err(s):
     print(s, file=sys.stderr, end='')
 
+# One entry per HTTP attempt; `retry` counts the earlier attempts for
+# the same request, and `status` is None if no response was received
+Record = namedtuple('Record', ['url', 'status', 'latency', 'nbytes', 'retry'])
+
+class Transport:
+    """Pooled, keep-alive HTTP transport with per-request metrics.
+
+    All requests share one `requests.Session`, so connections to
+    NOMADS (and other services) are reused instead of paying a new
+    TCP+TLS handshake for every download.  Every attempt is counted
+    in running totals so `summary()` can show where the time goes,
+    and the last `records` attempts are kept for inspection, so a
+    long-running `watch` does not grow without bound.
+
+    """
+    def __init__(self, hosts=POOL_HOSTS, size=POOL_SIZE, records=MAX_RECORDS):
+        adapter = requests.adapters.HTTPAdapter(
+            pool_connections=hosts, pool_maxsize=size, pool_block=True)
+
+        self.session = requests.Session()
+        self.session.mount('https://', adapter)
+        self.session.mount('http://',  adapter)
+        self.records = deque(maxlen=records)
+        self.lock    = Lock()
+
+        self.requests = 0
+        self.attempts = 0
+        self.bytes    = 0
+        self.latency  = 0.0
+        self.max      = 0.0
+        self.status   = Counter()
+
+    def get(self, url, retry=0, **kwargs):
+        status, nbytes = None, 0
+        start = time.monotonic()
+        try:
+            r = self.session.get(url, **kwargs)
+            status = r.status_code
+            nbytes = len(r.content)
+            return r
+        finally:
+            t = time.monotonic() - start
+            with self.lock:
+                self.records.append(Record(url, status, t, nbytes, retry))
+                self.requests += retry == 0
+                self.attempts += 1
+                self.bytes    += nbytes
+                self.latency  += t
+                self.max       = max(self.max, t)
+                self.status[status] += 1
+
+    def summary(self):
+        with self.lock:
+            return {
+                'requests': self.requests,
+                'attempts': self.attempts,
+                'retries' : self.attempts - self.requests,
+                'bytes'   : self.bytes,
+                'latency' : self.latency,
+                'mean'    : self.latency / self.attempts if self.attempts else 0.0,
+                'max'     : self.max,
+                'status'  : dict(self.status),
+            }
+
+    def close(self):
+        self.session.close()
+
+# Default transport shared by the GFS loader and the site elevation
+# lookup
+transport = Transport()
+
 def request(url,
             ctime=CONN_TIMEOUT,
             rtime=READ_TIMEOUT,
             delay=RETRY_DELAY,
-            retry=MAX_DOWNLOAD_TRIES):
+            retry=MAX_DOWNLOAD_TRIES,
+            transport=transport,
+            headers=None):
+    tries = 0
     while True:
         retry -= 1
 
         try:
-            r = requests.get(url, timeout=(ctime, rtime))
-            if r.status_code == requests.codes.ok:
+            r = transport.get(url, retry=tries, timeout=(ctime, rtime), headers=headers)
+            if r.status_code in {requests.codes.ok, requests.codes.partial_content}:
                 return r
             elif r.status_code == 404:
                 err("Data not available (404).")
                 time.sleep(NODATA_DELAY - delay)
-            elif r.status_code in {403, 429, 500, 502, 503, 504}:
+            elif r.status_code in RETRYABLE:
                 err(f"Received retryable status {r.status_code}.")
                 retry += 0.8
             else:
@@ -58,6 +143,7 @@ def request(url,
         except requests.exceptions.ReadTimeout:
             err("Data download timed out.")
 
+        tries += 1
         if retry:
             errln("  Retrying...")
             time.sleep(delay)
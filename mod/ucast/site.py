@@ -17,10 +17,11 @@
 # along with `ucast`.  If not, see <http://www.gnu.org/licenses/>.
 
 from collections import namedtuple
-import requests
 import urllib
 import pandas as pd
 
+from .request import transport
+
 import gc
 from math import floor
 
@@ -54,7 +55,7 @@ def elevation_function(lat,lon):
             'units': 'Meters'
         }
         # format query string and return query value
-        result = requests.get((url + urllib.parse.urlencode(params)))
+        result = transport.get(url + urllib.parse.urlencode(params))
         return float(result.json()['USGS_Elevation_Point_Query_Service']['Elevation_Query']['Elevation'])
 
 
@@ -17,6 +17,8 @@
 # along with `ucast`.  If not, see <http://www.gnu.org/licenses/>.
 
 from random   import randrange
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from threading import Lock
 from os       import symlink, rename, path
 from datetime import timedelta
 from math     import sqrt
@@ -26,40 +28,295 @@ import pandas as pd
 from tqdm import tqdm
 
 import ucast  as uc
-from ucast.io import dt_fmt
+from ucast.io    import dt_fmt
+from ucast.fetch import ifetch, MAX_IN_FLIGHT, RATE
+from ucast.request import errln
+from ucast.plan  import Plan
+from ucast.accum import Accumulator, pack_jacobians
+from ucast.radtran.am.core import resolved
+from ucast.manifest import manifest, hours, record, done, gaps, fill
 
-columns      = ['date', 'tau', 'Tb', 'pwv', 'lwp', 'iwp', 'o3']
+columns      = ['date', 'tau', 'Tb', 'pwv', 'lwp', 'iwp', 'o3', 'Ts', 'RHs']
 forecast_hrs = list(range(120+1)) + list(range(123, 384+1, 3))
 
-am = uc.am.AM()
+BATCH = 32  # Profiles whose `am` configurations are generated at once
 
+am = uc.am.AM()
 
-def ucast_dataframe(site, cycle, test=False):
-    df = pd.DataFrame(columns=columns)
 
-    if test:
-        forecasts = range(2)
-    else:
-        forecasts = tqdm(forecast_hrs, desc=cycle.strftime(dt_fmt))
+def table_columns():
+    """Table columns, including the extra `am` bands, if any."""
+    return columns + am.names
 
-    for hr in forecasts:
-        try:
-            gfs = uc.gfs.GFS(site, cycle, hr)
-        except requests.exceptions.RetryError as e:
-            continue # skip a row
 
-        sol  = am.solve(gfs)
-        date = (gfs.cycle + timedelta(hours=hr)).strftime(dt_fmt)
-        df   = df.append({'date':date, **sol}, ignore_index=True)
+def table(rows):
+    """Sort solution `rows` by date into a table; `am` Jacobians, if
+    any, go to df.attrs["jacobians"]."""
+    rows = sorted(rows, key=lambda r: r['date'])
+    df   = pd.DataFrame(rows, columns=table_columns())
 
+    jacs = [(r['date'], r['jacobian']) for r in rows if 'jacobian' in r]
+    if jacs:
+        df.attrs['jacobians'] = pack_jacobians(jacs)
     return df
 
 
-def valid(fname):
-    if path.isfile(fname):
-        with open(fname) as f:
-            return len(f.readlines()) == len(forecast_hrs)+1
-    return False
+def mode(columns_only=False, emulator=None):
+    """Tag of the solver of `submit()`, so checkpoints of another
+    solver or `am` executable are not resumed."""
+    if columns_only:
+        return 'columns'
+    m = f'am {am.version}' + (' jacobians' if am.jacobians else '')
+    return m if emulator is None else f'emulator {emulator.version} {m}'
+
+
+def submit(pool, gfss, columns_only=False, emulator=None):
+    """Solve a batch of profiles with `am`, with an `uc.am.Emulator`,
+    or only integrate the water and ozone columns without running
+    `am`; returns a future for each profile.  The `am` configurations
+    or the columns of the whole batch are computed at once, and `am`
+    runs are submitted to the `am` `pool`."""
+    if columns_only:
+        return [resolved(c) for c in uc.am.columns_batch(gfss)]
+    if emulator is not None:
+        return emulator.submit_many(am, pool, gfss)
+    return am.submit_many(pool, gfss)
+
+
+def solved(f, site, date):
+    """Solution of the future `f`, or None if solving failed, so one
+    bad row does not abort the tables of the whole batch."""
+    try:
+        return f.result()
+    except Exception as e:
+        errln(f'Failed to solve {date} for {site.name}: {e!r}.  Skipping row.')
+        return None
+
+
+def ucast_dataframe(site, cycle, test=False, jobs=MAX_IN_FLIGHT, rate=RATE, cache=None, hrs=None,
+                    procs=None, columns_only=False, emulator=None, part=None):
+    """Create the table of `site` for `cycle`.
+
+    With a `part` file, each hour is checkpointed to it as soon as it
+    is solved, and a rerun after an interruption only solves the
+    remaining hours.  Remove `part` after saving the table.
+
+    """
+    if hrs is None:
+        hrs = range(2) if test else forecast_hrs
+
+    with Accumulator(cycle, hrs, table_columns(), part=part, mode=mode(columns_only, emulator)) as acc:
+        todo = acc.todo
+        urls = [uc.gfs.nomads.data_url(site, cycle, hr, uc.gfs.GRIDSZ) for hr in todo]
+        if acc.resumed:
+            print(f' resuming {acc.resumed} hours from "{part}" ...', end='')
+
+        # Download concurrently; decode each forecast hour as soon as
+        # its download completes and solve it on the `am` pool
+        forecasts = ifetch(urls, jobs=jobs, rate=rate, cache=cache)
+        if not test:
+            forecasts = tqdm(forecasts, total=len(urls), desc=cycle.strftime(dt_fmt))
+
+        # Accumulate (and checkpoint) each hour as soon as it is solved
+        lock = Lock()
+        def done(f, hr):
+            if f.exception() is None:
+                with lock:
+                    acc.add(hr, f.result())
+
+        with am.pool(procs) as pool:
+            solves = []
+            for i, content in forecasts:
+                if isinstance(content, requests.exceptions.RetryError):
+                    continue # skip a row
+                if isinstance(content, Exception):
+                    raise content
+
+                gfs = uc.gfs.GFS(site, cycle, todo[i], content=content)
+                f,  = submit(pool, [gfs], columns_only, emulator)
+                f.add_done_callback(lambda f, hr=todo[i]: done(f, hr))
+                solves.append((todo[i], f))
+
+        for hr, f in solves: # report failed rows; a rerun retries them
+            solved(f, site, (cycle + timedelta(hours=hr)).strftime(dt_fmt))
+
+        return acc.table()
+
+
+def ucast_dataframes(sites, cycle, test=False, jobs=MAX_IN_FLIGHT, rate=RATE, cache=None, hrs=None,
+                     bulk=False, mirror=None, procs=None, columns_only=False, emulator=None):
+    """Create tables for many `sites` with bounding-box requests.
+
+    Nearby sites are grouped by `uc.gfs.cluster()`.  Each group needs
+    only one NOMADS request per forecast hour, which is decoded once
+    and interpolated to all sites in the group.
+
+    With `bulk` (or a local `mirror`), the fields are instead taken
+    from the full pgrb2 files with `uc.gfs.ingest()`, so the cost does
+    not grow with the number of sites or groups.
+
+    Args:
+        hrs: Optional forecast hours to create for all sites, e.g.,
+            the union of the `gaps()` of existing tables.
+
+    """
+    if hrs is None:
+        hrs = range(2) if test else forecast_hrs
+
+    if bulk or mirror is not None:
+        return bulk_dataframes(sites, cycle, hrs, jobs=jobs, rate=rate, cache=cache, mirror=mirror,
+                               procs=procs, columns_only=columns_only, emulator=emulator)
+
+    groups = uc.gfs.cluster(sites)
+    tasks  = [(g, hr) for g in groups for hr in hrs]
+    urls   = [uc.gfs.nomads.group_url(g, cycle, hr, uc.gfs.GRIDSZ) for g, hr in tasks]
+
+    forecasts = ifetch(urls, jobs=jobs, rate=rate, cache=cache)
+    if not test:
+        forecasts = tqdm(forecasts, total=len(urls), desc=cycle.strftime(dt_fmt))
+
+    with am.pool(procs) as pool:
+        solves = []
+        for i, content in forecasts:
+            if isinstance(content, requests.exceptions.RetryError):
+                continue # skip a row for all sites in the group
+            if isinstance(content, Exception):
+                raise content
+
+            g, hr = tasks[i]
+            gfss  = uc.gfs.group(g, cycle, hr, content=content)
+            for gfs, f in zip(gfss, submit(pool, gfss, columns_only, emulator)):
+                solves.append((gfs.site, hr, f))
+
+    rows = {s: [] for s in sites}
+    for s, hr, f in solves:
+        date = (cycle + timedelta(hours=hr)).strftime(dt_fmt)
+        sol  = solved(f, s, date)
+        if sol is not None:
+            rows[s].append({'date':date, **sol})
+
+    return [table(rows[s]) for s in sites]
+
+
+def plan_dataframes(pairs, test=False, jobs=MAX_IN_FLIGHT, rate=RATE, cache=None, procs=None,
+                    columns_only=False, emulator=None, hrs=None):
+    """Create tables for many (site, cycle) `pairs` with a `Plan`.
+
+    Sites in the same grid cell share one download per cycle and
+    forecast hour, so, e.g., stencil points and co-located telescopes
+    do not fetch the same subregion more than once.
+
+    Args:
+        hrs: Optional dictionary mapping pairs to the forecast hours
+            to create, e.g., only the `gaps()` of existing tables.
+
+    Returns:
+        Dictionary mapping each (site, cycle) pair to its table.
+
+    """
+    if hrs is None:
+        hrs = {p: range(2) if test else forecast_hrs for p in pairs}
+    plan = Plan((s, c, hr) for s, c in pairs for hr in hrs[s, c])
+    print(plan.summary())
+
+    forecasts = plan.run(jobs=jobs, rate=rate, cache=cache)
+    if not test:
+        forecasts = tqdm(forecasts, total=len(plan.jobs))
+
+    with am.pool(procs) as pool:
+        solves, batch = [], []
+
+        def flush():
+            fs = submit(pool, [gfs for _, gfs in batch], columns_only, emulator)
+            solves.extend((job, f) for (job, _), f in zip(batch, fs))
+            batch.clear()
+
+        for job, gfs in forecasts:
+            if isinstance(gfs, requests.exceptions.RetryError):
+                continue # skip a row
+            if isinstance(gfs, Exception):
+                raise gfs
+
+            batch.append((job, gfs))
+            if len(batch) >= BATCH:
+                flush()
+        flush()
+
+    rows = {p: [] for p in pairs}
+    for job, f in solves:
+        date = (job.cycle + timedelta(hours=job.hr)).strftime(dt_fmt)
+        sol  = solved(f, job.site, date)
+        if sol is not None:
+            rows[job.site, job.cycle].append({'date':date, **sol})
+
+    return {p: table(r) for p, r in rows.items()}
+
+
+def plan_profiles(pairs, test=False, jobs=MAX_IN_FLIGHT, rate=RATE, cache=None):
+    """Download and decode the GFS profiles of many (site, cycle)
+    `pairs` with a `Plan`, e.g., to train an `uc.am.Emulator`."""
+    hrs  = range(2) if test else forecast_hrs
+    plan = Plan((s, c, hr) for s, c in pairs for hr in hrs)
+    print(plan.summary())
+
+    forecasts = plan.run(jobs=jobs, rate=rate, cache=cache)
+    if not test:
+        forecasts = tqdm(forecasts, total=len(plan.jobs))
+
+    gfss = []
+    for job, gfs in forecasts:
+        if isinstance(gfs, requests.exceptions.RetryError):
+            continue
+        if isinstance(gfs, Exception):
+            raise gfs
+        gfss.append(gfs)
+    return gfss
+
+
+def bulk_dataframes(sites, cycle, hrs, jobs=MAX_IN_FLIGHT, rate=RATE, cache=None, mirror=None,
+                    procs=None, columns_only=False, emulator=None):
+    """Create tables for many `sites` from full pgrb2 files.
+
+    The inventories and byte ranges are downloaded with `ifetch()`, so
+    they share its rate limit, retry budget, circuit breaker, and
+    `cache`; with a local `mirror`, the files are read directly.
+
+    """
+    hrs = list(hrs)
+    with ThreadPoolExecutor(max_workers=jobs) as pool, am.pool(procs) as pool_am:
+        if mirror is None:
+            futures = {}
+            for hr, content in uc.gfs.bulk.fetch(cycle, hrs, jobs=jobs, rate=rate, cache=cache):
+                if isinstance(content, requests.exceptions.RetryError):
+                    continue # skip a row for all sites
+                if isinstance(content, Exception):
+                    raise content
+                futures[pool.submit(uc.gfs.bulk.decode, sites, cycle, hr, content)] = hr
+        else:
+            futures = {pool.submit(uc.gfs.ingest, sites, cycle, hr, mirror=mirror): hr for hr in hrs}
+
+        solves = []
+        for f in tqdm(as_completed(futures), total=len(futures), desc=cycle.strftime(dt_fmt)):
+            try:
+                gfss = f.result()
+            except FileNotFoundError:
+                continue # skip a row missing from the mirror
+
+            for gfs, s in zip(gfss, submit(pool_am, gfss, columns_only, emulator)):
+                solves.append((gfs.site, futures[f], s))
+
+    rows = {s: [] for s in sites}
+    for s, hr, f in solves:
+        date = (cycle + timedelta(hours=hr)).strftime(dt_fmt)
+        sol  = solved(f, s, date)
+        if sol is not None:
+            rows[s].append({'date':date, **sol})
+
+    return [table(rows[s]) for s in sites]
+
+
+def valid(fname, hrs=forecast_hrs):
+    return not gaps(fname, hrs)
 
 
 def forced_symlink(src, dst):
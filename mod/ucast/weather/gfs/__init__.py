@@ -17,4 +17,6 @@
 # along with `ucast`.  If not, see <http://www.gnu.org/licenses/>.
 
 from .cycle import *
-from .core  import GFS
+from .core  import GFS, GRIDSZ, group, cluster
+from .watch import available, published
+from .bulk  import ingest
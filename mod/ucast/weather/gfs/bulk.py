@@ -0,0 +1,195 @@
+# Copyright (C) 2020 Chi-kwan Chan
+# Copyright (C) 2020 Steward Observatory
+#
+# This file is part of `ucast`.
+#
+# `Ucast` is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# `Ucast` is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with `ucast`.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+
+from collections import namedtuple
+
+from ...request import request
+from ...fetch   import ifetch, split
+from .          import nomads
+from .nomads    import variables, levels
+from .grib      import load_points
+from .watch     import PROD_PATH
+from .core      import GFS
+
+MAX_GAP = 256 * 1024  # Merge byte ranges separated by at most this
+
+# One line of a GRIB2 inventory (".idx") file; `end` is inclusive, or
+# None for the last message of the file
+Record = namedtuple('Record', ['n', 'start', 'end', 'var', 'level'])
+
+def base_url():
+    """Base URL of the GFS production directories.
+
+    Defaults to the NOMADS "prod" tree; set `UCAST_BULK_URL` to use
+    another server with the same layout, e.g., the NOAA Open Data
+    Dissemination bucket https://noaa-gfs-bdp-pds.s3.amazonaws.com.
+
+    """
+    return os.environ.get("UCAST_BULK_URL", nomads.BASE_URL + PROD_PATH)
+
+def file_path(cycle, product, gridsz):
+    """Path of a full GFS pgrb2 file relative to the base URL or mirror."""
+    p = f"f{product:03d}" if isinstance(product, int) else "anl"
+    g = f"{gridsz:.2f}".replace('.', 'p')
+    return f"gfs.{cycle:%Y%m%d}/{cycle:%H}/atmos/gfs.t{cycle:%H}z.pgrb2.{g}.{p}"
+
+def parse_idx(text):
+    """Parse a GRIB2 inventory into a list of `Record`s.
+
+    Each line looks like "123:45678:d=2020070106:TMP:500 mb:3 hour
+    fcst:".  Sub-messages ("12.1:...") share the byte range of their
+    parent message, so only the first line of each offset is kept.
+
+    """
+    rows = []
+    for line in text.splitlines():
+        f = line.split(':')
+        if len(f) < 5:
+            continue
+        start = int(f[1])
+        if rows and rows[-1][1] == start:
+            continue
+        rows.append((f[0], start, f[3], f[4]))
+
+    return [Record(n, start, rows[k+1][1] - 1 if k+1 < len(rows) else None, var, level)
+            for k, (n, start, var, level) in enumerate(rows)]
+
+def select(records, variables=variables, levels=levels):
+    """Records of the requested variables on the requested levels."""
+    wanted = {(v, f"{l} mb") for v in variables for l in levels}
+    return [r for r in records if (r.var, r.level) in wanted]
+
+def ranges(records, gap=MAX_GAP):
+    """Merge the byte ranges of `records` into as few ranges as possible.
+
+    Ranges separated by at most `gap` bytes are merged, trading a
+    little extra download for fewer requests.
+
+    """
+    out = []
+    for r in sorted(records, key=lambda r: r.start):
+        if out and out[-1][1] is not None and r.start - out[-1][1] - 1 <= gap:
+            out[-1] = (out[-1][0], r.end)
+        else:
+            out.append((r.start, r.end))
+    return out
+
+def file_url(cycle, product, gridsz):
+    """URL of a full GFS pgrb2 file; its inventory is at url + ".idx"."""
+    return '/'.join([base_url(), file_path(cycle, product, gridsz)])
+
+def range_urls(url, idx):
+    """URLs of the byte ranges of the requested messages of the pgrb2
+    file `url` with the inventory `idx`, as "#bytes=a-b" fragments
+    understood by `ucast.fetch`."""
+    return [f"{url}#bytes={a}-{'' if b is None else b}"
+            for a, b in ranges(select(parse_idx(idx)))]
+
+def download(cycle, product, gridsz):
+    """Download the requested messages of a full pgrb2 file by byte ranges."""
+    url = file_url(cycle, product, gridsz)
+    return b''.join(request(u, headers=h).content
+                    for u, h in map(split, range_urls(url, request(url + '.idx').text)))
+
+def fetch(cycle, products, gridsz=0.25, **kwargs):
+    """Iterate over (product, content) of the requested messages of
+    full pgrb2 files, in the order of completion.
+
+    The inventories and then the byte ranges are downloaded with
+    `ucast.fetch.ifetch()`, so they go through its rate limit, retry
+    budget, circuit breaker, and `cache`; keyword arguments are
+    passed to it.  A product whose inventory or any range failed
+    gives the exception instead of the content.
+
+    """
+    products = list(products)
+    urls     = [file_url(cycle, p, gridsz) for p in products]
+
+    parts  = [] # (product index, range index, range URL)
+    chunks = {}
+    for k, idx in ifetch([u + '.idx' for u in urls], **kwargs):
+        if isinstance(idx, Exception):
+            yield products[k], idx
+            continue
+        us = range_urls(urls[k], idx.decode())
+        parts    += [(k, n, u) for n, u in enumerate(us)]
+        chunks[k] = [None] * len(us)
+
+    left = {k: len(c) for k, c in chunks.items()}
+    for i, content in ifetch([u for _, _, u in parts], **kwargs):
+        k, n, _ = parts[i]
+        if k not in left:
+            continue # already failed
+        if isinstance(content, Exception):
+            del left[k]
+            yield products[k], content
+            continue
+        chunks[k][n] = content
+        left[k] -= 1
+        if not left[k]:
+            del left[k]
+            yield products[k], b''.join(chunks[k])
+
+def read(mirror, cycle, product, gridsz):
+    """Read the requested messages of a full pgrb2 file from a local mirror.
+
+    The mirror has the same layout as the production directories.  If
+    the inventory is missing, the whole file is read and the unwanted
+    messages are skipped when decoding.
+
+    """
+    path = os.path.join(mirror, file_path(cycle, product, gridsz))
+    if not os.path.isfile(path + '.idx'):
+        with open(path, 'rb') as f:
+            return f.read()
+
+    with open(path + '.idx') as f:
+        rs = ranges(select(parse_idx(f.read())))
+
+    chunks = []
+    with open(path, 'rb') as f:
+        for a, b in rs:
+            f.seek(a)
+            chunks.append(f.read() if b is None else f.read(b - a + 1))
+    return b''.join(chunks)
+
+def ingest(sites, cycle, product=None, gridsz=0.25, mirror=None):
+    """Load GFS data for any number of sites from a full pgrb2 file.
+
+    Only the messages of `nomads.variables` on `nomads.levels` are
+    fetched, using the inventory and HTTP byte-range requests (or read
+    from a local `mirror`).  Each global field is decoded once and
+    interpolated to all sites, so the cost is roughly independent of
+    the number of sites.
+
+    Returns:
+        List of `GFS` instances, one for each site.
+
+    """
+    if mirror is None:
+        content = download(cycle, product, gridsz)
+    else:
+        content = read(mirror, cycle, product, gridsz)
+    return decode(sites, cycle, product, content, gridsz)
+
+def decode(sites, cycle, product, content, gridsz=0.25):
+    """Decode the messages `content` of a full pgrb2 file for all `sites`."""
+    ds = load_points(content, sites, gridsz)
+    return [GFS(s, cycle, product, gridsz, data=d) for s, d in zip(sites, ds)]
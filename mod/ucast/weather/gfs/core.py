@@ -16,32 +16,73 @@
 # You should have received a copy of the GNU General Public License
 # along with `ucast`.  If not, see <http://www.gnu.org/licenses/>.
 
-from tempfile import NamedTemporaryFile
-
-from ...request import request
-from .nomads    import data_url
-from .grib      import load
+from ...fetch   import download
+from .nomads    import data_url, group_url
+from .grib      import load, load_group
 
 GRIDSZ = 0.25  # Grid spacing string: the available GFS lat,lon grid
                # spacings are 0.25, 0.50, or 1.00 degrees.
 
+GROUP_SPAN = 5.0  # Maximum extent of the bounding box of a site group
+                  # in degrees, to keep bounding-box requests small.
+
 class GFS:
 
-    def __init__(self, site, cycle, product=None, gridsz=GRIDSZ):
+    def __init__(self, site, cycle, product=None, gridsz=GRIDSZ, content=None, data=None, cache=None):
 
-        # Step 1: download data from NOMADS
-        r = request(data_url(site, cycle, product, gridsz))
+        if data is None:
+            # Step 1: download data from NOMADS (or `cache`), unless
+            # the GRIB content was already fetched, e.g., by
+            # `ucast.fetch`
+            if content is None:
+                content = download(data_url(site, cycle, product, gridsz), cache)
 
-        # Step 2: save data to temporary file; load it back with `pygrib`
-        with NamedTemporaryFile() as t:
-            with open(t.name, "wb") as f:
-                f.write(r.content)
-            d = load(t.name, site)
+            # Step 2: decode the GRIB2 content in memory
+            data = load(content, site, gridsz)
 
         # Step 3: set the instance attributes
         self.site    = site
         self.cycle   = cycle
         self.product = product
         self.gridsz  = gridsz
-        for k, v in d.items():
+        for k, v in data.items():
             setattr(self, k, v)
+
+
+def group(sites, cycle, product=None, gridsz=GRIDSZ, content=None, cache=None):
+    """Load GFS data for many sites from a single bounding-box request.
+
+    Args:
+        sites: Sites covered by one request; see `cluster()`.
+        cycle: GFS forecast cycle.
+        product: Forecast hour, or None for the analysis.
+        gridsz: Grid spacing in degrees.
+        content: GRIB content of `group_url(sites, ...)` if it was
+            already downloaded.
+        cache: Optional `ucast.cache.GribCache` to look up and store
+            the download.
+
+    Returns:
+        List of `GFS` instances, one for each site.
+
+    """
+    if content is None:
+        content = download(group_url(sites, cycle, product, gridsz), cache)
+
+    ds = load_group(content, sites, gridsz)
+    return [GFS(s, cycle, product, gridsz, data=d) for s, d in zip(sites, ds)]
+
+
+def cluster(sites, span=GROUP_SPAN):
+    """Group `sites` so each group has a bounding box within `span` degrees."""
+    groups = []
+    for s in sites:
+        for g in groups:
+            lats = [t.lat for t in g] + [s.lat]
+            lons = [t.lon for t in g] + [s.lon]
+            if max(lats) - min(lats) <= span and max(lons) - min(lons) <= span:
+                g.append(s)
+                break
+        else:
+            groups.append([s])
+    return groups
@@ -16,40 +16,256 @@
 # You should have received a copy of the GNU General Public License
 # along with `ucast`.  If not, see <http://www.gnu.org/licenses/>.
 
+import os
 import numpy as np
-import pygrib
 
-from .nomads import levels
+from .nomads import parameters, levels
+from .       import grib2
 
 BADVAL = -99999.0  # placeholder for missing or undefined data
 
+# Profile name -> (NOMADS variable, placeholder for missing data)
 load_map = {
-    'z'        : ("Geopotential Height", BADVAL),
-    'T'        : ("Temperature",         BADVAL),
-    'o3_mmr'   : ("Ozone mixing ratio",     0.0),
-    'RH'       : ("Relative humidity",      0.0),
-    'cloud_lmr': ("Cloud mixing ratio",     0.0),
-    'cloud_imr': ("Ice water mixing ratio", 0.0),
+    'z'        : ("HGT",   BADVAL),
+    'T'        : ("TMP",   BADVAL),
+    'o3_mmr'   : ("O3MR",     0.0),
+    'RH'       : ("RH",       0.0),
+    'cloud_lmr': ("CLWMR",    0.0),
+    'cloud_imr': ("ICMR",     0.0),
 }
 
-def load(path, site, grid_delta=0.25):
+# Messages are identified by their (discipline, category, number)
+# triplets, which, unlike the names, do not change between eccodes
+# versions (e.g., "Geopotential Height" vs "Geopotential height")
+triplets = {p: var for var, p in parameters.items()}
+
+# Position of each (variable, level) in the stacked fields
+slots = {(var, l): (m, n)
+         for m, (var, _) in enumerate(load_map.values())
+         for n, l in enumerate(levels)}
+
+def messages(content):
+    """Split GRIB2 `content` into individual messages.
+
+    Section 0 of each GRIB2 message starts with b"GRIB" and records
+    the total length of the message in octets 9-16.  A length shorter
+    than section 0 or past the end of `content` means the content is
+    corrupt or truncated, and raises a ValueError.
+
+    """
+    i = content.find(b'GRIB')
+    while 0 <= i < len(content):
+        n = int.from_bytes(content[i+8:i+16], 'big')
+        if n < 16 or i + n > len(content):
+            raise ValueError(f'Invalid GRIB2 message length {n} at offset {i}')
+        yield content[i:i+n]
+        i = content.find(b'GRIB', i+n)
+
+def pygrib_decoder():
+    import pygrib # slow to import; only when selected
+    return pygrib.fromstring
+
+def builtin_decoder():
+    return grib2.Message
+
+# GRIB2 decoder backends; each returns a function that decodes one
+# message into an object with the `pygrib` message interface
+decoders = {
+    'pygrib' : pygrib_decoder,
+    'builtin': builtin_decoder,
+}
+
+decoder = None # selected by `use()`
+
+def use(name=None):
+    """Select the GRIB2 decoder backend.
+
+    Args:
+        name: "pygrib" or "builtin".  If None, take it from the
+            `UCAST_GRIB` environment variable, or use `pygrib` if it
+            is installed and the built-in reader otherwise.
+
+    Returns:
+        Name of the selected backend.
+
+    """
+    global decoder
+
+    if name is None:
+        name = os.environ.get("UCAST_GRIB")
+    if name is None:
+        try:
+            decoder = pygrib_decoder()
+            return 'pygrib'
+        except ImportError:
+            name = 'builtin'
+
+    if name not in decoders:
+        raise ValueError(f'Unknown GRIB2 decoder "{name}"; choose from {", ".join(decoders)}')
+    decoder = decoders[name]()
+    return name
+
+def decode(message):
+    """Decode one GRIB2 message with the selected backend."""
+    if decoder is None:
+        use()
+    return decoder(message)
+
+def slot(g):
+    """Position of a decoded message in the stacked fields, or None if
+    it is not one of the variables and levels used by `ucast`."""
+    if g.typeOfLevel != 'isobaricInhPa':
+        return None
+    var = triplets.get((g.discipline, g.parameterCategory, g.parameterNumber))
+    return slots.get((var, g.level))
+
+def fields(content, shape=None):
+    """Decode GRIB2 `content` in a single pass over its messages.
+
+    Args:
+        content: GRIB2 content, e.g., from `nomads.data_url()`.
+        shape: Expected (ny, nx) shape of the grid, to preallocate
+            the output; taken from the first message if None.
+
+    Returns:
+        Fields with shape (variable, level, ny, nx) ordered as
+        `load_map` and `levels`, NaN where a message is missing, and
+        the latitudes and longitudes of the grid rows and columns.
+
+    """
+    F = None if shape is None else np.full((len(load_map), len(levels)) + tuple(shape), np.nan)
+    lats = lons = None
+
+    for g in map(decode, messages(content)):
+        k = slot(g)
+        if k is None:
+            continue
+        if lats is None:
+            la, lo = g.latlons()
+            lats, lons = la[:,0], lo[0,:]
+            if F is None:
+                F = np.full((len(load_map), len(levels)) + la.shape, np.nan)
+        a = np.ma.filled(g.values, np.nan)
+        if a.shape != F.shape[2:]:
+            raise ValueError(f"Unexpected grid shape {a.shape} in GRIB2 message")
+        F[k] = a
+
+    if lats is None:
+        raise ValueError("No GRIB2 message found")
+
+    return F, lats, lons
+
+def load(content, site, grid_delta=0.25):
+    """Load the GFS profile of `site` from the GRIB2 content of its
+    grid cell, i.e., a 2x2 subregion from `nomads.data_url()`."""
 
     u = (site.lat/grid_delta) % 1
     v = (site.lon/grid_delta) % 1
 
-    idx = pygrib.index(path, "name", "level")
+    F, _, _ = fields(content, (2, 2))
 
-    def grid_interp(name, level, bad):
-        try:
-            a = idx.select(name=name, level=level)[0].values
-        except:
-            return bad
-        else:
-            return (a[0][0] * (1.0-u) * (1.0-v) + a[1][0] * u * (1.0-v) +
-                    a[0][1] * (1.0-u) *      v  + a[1][1] * u *      v   )
-
-    d = {'P':np.array(levels)}
-    for k, (name, bad) in load_map.items():
-        d[k] = np.array([grid_interp(name, l, bad) for l in levels])
-
-    return d
+    # Bilinear interpolation of all variables and levels at once; the
+    # first grid index runs from south to north
+    w = np.array([[(1.0-u) * (1.0-v), (1.0-u) * v],
+                  [     u  * (1.0-v),      u  * v]])
+    f = np.einsum('mnij,ij->mn', F, w)
+
+    return profiles(f[..., None])[0]
+
+def weights(sites, lats, lons, grid_delta=0.25):
+    """Precompute bilinear interpolation weights for `sites`.
+
+    Args:
+        sites: Sequence of sites inside the grid.
+        lats: Latitudes of the grid rows.
+        lons: Longitudes of the grid columns.
+        grid_delta: Grid spacing in degrees.
+
+    Returns:
+        Row indices, column indices, and weights of the four grid
+        points surrounding each site, each with shape (len(sites), 4).
+
+    """
+    lat  = np.array([s.lat for s in sites])
+    lon  = np.array([s.lon for s in sites]) % 360
+    lons = np.asarray(lons) % 360
+
+    b = np.floor(lat / grid_delta) * grid_delta
+    l = np.floor(lon / grid_delta) * grid_delta
+    u = (lat - b) / grid_delta
+    v = (lon - l) / grid_delta
+
+    def index(grid, x):
+        d = np.abs(np.asarray(grid)[None,:] - x[:,None])
+        k = d.argmin(axis=1)
+        if np.any(d[np.arange(len(x)),k] > grid_delta / 2):
+            raise ValueError("Site outside of the GRIB grid")
+        return k
+
+    i0, i1 = index(lats, b), index(lats, b + grid_delta)
+    j0, j1 = index(lons, l), index(lons, (l + grid_delta) % 360)
+
+    i = np.stack([i0, i1, i0, i1], axis=-1)
+    j = np.stack([j0, j0, j1, j1], axis=-1)
+    w = np.stack([(1.0-u) * (1.0-v), u * (1.0-v),
+                  (1.0-u) *      v,  u *      v ], axis=-1)
+    return i, j, w
+
+def load_group(content, sites, grid_delta=0.25):
+    """Load GFS profiles of many `sites` from one GRIB2 content.
+
+    The GRIB2 content should cover the bounding box of all `sites`,
+    e.g., downloaded from `nomads.group_url()`.  All fields are
+    stacked and interpolated to all sites and levels at once.
+
+    """
+    F, lats, lons = fields(content)
+
+    i, j, w = weights(sites, lats, lons, grid_delta)
+
+    # Interpolate all variables, levels, and sites in one go; shape
+    # of `f` is (variable, level, site)
+    return profiles((F[..., i, j] * w).sum(axis=-1))
+
+def load_points(content, sites, grid_delta=0.25):
+    """Load GFS profiles of many `sites` from large GRIB2 content.
+
+    Unlike `load_group()`, fields are not stacked.  Each message is
+    decoded once and immediately interpolated to all sites, so this
+    also works for global fields, e.g., byte ranges of the full
+    pgrb2 files.  Messages of other variables or levels are skipped.
+
+    """
+    f   = np.full((len(load_map), len(levels), len(sites)), np.nan)
+    ijw = None
+    for g in map(decode, messages(content)):
+        k = slot(g)
+        if k is None:
+            continue
+        if ijw is None:
+            lats, lons = g.latlons()
+            ijw = weights(sites, lats[:,0], lons[0,:], grid_delta)
+
+        i, j, w = ijw
+        f[k] = (np.ma.filled(g.values, np.nan)[i, j] * w).sum(axis=-1)
+
+    return profiles(f)
+
+def profiles(f):
+    """Split interpolated fields of shape (variable, level, site) into
+    per-site profiles.
+
+    Missing values are replaced by their placeholders and listed as
+    (profile name, level) pairs in the "missing" entry of each
+    profile.
+
+    """
+    ds = [{'P':np.array(levels), 'missing':[]} for _ in range(f.shape[-1])]
+    for m, (k, (_, bad)) in enumerate(load_map.items()):
+        nan = np.isnan(f[m])
+        a   = np.where(nan, bad, f[m])
+        for s, d in enumerate(ds):
+            d[k] = a[:,s]
+            d['missing'].extend((k, levels[n]) for n in np.flatnonzero(nan[:,s]))
+
+    return ds
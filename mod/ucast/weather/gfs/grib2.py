@@ -0,0 +1,267 @@
+# Copyright (C) 2020 Chi-kwan Chan
+# Copyright (C) 2020 Steward Observatory
+#
+# This file is part of `ucast`.
+#
+# `Ucast` is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# `Ucast` is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with `ucast`.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Minimal GRIB2 reader.
+
+Only what the NOMADS GFS output needs is supported: regular lat-lon
+grids (grid definition template 3.0), the common product definition
+templates (4.0-4.15, which share their first 34 octets), and simple
+(5.0) and complex packing with or without spatial differencing (5.2
+and 5.3).  Decoded messages provide the subset of the `pygrib`
+message interface used by `grib`.
+
+"""
+
+import struct
+import numpy as np
+
+CHUNK = 65536  # Number of integers unpacked at a time
+
+# Type of fixed surface (code table 4.5) -> pygrib's `typeOfLevel`
+surfaces = {
+    1  : 'surface',
+    100: 'isobaricInhPa',
+    103: 'heightAboveGround',
+}
+
+def signed(b):
+    """Decode a GRIB2 sign-magnitude integer."""
+    n = int.from_bytes(b, 'big')
+    m = 1 << (8 * len(b) - 1)
+    return -(n & ~m) if n & m else n
+
+def unpack(bits, offset, widths):
+    """Unpack unsigned integers of variable `widths` from a bit array.
+
+    Args:
+        bits: Array of bits from `np.unpackbits()`.
+        offset: Position of the first bit.
+        widths: Number of bits of each integer.
+
+    Returns:
+        The integers and the position of the next bit.
+
+    """
+    widths = np.asarray(widths, dtype=np.int64)
+    start  = offset + np.concatenate([[0], np.cumsum(widths)[:-1]])
+
+    # Gather the bits of CHUNK integers at a time to bound the memory
+    x = np.zeros(len(widths), dtype=np.int64)
+    for c in range(0, len(widths), CHUNK):
+        w, s = widths[c:c+CHUNK], start[c:c+CHUNK]
+        if w.max() == 0:
+            continue
+        k     = np.arange(w.max())
+        valid = k[None,:] < w[:,None]
+        idx   = np.where(valid, s[:,None] + k[None,:], 0)
+        shift = np.where(valid, w[:,None] - 1 - k[None,:], 0)
+        x[c:c+CHUNK] = ((bits[idx].astype(np.int64) << shift) * valid).sum(axis=1)
+
+    return x, offset + int(widths.sum())
+
+def octets(n):
+    """Round a number of bits up to whole octets."""
+    return -(-n // 8) * 8
+
+class Message:
+    """A decoded GRIB2 message.
+
+    Args:
+        content: Bytes of exactly one GRIB2 message.
+
+    """
+    def __init__(self, content):
+        if content[:4] != b'GRIB' or content[7] != 2:
+            raise ValueError("Not a GRIB2 message")
+
+        self.discipline = content[6]
+
+        sections = {}
+        i = 16
+        while content[i:i+4] != b'7777':
+            n = int.from_bytes(content[i:i+4], 'big')
+            if n < 5 or i + n > len(content):
+                raise ValueError("Truncated GRIB2 message")
+            sections[content[i+4]] = content[i:i+n]
+            i += n
+
+        for s in (3, 4, 5, 7):
+            if s not in sections:
+                raise ValueError(f"Section {s} missing from GRIB2 message")
+
+        self.grid(sections[3])
+        self.product(sections[4])
+        self.sec5   = sections[5]
+        self.sec6   = sections.get(6)
+        self.sec7   = sections[7]
+        self._values = None
+
+    def grid(self, s):
+        """Parse the grid definition section; octet numbers below are
+        those of the GRIB2 specification minus one."""
+        t = struct.unpack('>H', s[12:14])[0]
+        if t != 0:
+            raise ValueError(f"Unsupported grid definition template 3.{t}")
+
+        self.Ni, self.Nj = struct.unpack('>II', s[30:38])
+        basic, subdiv    = struct.unpack('>II', s[38:46])
+        unit = 1e-6 if basic in (0, 0xFFFFFFFF) else basic / subdiv
+
+        self.la1  = signed(s[46:50]) * unit
+        self.lo1  = signed(s[50:54]) * unit
+        self.la2  = signed(s[55:59]) * unit
+        self.lo2  = signed(s[59:63]) * unit
+        self.scan = s[71]
+
+    def product(self, s):
+        t = struct.unpack('>H', s[7:9])[0]
+        if t > 15:
+            raise ValueError(f"Unsupported product definition template 4.{t}")
+
+        self.parameterCategory = s[9]
+        self.parameterNumber   = s[10]
+
+        surface, scale = s[22], signed(s[23:24])
+        value = int.from_bytes(s[24:28], 'big')
+        self.typeOfLevel = surfaces.get(surface, str(surface))
+        self.level = value * 10.0**(-scale)
+        if surface == 100:
+            self.level = round(self.level / 100) # Pa to hPa, as pygrib
+
+    def latlons(self):
+        """Latitudes and longitudes of the grid points, as `values`."""
+        lo2 = self.lo2
+        if self.scan & 0x80:
+            lo2 = lo2 if lo2 < self.lo1 else lo2 - 360
+        else:
+            lo2 = lo2 if lo2 > self.lo1 or self.Ni == 1 else lo2 + 360
+        lats = np.linspace(self.la1, self.la2, self.Nj)
+        lons = np.linspace(self.lo1, lo2,      self.Ni)
+        return np.meshgrid(lats, lons, indexing='ij')
+
+    @property
+    def values(self):
+        """Decoded values with shape (Nj, Ni) in scanning order; NaN
+        where the bitmap or missing value management says so."""
+        if self._values is None:
+            self._values = self.decode()
+        return self._values
+
+    def decode(self):
+        s5 = self.sec5
+        n, t = struct.unpack('>IH', s5[5:11])
+        R    = struct.unpack('>f', s5[11:15])[0]
+        E    = signed(s5[15:17])
+        D    = signed(s5[17:19])
+        nbit = s5[19]
+
+        data = self.sec7[5:]
+        if t == 0:
+            x, ok = self.simple(data, n, nbit), None
+        elif t in (2, 3):
+            x, ok = self.complex(data, n, nbit, t)
+        else:
+            raise ValueError(f"Unsupported data representation template 5.{t}")
+
+        y = (R + x * 2.0**E) / 10.0**D
+        if ok is not None:
+            y = np.where(ok, y, np.nan)
+
+        # Scatter the packed values onto the grid using the bitmap
+        npts = self.Ni * self.Nj
+        if self.sec6 is not None and self.sec6[5] == 0:
+            bitmap = np.unpackbits(np.frombuffer(self.sec6[6:], dtype=np.uint8))[:npts]
+            v = np.full(npts, np.nan)
+            v[bitmap.astype(bool)] = y
+        elif self.sec6 is not None and self.sec6[5] != 255:
+            raise ValueError("Predefined or previous bitmaps are not supported")
+        else:
+            v = y
+
+        if self.scan & 0x20: # adjacent points in j direction
+            return v.reshape(self.Ni, self.Nj).T
+        return v.reshape(self.Nj, self.Ni)
+
+    def simple(self, data, n, nbit):
+        if nbit == 0:
+            return np.zeros(n)
+        bits = np.unpackbits(np.frombuffer(data, dtype=np.uint8))
+        return unpack(bits, 0, np.full(n, nbit))[0].astype(float)
+
+    def complex(self, data, n, nbit, t):
+        s5 = self.sec5
+        missing  = s5[22]
+        ng       = int.from_bytes(s5[31:35], 'big')
+        wref     = s5[35]
+        wbit     = s5[36]
+        lref     = int.from_bytes(s5[37:41], 'big')
+        linc     = s5[41]
+        llast    = int.from_bytes(s5[42:46], 'big')
+        lbit     = s5[46]
+
+        # Spatial differencing: initial values and overall minimum
+        # are stored at the beginning of the data section
+        if t == 3:
+            order, size = s5[47], s5[48]
+            extra = [signed(data[k*size:(k+1)*size]) for k in range(order + 1)]
+            data  = data[(order + 1) * size:]
+
+        bits = np.unpackbits(np.frombuffer(data, dtype=np.uint8))
+
+        refs,    o = unpack(bits, 0,         np.full(ng, nbit))
+        widths,  o = unpack(bits, octets(o), np.full(ng, wbit))
+        lengths, o = unpack(bits, octets(o), np.full(ng, lbit))
+        widths  = widths + wref
+        lengths = lengths * linc + lref
+        lengths[-1] = llast
+        if lengths.sum() != n:
+            raise ValueError("Inconsistent group lengths in GRIB2 message")
+
+        x, _ = unpack(bits, octets(o), np.repeat(widths, lengths))
+        w    = np.repeat(widths, lengths)
+        r    = np.repeat(refs,   lengths)
+
+        # Missing value management (code table 5.5): all-ones (and,
+        # for 2, all-ones minus one) mark missing values
+        ok = None
+        if missing in (1, 2):
+            full = (1 << w) - 1
+            ok   = np.where(w > 0, x != full, r != (1 << nbit) - 1)
+            if missing == 2:
+                ok &= np.where(w > 0, x != full - 1, r != (1 << nbit) - 2)
+
+        x = x + r
+
+        if t == 3:
+            m   = np.ones(n, dtype=bool) if ok is None else ok
+            x[m] = self.undifference(x[m], order, extra[:order], extra[order])
+
+        return x.astype(float), ok
+
+    @staticmethod
+    def undifference(x, order, first, minimum):
+        """Invert the spatial differencing of order 1 or 2."""
+        x = x + minimum
+        if len(x) <= order:
+            return np.array(first[:len(x)], dtype=np.int64)
+        if order == 1:
+            return first[0] + np.cumsum(np.r_[0, x[1:]])
+        if order == 2:
+            d = np.cumsum(np.r_[first[1] - first[0], x[2:]])
+            return np.r_[first[0], first[0] + np.cumsum(d)]
+        raise ValueError(f"Unsupported order of spatial differencing {order}")
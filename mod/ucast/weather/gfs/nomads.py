@@ -18,10 +18,15 @@
 
 from math import floor
 
+import os
 import sys
 import requests
 import time
 
+# Base URL of NOMADS; point it to a stand-in server (see `standin`)
+# for offline runs and benchmarks
+BASE_URL = os.environ.get("UCAST_NOMADS_URL", "https://nomads.ncep.noaa.gov")
+
 # GFS variables to be requested
 variables = (
     "HGT",   # Geopotential height [m]
@@ -32,6 +37,17 @@ variables = (
     "ICMR",  # Cloud ice mass mixing ratio [kg liquid / kg air]
 )
 
+# GRIB2 (discipline, parameter category, parameter number) of the
+# variables; "O3MR", "CLWMR", and "ICMR" are NCEP local parameters
+parameters = {
+    "HGT"  : (0,  3,   5),
+    "TMP"  : (0,  0,   0),
+    "O3MR" : (0, 14, 192),
+    "RH"   : (0,  1,   1),
+    "CLWMR": (0,  1,  22),
+    "ICMR" : (0,  1,  23),
+}
+
 # GFS grid levels [mbar]
 levels = (
     1, 2, 3, 5, 7, 10, 20, 30, 50, 70, 100, 150, 200, 250, 300, 350, 400,
@@ -40,7 +56,7 @@ levels = (
 
 def cgi_url(g):
     """URL for the CGI interface for getting GFS data."""
-    return f"https://nomads.ncep.noaa.gov/cgi-bin/filter_gfs_{g}_1hr.pl"
+    return f"{BASE_URL}/cgi-bin/filter_gfs_{g}_1hr.pl"
 
 def product_query(cycle, g, p):
     """Query string for requesting the kind of data product."""
@@ -62,12 +78,20 @@ def subregion_query(lat, lon, gridsz):
     t = b + gridsz
     return f"subregion=&leftlon={l}&rightlon={r}&toplat={t}&bottomlat={b}"
 
+def bbox_query(sites, gridsz):
+    """Query string for the grid subset covering all `sites`."""
+    l = floor(min(s.lon for s in sites) / gridsz) * gridsz
+    b = floor(min(s.lat for s in sites) / gridsz) * gridsz
+    r = floor(max(s.lon for s in sites) / gridsz) * gridsz + gridsz
+    t = floor(max(s.lat for s in sites) / gridsz) * gridsz + gridsz
+    return f"subregion=&leftlon={l}&rightlon={r}&toplat={t}&bottomlat={b}"
+
 def cycle_query(cycle):
     """Query string for requesting the specific data and production cycle"""
     return f"dir=%2Fgfs.{cycle:%Y%m%d}%2F{cycle:%H}%2Fatmos"
 
-def data_url(site, cycle, product, gridsz):
-    """Construct the full data request URL.
+def query_url(cycle, product, gridsz, subregion):
+    """Construct the full data request URL for a subregion query.
 
     These include the base URL for the NOMADS CGI, and various strings
     for formatting the arguments given to it.  Note that some
@@ -89,7 +113,16 @@ def data_url(site, cycle, product, gridsz):
         product_query(cycle, g, p),
         '&'.join(level_query(l)    for l in levels),
         '&'.join(variable_query(v) for v in variables),
-        subregion_query(site.lat, site.lon, gridsz),
+        subregion,
         cycle_query(cycle),
     ])
     return '?'.join([cgi_url(g), query])
+
+def data_url(site, cycle, product, gridsz):
+    """Data request URL for the grid cell containing `site`."""
+    return query_url(cycle, product, gridsz,
+                     subregion_query(site.lat, site.lon, gridsz))
+
+def group_url(sites, cycle, product, gridsz):
+    """Data request URL for the bounding box of a group of `sites`."""
+    return query_url(cycle, product, gridsz, bbox_query(sites, gridsz))
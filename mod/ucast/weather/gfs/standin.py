@@ -0,0 +1,247 @@
+# Copyright (C) 2020 Chi-kwan Chan
+# Copyright (C) 2020 Steward Observatory
+#
+# This file is part of `ucast`.
+#
+# `Ucast` is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# `Ucast` is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with `ucast`.  If not, see <http://www.gnu.org/licenses/>.
+
+import random
+import re
+import time
+
+from datetime     import datetime
+from functools    import lru_cache
+from http.server  import HTTPServer, BaseHTTPRequestHandler
+from socketserver import ThreadingMixIn
+from threading    import Thread, Lock
+from urllib.parse import urlsplit, parse_qs
+
+from .       import synthetic
+from .nomads import variables, levels
+from .watch  import PROD_PATH
+
+# GFS forecast hours; see `ucast.utils.forecast_hrs`
+HOURS = list(range(120+1)) + list(range(123, 384+1, 3))
+
+CHUNK = 8192  # Write size when throttling the bandwidth
+
+file_re  = re.compile(r"gfs\.t(\d\d)z\.pgrb2\.(\d)p(\d\d)\.(f\d{3}|anl)$")
+dir_re   = re.compile(r"/gfs\.(\d{8})/(\d\d)/atmos$")
+lev_re   = re.compile(r"lev_(\d+)_mb$")
+list_re  = re.compile(re.escape(PROD_PATH) + r"/gfs\.(\d{8})/(\d\d)/atmos/?$")
+full_re  = re.compile(re.escape(PROD_PATH) + r"/gfs\.(\d{8})/(\d\d)/atmos/"
+                      r"gfs\.t(\d\d)z\.pgrb2\.(\d)p(\d\d)\.(f\d{3}|anl)(\.idx)?$")
+range_re = re.compile(r"bytes=(\d+)-(\d*)$")
+
+@lru_cache(maxsize=4)
+def full(cycle, product, gridsz):
+    """Synthetic global pgrb2 file and its inventory.
+
+    Only the variables and levels used by `ucast` are included.  This
+    is meant for coarse grids (e.g., 1.00 degree); a 0.25 degree file
+    takes a lot of time and memory to synthesize.
+
+    """
+    desc = "anl" if product is None else f"{product} hour fcst"
+
+    chunks, lines, offset = [], [], 0
+    for v in variables:
+        for l in levels:
+            m = synthetic.subset(cycle, product, gridsz, [v], [l], 0, 360 - gridsz, 90, -90)
+            lines.append(f"{len(chunks)+1}:{offset}:d={cycle:%Y%m%d%H}:{v}:{l} mb:{desc}:")
+            chunks.append(m)
+            offset += len(m)
+
+    return b''.join(chunks), '\n'.join(lines).encode() + b'\n'
+
+class Handler(BaseHTTPRequestHandler):
+
+    protocol_version = "HTTP/1.1" # keep-alive, like NOMADS
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    def do_GET(self):
+        s = self.server
+        time.sleep(s.delay())
+
+        code = s.error()
+        if code is not None:
+            return self.send_error(code)
+
+        u = urlsplit(self.path)
+        try:
+            if u.path.startswith("/cgi-bin/filter_gfs_"):
+                content = self.subset(u.query)
+            elif list_re.match(u.path):
+                content = self.listing(u.path)
+            elif full_re.match(u.path):
+                content = self.full(u.path)
+            else:
+                content = None
+        except (KeyError, ValueError) as e:
+            return self.send_error(400, str(e))
+
+        if content is None:
+            return self.send_error(404)
+
+        # Single byte-range requests, as used by `bulk`
+        r = range_re.match(self.headers.get("Range", ""))
+        if r:
+            a = int(r.group(1))
+            b = int(r.group(2)) if r.group(2) else len(content) - 1
+            if a >= len(content):
+                return self.send_error(416)
+            b = min(b, len(content) - 1)
+            self.send_response(206)
+            self.send_header("Content-Range", f"bytes {a}-{b}/{len(content)}")
+            content = content[a:b+1]
+        else:
+            self.send_response(200)
+
+        self.send_header("Content-Type",   "application/octet-stream")
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        s.write(self.wfile, content)
+
+    def subset(self, query):
+        """GRIB2 content for a `filter_gfs_*` CGI query."""
+        if self.server.fixtures is not None:
+            content = self.server.fixtures.get(self.path)
+            if content is not None or not self.server.synthesize:
+                return content
+
+        q = parse_qs(query, keep_blank_values=True)
+        f = file_re.match(q["file"][0])
+        d = dir_re.match(q["dir"][0])
+        if f is None or d is None or f.group(1) != d.group(2):
+            raise ValueError("Invalid file or dir")
+
+        cycle = datetime.strptime(d.group(1) + d.group(2), "%Y%m%d%H")
+        if cycle > datetime.utcnow():
+            return None # not produced yet
+
+        p = f.group(4)
+        return synthetic.subset(
+            cycle,
+            None if p == "anl" else int(p[1:]),
+            int(f.group(2)) + int(f.group(3)) / 100,
+            [k[4:] for k in q if k.startswith("var_")],
+            [int(m.group(1)) for m in map(lev_re.match, q) if m],
+            float(q["leftlon"][0]),
+            float(q["rightlon"][0]),
+            float(q["toplat"][0]),
+            float(q["bottomlat"][0]),
+        )
+
+    def full(self, path):
+        """Full pgrb2 file or its inventory."""
+        f     = full_re.match(path)
+        cycle = datetime.strptime(f.group(1) + f.group(2), "%Y%m%d%H")
+        if f.group(2) != f.group(3) or cycle > datetime.utcnow():
+            return None
+
+        p = f.group(6)
+        content, idx = full(cycle,
+                            None if p == "anl" else int(p[1:]),
+                            int(f.group(4)) + int(f.group(5)) / 100)
+        return idx if f.group(7) else content
+
+    def listing(self, path):
+        """HTML directory listing of a GFS cycle."""
+        d     = list_re.match(path)
+        cycle = datetime.strptime(d.group(1) + d.group(2), "%Y%m%d%H")
+        if cycle > datetime.utcnow():
+            return None
+
+        names = [f"gfs.t{cycle:%H}z.pgrb2.0p25.f{h:03d}{e}" for h in HOURS for e in ("", ".idx")]
+        return "\n".join(["<html><body>"] +
+                         [f'<a href="{n}">{n}</a><br>' for n in names] +
+                         ["</body></html>"]).encode()
+
+class StandIn(ThreadingMixIn, HTTPServer):
+    """Local stand-in for the NOMADS GFS services.
+
+    The server answers the `filter_gfs_*` CGI queries built by
+    `nomads.data_url()` and `nomads.group_url()`, the directory
+    listings probed by `watch.available()`, and the (byte-range)
+    requests of full pgrb2 files and inventories made by `bulk`.
+    GRIB2 subsets are served from recorded `fixtures` (a
+    `ucast.cache.GribCache`, e.g., filled by a real run with
+    `--cache`) or synthesized by `synthetic`.
+
+    Args:
+        address: (host, port) to bind; port 0 picks a free port.
+        latency: Delay of each response in seconds.
+        jitter: Maximum random extra delay in seconds.
+        errors: Dictionary mapping HTTP status codes (e.g., 404, 429,
+            503) to the probability of injecting them.
+        bandwidth: Throttle responses to this many bytes per second;
+            None for no limit.
+        fixtures: Optional `GribCache` with recorded responses.
+        synthesize: Synthesize responses missing from `fixtures`.
+        seed: Seed of the random number generator.
+        verbose: Log every request.
+
+    """
+    daemon_threads = True
+
+    def __init__(self, address=("127.0.0.1", 0), latency=0.0, jitter=0.0,
+                 errors=None, bandwidth=None, fixtures=None, synthesize=True,
+                 seed=None, verbose=False):
+        super().__init__(address, Handler)
+
+        self.latency    = latency
+        self.jitter     = jitter
+        self.errors     = dict(errors or {})
+        self.bandwidth  = bandwidth
+        self.fixtures   = fixtures
+        self.synthesize = synthesize
+        self.verbose    = verbose
+        self.random     = random.Random(seed)
+        self.lock       = Lock()
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def delay(self):
+        with self.lock:
+            return self.latency + self.jitter * self.random.random()
+
+    def error(self):
+        """Randomly pick an injected error status, or None."""
+        with self.lock:
+            r = self.random.random()
+        for code, p in self.errors.items():
+            if r < p:
+                return code
+            r -= p
+        return None
+
+    def write(self, f, content):
+        if not self.bandwidth:
+            f.write(content)
+            return
+        for i in range(0, len(content), CHUNK):
+            chunk = content[i:i+CHUNK]
+            f.write(chunk)
+            time.sleep(len(chunk) / self.bandwidth)
+
+    def start(self):
+        """Serve in a background thread; return self for chaining."""
+        Thread(target=self.serve_forever, daemon=True).start()
+        return self
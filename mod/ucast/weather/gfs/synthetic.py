@@ -0,0 +1,173 @@
+# Copyright (C) 2020 Chi-kwan Chan
+# Copyright (C) 2020 Steward Observatory
+#
+# This file is part of `ucast`.
+#
+# `Ucast` is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# `Ucast` is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with `ucast`.  If not, see <http://www.gnu.org/licenses/>.
+
+import struct
+import numpy as np
+
+from datetime import datetime
+
+from .nomads import parameters, levels as gfs_levels
+
+# Physical constants for the synthetic atmosphere
+R_DRY  = 287.05   # specific gas constant of dry air [J / kg / K]
+G_STD  = 9.80665  # standard gravity [m / s^2]
+LAPSE  = 0.0065   # tropospheric lapse rate [K / m]
+T_TROP = 216.65   # tropopause temperature [K]
+Z_1000 = 110.0    # height of the 1000 mbar level [m]
+
+NBITS  = 16       # bits per packed value
+
+def atmosphere(P, lat, lon, hr):
+    """Smooth, deterministic synthetic GFS-like atmosphere.
+
+    The profile is a standard atmosphere whose surface temperature,
+    humidity, clouds, and ozone vary smoothly with latitude,
+    longitude, and time, so interpolation and caching can be tested
+    without access to NOMADS.
+
+    Args:
+        P: Pressure levels in mbar, ordered from the top.
+        lat, lon: Latitudes and longitudes in degrees; arrays of the
+            same shape.
+        hr: Hours since an arbitrary epoch, e.g., cycle plus forecast
+            hour.
+
+    Returns:
+        Dictionary mapping the NOMADS variable names to arrays of
+        shape `(len(P),) + lat.shape`.
+
+    """
+    P   = np.asarray(P, dtype=float).reshape((-1,) + (1,) * np.ndim(lat))
+    phi = np.radians(lat)
+    lam = np.radians(lon)
+    t   = 2 * np.pi * hr / 24
+
+    # Temperature: adiabatic troposphere capped at the tropopause, and
+    # a warming stratosphere
+    T0 = 300 - 45 * np.sin(phi)**2 + 3 * np.sin(t + lam)
+    T  = np.maximum(T0 * (P / 1000)**(R_DRY * LAPSE / G_STD), T_TROP)
+    T  = np.where(P < 100, T_TROP + 30 * np.log10(100 / P), T)
+
+    # Geopotential height from the hypsometric equation, integrated
+    # upward from the 1000 mbar level
+    dz = (R_DRY / G_STD) * 0.5 * (T[:-1] + T[1:]) * np.log(P[1:] / P[:-1])
+    z  = Z_1000 + np.concatenate([np.cumsum(dz[::-1], axis=0)[::-1],
+                                  np.zeros((1,) + dz.shape[1:])])
+
+    # Humidity, clouds, and ozone
+    w   = 0.5 + 0.5 * np.sin(t / 4 + lam + phi)
+    RH  = np.clip(5 + 80 * w * (P / 1000)**2, 0, 100)
+    lmr = 2e-4 * w * np.exp(-((P - 800) / 60)**2) * (T > 250)
+    imr = 5e-5 * (1 - w) * np.exp(-((P - 300) / 50)**2)
+    o3  = 3e-8 + 1e-5 * np.exp(-(np.log(P / 10) / 1.2)**2)
+
+    ones = np.ones_like(T)
+    return {
+        "HGT"  : z,
+        "TMP"  : T,
+        "O3MR" : o3  * ones,
+        "RH"   : RH  * ones,
+        "CLWMR": lmr * ones,
+        "ICMR" : imr * ones,
+    }
+
+def signed(n, x):
+    """Encode a GRIB2 sign-magnitude integer with `n` octets."""
+    m = 1 << (8 * n - 1)
+    return (abs(x) | m if x < 0 else x).to_bytes(n, 'big')
+
+def message(values, lats, lons, var, level, cycle, product=None):
+    """Encode one GRIB2 message with simple packing.
+
+    The grid is a regular lat-lon grid scanned from west to east and
+    from south to north, as in the subregion output of the NOMADS
+    filter.
+
+    Args:
+        values: Array of shape (len(lats), len(lons)).
+        lats, lons: Ascending latitudes and longitudes in degrees.
+        var: NOMADS variable name, e.g., "TMP".
+        level: Isobaric level in mbar.
+        cycle: GFS forecast cycle.
+        product: Forecast hour, or None for the analysis.
+
+    Returns:
+        The GRIB2 message as bytes.
+
+    """
+    discipline, category, number = parameters[var]
+
+    v      = np.asarray(values, dtype=float).ravel()
+    nj, ni = len(lats), len(lons)
+    di     = (lons[-1] - lons[0]) / (ni - 1) if ni > 1 else 0
+    dj     = (lats[-1] - lats[0]) / (nj - 1) if nj > 1 else 0
+    udeg   = lambda x: round(x * 1e6)
+
+    # Section 1: identification; NCEP (7) as the originating centre
+    # so the local parameters are decoded
+    sec1 = struct.pack('>IBHHBBBHBBBBBBB', 21, 1, 7, 0, 2, 1, 1,
+                       cycle.year, cycle.month, cycle.day, cycle.hour, 0, 0, 0, 1)
+
+    # Section 3: grid definition template 3.0 (regular lat-lon)
+    tmpl = (struct.pack('>BBIBIBI', 6, 0, 0, 0, 0, 0, 0) +
+            struct.pack('>IIII', ni, nj, 0, 0xFFFFFFFF) +
+            signed(4, udeg(lats[0])) + struct.pack('>I', udeg(lons[0] % 360)) + b'\x30' +
+            signed(4, udeg(lats[-1])) + struct.pack('>I', udeg(lons[-1] % 360)) +
+            struct.pack('>II', udeg(di), udeg(dj)) + b'\x40')
+    sec3 = struct.pack('>IBBIBBH', 14 + len(tmpl), 3, 0, ni * nj, 0, 0, 0) + tmpl
+
+    # Section 4: product definition template 4.0 on an isobaric level
+    fhr  = product if isinstance(product, int) else 0
+    sec4 = (struct.pack('>IBHH', 34, 4, 0, 0) +
+            struct.pack('>BBBBBHBBIBBIBBI', category, number, 2, 0, 96, 0, 0, 1,
+                        fhr, 100, 0, level * 100, 255, 255, 0xFFFFFFFF))
+
+    # Section 5: data representation template 5.0 (simple packing);
+    # Y = R + X * 2^E, with the reference value R rounded down
+    R = np.float32(v.min())
+    if R > v.min():
+        R = np.nextafter(R, np.float32(-np.inf))
+    r = v.max() - float(R)
+    E = int(np.ceil(np.log2(r / (2**NBITS - 1)))) if r > 0 else 0
+    X = np.clip(np.round((v - float(R)) / 2.0**E), 0, 2**NBITS - 1).astype('>u4')
+    sec5 = (struct.pack('>IBIH', 21, 5, ni * nj, 0) + struct.pack('>f', R) +
+            signed(2, E) + signed(2, 0) + struct.pack('>BB', NBITS, 0))
+
+    # Section 6: no bitmap; section 7: packed data
+    sec6 = struct.pack('>IBB', 6, 6, 255)
+    bits = np.unpackbits(X.view(np.uint8).reshape(-1, 4), axis=1)[:, 32-NBITS:]
+    data = np.packbits(bits.ravel()).tobytes()
+    sec7 = struct.pack('>IB', 5 + len(data), 7) + data
+
+    body = sec1 + sec3 + sec4 + sec5 + sec6 + sec7 + b'7777'
+    return b'GRIB' + struct.pack('>HBBQ', 0, discipline, 2, 16 + len(body)) + body
+
+def subset(cycle, product, gridsz, variables, levels, left, right, top, bottom):
+    """Synthetic GRIB2 content as returned by the NOMADS filter CGI."""
+    lats = np.arange(bottom, top + gridsz / 2, gridsz)
+    lons = np.arange(left,   right + gridsz / 2, gridsz)
+    lat, lon = np.meshgrid(lats, lons, indexing='ij')
+
+    # The hypsometric integration needs all levels ordered from the
+    # top, so heights do not depend on the requested subset
+    P  = sorted(set(levels) | set(gfs_levels))
+    hr = (cycle - datetime(1970, 1, 1)).total_seconds() / 3600
+    a  = atmosphere(P, lat, lon, hr + (product if isinstance(product, int) else 0))
+
+    return b''.join(message(a[v][P.index(l)], lats, lons, v, l, cycle, product)
+                    for v in variables for l in levels)
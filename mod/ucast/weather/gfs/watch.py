@@ -0,0 +1,96 @@
+# Copyright (C) 2020 Chi-kwan Chan
+# Copyright (C) 2020 Steward Observatory
+#
+# This file is part of `ucast`.
+#
+# `Ucast` is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# `Ucast` is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with `ucast`.  If not, see <http://www.gnu.org/licenses/>.
+
+import re
+import time
+import requests
+
+from ...request import transport, errln, CONN_TIMEOUT, READ_TIMEOUT
+from .          import nomads
+
+PROD_PATH  = "/pub/data/nccf/com/gfs/prod"
+POLL_DELAY = 60         # Delay between directory listings in seconds
+MAX_WAIT   = 8 * 3600   # Give up on unpublished hours after this many seconds
+
+def listing_url(cycle):
+    """URL of the NOMADS directory listing of a GFS cycle."""
+    return f"{nomads.BASE_URL}{PROD_PATH}/gfs.{cycle:%Y%m%d}/{cycle:%H}/atmos/"
+
+def available(cycle, gridsz=0.25):
+    """Forecast hours of `cycle` that are already published on NOMADS.
+
+    A forecast hour is considered published once its GRIB2 inventory
+    (".idx") file appears in the directory listing, which NCEP writes
+    after the GRIB2 file itself is complete.  One listing is a single
+    small request no matter how many hours are available.
+
+    Args:
+        cycle: GFS forecast cycle.
+        gridsz: Grid spacing in degrees.
+
+    Returns:
+        Set of published forecast hours; empty if the cycle directory
+        does not exist yet.
+
+    """
+    g = f"{gridsz:.2f}".replace('.', 'p')
+    r = transport.get(listing_url(cycle), timeout=(CONN_TIMEOUT, READ_TIMEOUT))
+    if r.status_code == 404:
+        return set()
+    r.raise_for_status()
+
+    pattern = re.compile(rf"gfs\.t{cycle:%H}z\.pgrb2\.{g}\.f(\d{{3}})\.idx")
+    return {int(h) for h in pattern.findall(r.text)}
+
+def published(cycle, hrs, gridsz=0.25, poll=POLL_DELAY, wait=MAX_WAIT):
+    """Yield forecast hours of `cycle` as soon as they are published.
+
+    Args:
+        cycle: GFS forecast cycle.
+        hrs: Forecast hours to wait for.
+        gridsz: Grid spacing in degrees.
+        poll: Delay between probes in seconds.
+        wait: Stop waiting for the remaining hours after this many
+            seconds.
+
+    Yields:
+        Sorted lists of forecast hours that became available since
+        the previous probe.
+
+    """
+    pending  = set(hrs)
+    deadline = time.monotonic() + wait
+
+    while pending:
+        probe = time.monotonic()
+        try:
+            new = available(cycle, gridsz) & pending
+        except requests.exceptions.RequestException as e:
+            errln(f"Failed to probe NOMADS: {e}")
+            new = set()
+
+        if new:
+            pending -= new
+            yield sorted(new)
+        elif time.monotonic() > deadline:
+            errln(f"Gave up waiting for {len(pending)} forecast hours of {cycle}")
+            return
+
+        # Processing the yielded hours counts toward the poll delay
+        if pending:
+            time.sleep(max(0, probe + poll - time.monotonic()))
@@ -40,9 +40,11 @@ setup(
         'matplotlib>=3.2.2',
         'numpy>=1.18.5',
         'pandas>=1.0.5',
-        'pygrib>=2.0.4',
         'requests>=2.24.0',
         'tqdm>=4.46.1',
         'bokeh>=2.3.0'
     ],
+    extras_require={
+        'pygrib': ['pygrib>=2.0.4'], # optional GRIB2 decoder backend
+    },
 )
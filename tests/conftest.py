@@ -0,0 +1,36 @@
+# Copyright (C) 2020 Chi-kwan Chan
+# Copyright (C) 2020 Steward Observatory
+#
+# This file is part of `ucast`.
+#
+# `Ucast` is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# `Ucast` is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with `ucast`.  If not, see <http://www.gnu.org/licenses/>.
+
+from datetime import datetime, timedelta
+
+import pandas as pd
+import pytest
+
+CYCLE = datetime(2020, 7, 1, 6)
+
+@pytest.fixture
+def table():
+    """Factory of small forecast tables of `cycle` at the forecast
+    hours `hrs`; tau and Tb grow with the hour unless `tau` is given"""
+    def make(hrs=range(3), cycle=CYCLE, tau=None):
+        return pd.DataFrame({
+            'date': [(cycle + timedelta(hours=hr)).strftime('%Y-%m-%d_%H.%M.%S') for hr in hrs],
+            'tau' : [0.05 + hr if tau is None else tau for hr in hrs],
+            'Tb'  : [12.0 + hr for hr in hrs],
+        })
+    return make
@@ -0,0 +1,70 @@
+# Copyright (C) 2020 Chi-kwan Chan
+# Copyright (C) 2020 Steward Observatory
+#
+# This file is part of `ucast`.
+#
+# `Ucast` is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# `Ucast` is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with `ucast`.  If not, see <http://www.gnu.org/licenses/>.
+
+from datetime import datetime
+
+import numpy as np
+
+from ucast.accum import Accumulator
+
+COLUMNS = ['date', 'tau', 'Tb']
+
+def test_resume(tmp_path):
+    part  = str(tmp_path / 'table.tsv.part')
+    cycle = datetime(2020, 7, 1, 6)
+
+    with Accumulator(cycle, range(4), COLUMNS, part=part) as acc:
+        acc.add(2, {'tau':0.2, 'Tb':20.0})
+        acc.add(0, {'tau':0.1, 'Tb':10.0, 'pwv':1.0}) # extra keys are ignored
+
+    # Interrupted while writing the next row
+    with open(part, 'a') as f:
+        f.write('3\t0.3')
+
+    acc = Accumulator(cycle, range(4), COLUMNS, part=part)
+    assert acc.resumed == 2
+    assert acc.todo == [1, 3]
+
+    acc.add(3, {'tau':0.3, 'Tb':30.0})
+    acc.close()
+    assert Accumulator(cycle, range(4), COLUMNS, part=part).todo == [1]
+
+    df = acc.table()
+    assert list(df.columns) == COLUMNS
+    assert list(df.date) == ['2020-07-01_06.00.00', '2020-07-01_08.00.00', '2020-07-01_09.00.00']
+    assert np.array_equal(df.tau, [0.1, 0.2, 0.3])
+
+    # A checkpoint with different columns or solver is not resumed
+    assert Accumulator(cycle, range(4), COLUMNS + ['pwv'], part=part).resumed == 0
+    assert Accumulator(cycle, range(4), COLUMNS, part=part, mode='columns').resumed == 0
+
+def test_resume_jacobians(tmp_path):
+    part  = str(tmp_path / 'table.tsv.part')
+    cycle = datetime(2020, 7, 1, 6)
+    jac   = {'tau': {'T': [0.1, None]}, 'Tb': {'T': [1.0, None]}}
+
+    with Accumulator(cycle, range(2), COLUMNS, part=part) as acc:
+        acc.add(1, {'tau':0.2, 'Tb':20.0, 'jacobian':jac})
+
+    # Resumed rows keep their Jacobians
+    with Accumulator(cycle, range(2), COLUMNS, part=part) as acc:
+        assert acc.todo == [0]
+        acc.add(0, {'tau':0.1, 'Tb':10.0, 'jacobian':jac})
+        df = acc.table()
+    assert df.attrs['jacobians']['date'] == list(df.date)
+    assert np.allclose(df.attrs['jacobians']['tau']['T'][:,0], 0.1)
@@ -18,6 +18,202 @@
 
 import ucast as uc
 
+from datetime import datetime
+
+import numpy as np
+import pytest
+
+from ucast             import site
+from ucast.cache       import SolutionCache
+from ucast.radtran.am  import AM, tune
+from ucast.radtran.am.core import PROCS
+from ucast.radtran.am.config import config, config_batch, layers, differentiate
+from ucast.radtran.am import columns, columns_batch, Emulator
+from ucast.weather.gfs import GFS, grib, synthetic
+from ucast.weather.gfs.nomads import variables, levels
+
+@pytest.fixture
+def am(tmp_path):
+    # Stand-in for the `am` executable; the real one is not needed to
+    # test the scheduling
+    path = tmp_path / 'am'
+    path.write_text('#!/bin/sh\ncat > /dev/null\necho "225 0.05 12.0"\n')
+    path.chmod(0o755)
+    return AM(str(path), procs=4)
+
+def profiles(n):
+    s = site.JCMT
+    c = datetime(2020, 7, 1, 6)
+    g = synthetic.subset(c, 0, 0.25, variables, levels, -155.5, -155.25, 20.0, 19.75)
+    return [GFS(s, c, hr, data=grib.load(g, s)) for hr in range(n)]
+
 def test_am():
     am = uc.radtran.am.AM(path='/dev/null/')
     assert am is not None
+
+def test_solve_many(am):
+    gfss = profiles(8)
+    gfss[3].site = site.JCMT._replace(alt=1e5) # above the top GFS level
+
+    sols = am.solve_many(gfss)
+    assert len(sols) == 8
+    assert isinstance(sols[3], ValueError)
+    for k, sol in enumerate(sols):
+        if k != 3:
+            assert sol['tau'] == 0.05 and sol['Tb'] == 12.0
+
+def test_failure(tmp_path):
+    path = tmp_path / 'am'
+    path.write_text('#!/bin/sh\necho "am: bad config" >&2\nexit 1\n')
+    path.chmod(0o755)
+
+    with pytest.raises(RuntimeError, match='bad config'):
+        AM(str(path), procs=1).solve(profiles(1)[0])
+
+def test_threads(tmp_path, monkeypatch):
+    path = tmp_path / 'am'
+    path.write_text('#!/bin/sh\necho "$OMP_NUM_THREADS"\n')
+    path.chmod(0o755)
+
+    am  = AM(str(path), procs=2, threads=3)
+    res = am.run('-', capture_output=True, encoding='utf-8')
+    assert res.stdout.strip() == '3'
+
+    # A `procs` override does not keep the calibrated threads
+    monkeypatch.setattr(tune, 'load', lambda: {'procs': 1, 'threads': 64})
+    assert AM(str(path), procs=1).threads == 64
+    assert AM(str(path), procs=2).threads == max(1, PROCS // 2)
+
+    am = AM(str(path))
+    with am.pool(4) as pool:
+        res = pool.submit(am.run, '-', capture_output=True, encoding='utf-8').result()
+    assert res.stdout.strip() == str(max(1, PROCS // 4))
+    assert am.run('-', capture_output=True, encoding='utf-8').stdout.strip() == '64'
+
+    assert (1, 1) in tune.combinations(4)
+    assert all(p * t <= 6 for p, t in tune.combinations(6))
+    assert (6, 1) in tune.combinations(6)
+
+def test_memo(am, tmp_path):
+    am.memo = SolutionCache(str(tmp_path / 'memo.sqlite'), maxsize=2)
+
+    gfss = profiles(3)
+    sols = [am.solve(gfss[k]) for k in [0, 1, 0, 2, 0]]
+    assert sols[2] == sols[0] == sols[4]
+    assert am.memo.summary()['hits'] == 2
+    assert am.memo.summary()['size'] == 2 # the least recently used one was evicted
+
+    # A different `am` executable does not share solutions
+    am._version = 'other'
+    am.solve(gfss[0])
+    assert am.memo.summary()['hits'] == 2
+
+def test_config_batch():
+    gfss = profiles(4)
+    for alt in [1e5, float(gfss[0].z[20]), 0.0]: # above the top, on, and below all levels
+        gfss.append(GFS(site.JCMT._replace(alt=alt), gfss[0].cycle, None,
+                        data={k:getattr(gfss[0], k) for k in grib.load_map.keys() | {'P'}}))
+
+    for g, c in zip(gfss, config_batch(gfss)):
+        try:
+            ref = config(g)
+        except ValueError:
+            assert isinstance(c, ValueError)
+            continue
+        assert c[0] == ref[0]
+        assert np.array_equal(c[1], ref[1])
+        assert np.array_equal(c[2], ref[2])
+
+def test_columns():
+    gfss = profiles(4)
+    d    = layers(gfss[0])
+    c    = columns(gfss[0])
+    assert np.isclose(c['lwp'] + c['iwp'], d['ctw'].sum() + d['cti'].sum())
+    assert c['pwv'] > 0 and c['o3'] > 0
+
+    for g, b in zip(gfss, columns_batch(gfss)):
+        c = columns(g)
+        assert b.keys() == c.keys()
+        assert all(np.isclose(b[k], c[k], rtol=1e-12) for k in c)
+
+def test_emulator(am, tmp_path):
+    gfss = profiles(24)
+    emu  = Emulator.train(am, gfss, degree=1)
+    assert all(abs(v) < 1e-9 for v in emu.error.values()) # `am` stand-in is constant
+
+    solve = emu.solver(am)
+    sol   = solve(gfss[0])
+    assert np.isclose(sol['tau'], 0.05) and np.isclose(sol['Tb'], 12.0)
+    assert sol['pwv'] == columns(gfss[0])['pwv']
+
+    # Batched: columns at once, `am` only for the misses
+    with am.pool() as pool:
+        fs = emu.submit_many(am, pool, gfss[:3])
+    assert [f.result()['pwv'] for f in fs] == [c['pwv'] for c in columns_batch(gfss[:3])]
+    assert emu.summary()['hits'] == 4 and emu.summary()['misses'] == 0
+
+    # Outside of the training range, fall back to `am`
+    emu.hi[0] = emu.lo[0] = -1.0
+    assert emu.predict(columns(gfss[0])) is None
+    assert solve(gfss[0])['tau'] == 0.05
+    assert emu.summary()['hits'] == 4 and emu.summary()['misses'] == 1
+
+    emu.save(str(tmp_path / 'emu.npz'))
+    emu2 = Emulator.load(str(tmp_path / 'emu.npz'))
+    assert np.array_equal(emu2.coef, emu.coef) and np.array_equal(emu2.lo, emu.lo)
+    assert emu2.version == emu.version
+    emu2.coef[0,0] += 1.0
+    assert emu2.version != emu.version
+
+def test_bands(tmp_path):
+    path = tmp_path / 'am'
+    path.write_text('#!/bin/sh\ncat > /dev/null\n'
+                    'echo "225 0.05 12.0"\necho "345 0.15 30.0"\necho "465 0.5 80.0"\necho "690 1.2 150.0"\n')
+    path.chmod(0o755)
+
+    am = AM(str(path), procs=1, bands=[465, 345])
+    assert 'f 225 GHz 465 GHz 120 GHz\n' in am.header
+    assert am.names == ['tau345', 'Tb345', 'tau465', 'Tb465']
+
+    sol = am.solve(profiles(1)[0])
+    assert sol['tau'] == 0.05 and sol['Tb'] == 12.0
+    assert sol['tau345'] == 0.15 and sol['Tb465'] == 80.0
+    assert 'tau690' not in sol
+
+    am.bands = []
+    assert 'f 225 GHz 225 GHz 1 GHz\n' in am.header
+
+def test_bands_grid():
+    am = AM('/dev/null', procs=1)
+    lo, hi, step = AM.grid([230.538, 345.796])
+    assert (hi - lo) // step + 1 == 4647
+
+    # Non-commensurate bands would explode the frequency grid
+    with pytest.raises(ValueError):
+        am.bands = [230.538, 345.796]
+    assert am.bands == []
+
+    am.bands = [230.5, 345]
+    assert 'f 225 GHz 345 GHz 0.5 GHz\n' in am.header
+
+def test_jacobians(tmp_path):
+    # Output one derivative per tagged variable: tau first, then Tb
+    path = tmp_path / 'am'
+    path.write_text('#!/bin/sh\nn=$(grep -cE " (1 K|1%|1e-3 kg\\*m\\^-2)$")\n'
+                    'awk -v n=$n \'BEGIN { printf "225 0.05 12.0";'
+                    ' for (j = 1; j <= n; j++) printf " %g", j / 1000;'
+                    ' for (j = 1; j <= n; j++) printf " %g", j; print "" }\'\n')
+    path.chmod(0o755)
+
+    am  = AM(str(path), procs=1, jacobians=True)
+    gfs = profiles(1)[0]
+    sol = am.solve(gfs)
+    assert sol['tau'] == 0.05 and sol['Tb'] == 12.0
+
+    _, tags = differentiate(config(gfs)[0])
+    jac = sol['jacobian']
+    for j, (v, k) in enumerate(tags):
+        assert jac['tau'][v][k] == (j + 1) / 1000
+        assert jac['Tb' ][v][k] == j + 1
+    assert len(jac['Tb']['T']) == len(config(gfs)[1])
+    assert all(t is not None for t in jac['Tb']['T'])
@@ -0,0 +1,49 @@
+# Copyright (C) 2020 Chi-kwan Chan
+# Copyright (C) 2020 Steward Observatory
+#
+# This file is part of `ucast`.
+#
+# `Ucast` is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# `Ucast` is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with `ucast`.  If not, see <http://www.gnu.org/licenses/>.
+
+from datetime import datetime
+
+import numpy  as np
+import pandas as pd
+
+from ucast.archive import Archive
+
+def test_archive(tmp_path, table):
+    a  = Archive(str(tmp_path / 'archive.sqlite'))
+    c0 = datetime(2020, 7, 1, 0)
+    c1 = datetime(2020, 7, 1, 6)
+    assert a.add(c0, table(range(0, 13, 3), c0, 0.05)) == 5
+    assert a.add(c1, table(range(0, 13, 3), c1, 0.05)) == 5
+
+    # Re-adding a cycle replaces it; new columns are added
+    df = table(range(0, 13, 3), c1, 0.1)
+    df['tau345'] = np.nan
+    assert a.add(c1, df) == 5
+    assert a.cycles() == [c0, c1]
+
+    # Forecasts valid at 09:00-12:00 from both cycles
+    q = a.query(valid=(datetime(2020, 7, 1, 9), datetime(2020, 7, 1, 12)))
+    assert len(q) == 4
+    assert list(q.columns) == ['cycle', 'date', 'lead', 'tau', 'Tb', 'tau345']
+    assert list(q.lead) == [9, 12, 3, 6]
+    assert list(q.tau)  == [0.05, 0.05, 0.1, 0.1]
+    assert q.tau345.isna().all()
+
+    # Lead-6h forecasts issued on July 1
+    q = a.query(cycle=(datetime(2020, 7, 1), datetime(2020, 7, 1, 23)), lead=6)
+    assert list(q.date) == [pd.Timestamp('2020-07-01 06:00'), pd.Timestamp('2020-07-01 12:00')]
@@ -0,0 +1,58 @@
+# Copyright (C) 2020 Chi-kwan Chan
+# Copyright (C) 2020 Steward Observatory
+#
+# This file is part of `ucast`.
+#
+# `Ucast` is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# `Ucast` is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with `ucast`.  If not, see <http://www.gnu.org/licenses/>.
+
+from datetime import datetime
+
+from ucast.cache import GribCache
+from ucast.weather.gfs import bulk, nomads
+from ucast.weather.gfs.standin import StandIn
+
+cycle = datetime(2020, 7, 1, 6)
+
+idx = """1:0:d=2020070106:PRMSL:mean sea level:3 hour fcst:
+2:100:d=2020070106:TMP:500 mb:3 hour fcst:
+3:250:d=2020070106:RH:500 mb:3 hour fcst:
+4:400:d=2020070106:UGRD:500 mb:3 hour fcst:
+4.1:400:d=2020070106:VGRD:500 mb:3 hour fcst:
+5:600:d=2020070106:HGT:500 mb:3 hour fcst:
+"""
+
+def test_idx():
+    records = bulk.parse_idx(idx)
+    assert len(records) == 5
+    assert records[-1].end is None
+
+    selected = bulk.select(records)
+    assert [r.var for r in selected] == ['TMP', 'RH', 'HGT']
+    assert bulk.ranges(selected, gap=0)   == [(100, 399), (600, None)]
+    assert bulk.ranges(selected, gap=500) == [(100, None)]
+
+def test_fetch(monkeypatch, tmp_path):
+    server = StandIn().start()
+    monkeypatch.setattr(nomads, 'BASE_URL', server.url)
+
+    # Rate limited and cached like the subset downloads
+    cache = GribCache(str(tmp_path))
+    out   = dict(bulk.fetch(cycle, [3], gridsz=2.5, rate=100, cache=cache))
+    assert out[3] == bulk.download(cycle, 3, 2.5)
+    assert cache.summary()['misses'] > 1 # one entry per byte range
+
+    assert dict(bulk.fetch(cycle, [3], gridsz=2.5, rate=100, cache=cache)) == out
+    assert cache.summary()['hits'] == cache.summary()['misses']
+
+    server.shutdown()
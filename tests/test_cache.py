@@ -0,0 +1,34 @@
+# Copyright (C) 2020 Chi-kwan Chan
+# Copyright (C) 2020 Steward Observatory
+#
+# This file is part of `ucast`.
+#
+# `Ucast` is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# `Ucast` is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with `ucast`.  If not, see <http://www.gnu.org/licenses/>.
+
+from ucast.cache import GribCache
+
+def test_cache(tmp_path):
+    cache = GribCache(str(tmp_path), maxsize=250)
+
+    cache.put('https://a/cgi?x=1&y=2', b'1' * 100)
+    assert cache.get('http://b/cgi?y=2&x=1') == b'1' * 100 # normalized
+    assert cache.get('https://a/cgi?x=2&y=2') is None
+
+    cache.put('https://a/cgi?x=2', b'2' * 100)
+    cache.get('https://a/cgi?x=1&y=2') # make x=1 recently used
+    cache.put('https://a/cgi?x=3', b'3' * 100)
+
+    assert cache.get('https://a/cgi?x=2') is None # evicted
+    assert cache.get('https://a/cgi?x=1&y=2') is not None
+    assert cache.summary()['hits'] == 3
@@ -0,0 +1,52 @@
+# Copyright (C) 2020 Chi-kwan Chan
+# Copyright (C) 2020 Steward Observatory
+#
+# This file is part of `ucast`.
+#
+# `Ucast` is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# `Ucast` is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with `ucast`.  If not, see <http://www.gnu.org/licenses/>.
+
+import asyncio
+import time
+
+from ucast.fetch   import TokenBucket, fetch
+from ucast.request import Transport
+
+def test_bucket():
+    bucket = TokenBucket(rate=50, burst=2)
+
+    async def drain():
+        for _ in range(7):
+            await bucket.acquire()
+
+    loop  = asyncio.new_event_loop()
+    start = time.monotonic()
+    loop.run_until_complete(drain())
+    loop.close()
+    assert time.monotonic() - start >= 5 / 50 * 0.9
+
+def test_fetch():
+    out = fetch(['invalid://a', 'invalid://b'], jobs=2, rate=100)
+    assert len(out) == 2
+    assert all(isinstance(o, Exception) for o in out)
+
+def test_transport():
+    t = Transport(records=2)
+    for retry in range(3):
+        try:
+            t.get('invalid://a', retry=retry)
+        except Exception:
+            pass
+    m = t.summary()
+    assert m['requests'] == 1 and m['retries'] == 2 and m['status'] == {None: 3}
+    assert len(t.records) == 2 # bounded; the totals are kept
@@ -0,0 +1,90 @@
+# Copyright (C) 2020 Chi-kwan Chan
+# Copyright (C) 2020 Steward Observatory
+#
+# This file is part of `ucast`.
+#
+# `Ucast` is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# `Ucast` is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with `ucast`.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import base64
+
+from datetime import datetime
+
+import numpy as np
+import pytest
+
+from ucast             import site
+from ucast.weather.gfs import grib, grib2, synthetic
+from ucast.weather.gfs.nomads import variables, levels
+
+def test_load():
+    s = site.JCMT
+    c = synthetic.subset(datetime(2020, 7, 1, 6), 3, 0.25, variables, levels,
+                         -155.5, -155.25, 20.0, 19.75)
+    d = grib.load(c, s)
+    g = grib.load_group(c, [s])[0]
+    assert d['missing'] == []
+    for k in grib.load_map:
+        assert np.allclose(d[k], g[k], rtol=1e-12, atol=0)
+
+    # Drop the last message (ICMR at 1000 mbar)
+    d = grib.load(b''.join(list(grib.messages(c))[:-1]), s)
+    assert d['missing'] == [('cloud_imr', 1000)]
+    assert d['cloud_imr'][-1] == 0.0
+
+    # Corrupt or truncated messages raise instead of looping forever
+    for bad in (b'GRIB' + b'\0' * 12 + b'junk', c[:-1]):
+        with pytest.raises(ValueError):
+            list(grib.messages(bad))
+
+# TMP at 500 mbar on a 1-degree grid over 0-7E, 0-5N, encoded by
+# pygrib with complex packing (template 5.2) and complex packing with
+# spatial differencing (template 5.3) from the values in `test_complex`
+complex_packed = {
+    2: 'R1JJQgAAAAIAAAAAAAABDAAAABUBAAcAAAIBAQfkBwEGAAAAAQAAAEgDAAAAADAAAAAABgAAAAAAAAAAAAAAAAAAAAAAAAgA'
+       'AAAGAAAAAP////8AAAAAAAAAADAATEtAAGrPwAAPQkAAD0JAQAAAACIEAAAAAAAAAgBgAAAAAQAAAANkAAAAw1D///////8A'
+       'AAAvBQAAADAAAkN6AACACAAADAABAGJY0ZoAAAAAAAAAAwAEAAAACQEAAAAYBAAAAAYG/wAAAEQHAAAAoAALsAbwIAgBgEAK'
+       'AYAAAABAEAMAEAYBQAAAAGAYAQBQAgEAAAAAgAQCgCAMAMAAAACgDACAYAgAgAAANzc3Nw==',
+    3: 'R1JJQgAAAAIAAAAAAAABFAAAABUBAAcAAAIBAQfkBwEGAAAAAQAAAEgDAAAAADAAAAAABgAAAAAAAAAAAAAAAAAAAAAAAAgA'
+       'AAAGAAAAAP////8AAAAAAAAAADAATEtAAGrPwAAPQkAAD0JAQAAAACIEAAAAAAAAAgBgAAAAAQAAAANkAAAAw1D///////8A'
+       'AAAxBQAAADAAA0N6AACACgAADgABAGJY0ZoAAAAAAAAABgAEAAAAAgEAAAADBQECAAAABgb/AAAASgcAAJgAYAHAAAAgABAB'
+       'AAAA0OA5ABuEAAYAAABwAcAAADwAgAIAAQAgABACAAEAFACQAIAJAAgAkACAAgAUAKAAwAMAKAA3Nzc3',
+}
+
+def test_complex():
+    j, i = np.mgrid[0:6, 0:8]
+    v    = 250.0 + (i * j % 7) + 10 * (j > 2)
+    for t, m in complex_packed.items():
+        b = grib2.Message(base64.b64decode(m))
+        assert (b.level, b.typeOfLevel) == (500, 'isobaricInhPa')
+        assert np.array_equal(b.values, v)
+        lats, lons = b.latlons()
+        assert np.array_equal(lats[:,0], range(6))
+        assert np.array_equal(lons[0],   range(8))
+
+def test_builtin():
+    pygrib = pytest.importorskip('pygrib')
+
+    c = synthetic.subset(datetime(2020, 7, 1, 6), 3, 1.0, ['TMP'], [500], 0, 359, 90, -90)
+    for packing in ['grid_simple', 'grid_complex', 'grid_complex_spatial_differencing']:
+        g = pygrib.fromstring(c)
+        v = g.values
+        g['packingType'] = packing
+        g['values']      = v
+        m = g.tostring()
+        b = grib2.Message(m)
+        p = pygrib.fromstring(m)
+        assert (b.level, b.typeOfLevel) == (500, 'isobaricInhPa')
+        assert np.array_equal(b.values, p.values)
+        assert np.allclose(b.latlons(), p.latlons())
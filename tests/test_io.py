@@ -0,0 +1,58 @@
+# Copyright (C) 2020 Chi-kwan Chan
+# Copyright (C) 2020 Steward Observatory
+#
+# This file is part of `ucast`.
+#
+# `Ucast` is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# `Ucast` is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with `ucast`.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+
+import numpy  as np
+import pandas as pd
+
+from ucast import io
+
+def test_npy(tmp_path, table):
+    tsv = str(tmp_path / '2020-07-01_06.00.00.tsv')
+    io.save_tsv(tsv, table())
+    os.symlink(tsv, str(tmp_path / 'latest.tsv'))
+
+    # Without a binary sidecar, read the TSV file
+    link = str(tmp_path / 'latest.tsv')
+    assert io.binary(link) == str(tmp_path / '2020-07-01_06.00.00.npy')
+    ref  = io.read_table(link)
+
+    io.save_npy(io.binary(link), table())
+    a = np.load(io.binary(link))
+    assert a.dtype['date'] == np.int64
+    assert a['date'][1] - a['date'][0] == 3600
+
+    df = io.read_table(link)
+    pd.testing.assert_frame_equal(df, ref, check_dtype=False)
+
+    # A stale sidecar is ignored
+    os.utime(io.binary(link), (0, 0))
+    io.save_tsv(tsv, table(range(2)))
+    assert len(io.read_table(link)) == 2
+
+def test_jacobians(tmp_path, table):
+    tsv = str(tmp_path / '2020-07-01_06.00.00.tsv')
+    df  = table()
+    df.attrs['jacobians'] = {'date': list(df.date), 'tau': {'T': np.ones((3, 2))}}
+    io.save_tsv(tsv, df)
+    assert np.allclose(io.read_jacobians(tsv)['tau']['T'], 1)
+
+    # A table saved again without Jacobians drops the stale ones
+    io.save_tsv(tsv, table())
+    assert io.read_jacobians(tsv) is None
@@ -0,0 +1,53 @@
+# Copyright (C) 2020 Chi-kwan Chan
+# Copyright (C) 2020 Steward Observatory
+#
+# This file is part of `ucast`.
+#
+# `Ucast` is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# `Ucast` is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with `ucast`.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+
+import pandas as pd
+
+from ucast        import io
+from ucast.loader import Loader
+
+def test_loader(tmp_path, table):
+    tsv = str(tmp_path / '2020-07-01_06.00.00.tsv')
+    io.save_tsv(tsv, table(range(3)))
+    for l in ['latest.tsv', 'latest-06.tsv']:
+        os.symlink(tsv, str(tmp_path / l))
+    links = [str(tmp_path / l) for l in ['latest.tsv', 'latest-06.tsv']]
+    cache = str(tmp_path / 'cache')
+
+    loader = Loader(cache, jobs=2)
+    dfs    = loader.read_many(links * 2)
+    assert [len(df) for df in dfs] == [3] * 4
+    assert loader.summary()['size'] == 1 # links share the resolved path
+    assert loader.summary()['misses'] == 1 # concurrent reads share a parse
+
+    # Another run reads the parsed table from `cache`
+    loader = Loader(cache)
+    pd.testing.assert_frame_equal(loader.read(links[0]), dfs[0], check_dtype=False)
+    assert loader.summary()['hits'] == 1
+
+    # A modified table is read again
+    io.save_tsv(tsv, table(range(2)))
+    os.utime(tsv, ns=(0, 10**18))
+    assert len(loader.read(links[0])) == 2
+    assert loader.summary()['misses'] == 1
+
+def test_disabled():
+    assert Loader('').cache is None
+    assert Loader(None).cache is None
@@ -0,0 +1,55 @@
+# Copyright (C) 2020 Chi-kwan Chan
+# Copyright (C) 2020 Steward Observatory
+#
+# This file is part of `ucast`.
+#
+# `Ucast` is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# `Ucast` is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with `ucast`.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+
+from datetime import datetime
+
+import numpy as np
+
+from ucast import io
+from ucast.manifest import manifest, record, done, gaps, fill
+
+cycle = datetime(2020, 7, 1, 6)
+
+def test_manifest(tmp_path, table):
+    tsv = str(tmp_path / '2020-07-01_06.00.00.tsv')
+    assert done(tsv) == set()
+    assert gaps(tsv, range(4)) == [0, 1, 2, 3]
+
+    io.save_tsv(tsv, table([0, 2]))
+    record(tsv, cycle, table([0, 2]))
+    assert manifest(tsv) == str(tmp_path / '2020-07-01_06.00.00.done')
+    assert done(tsv) == {0, 2}
+    assert gaps(tsv, range(4)) == [1, 3]
+
+    # A table without a manifest is read once, and its manifest written
+    os.remove(manifest(tsv))
+    assert gaps(tsv, range(4)) == [1, 3]
+    assert os.path.isfile(manifest(tsv))
+
+def test_fill(tmp_path, table):
+    tsv = str(tmp_path / '2020-07-01_06.00.00.tsv')
+    io.save_tsv(tsv, table([0, 2]))
+
+    new = table([1, 2, 3])
+    new.loc[1, 'tau'] = 9.0 # replaces the saved row of hour 2
+
+    df = fill(tsv, new)
+    assert list(df.date) == list(table(range(4)).date)
+    assert np.allclose(df.tau, [0.05, 1.05, 9.0, 3.05])
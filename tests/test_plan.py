@@ -0,0 +1,30 @@
+# Copyright (C) 2020 Chi-kwan Chan
+# Copyright (C) 2020 Steward Observatory
+#
+# This file is part of `ucast`.
+#
+# `Ucast` is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# `Ucast` is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with `ucast`.  If not, see <http://www.gnu.org/licenses/>.
+
+from datetime import datetime
+
+from ucast      import site
+from ucast.plan import Plan
+
+def test_plan():
+    cycle = datetime(2020, 7, 1, 6)
+    plan  = Plan((s, cycle, hr) for s in [site.JCMT, site.SMA, site.KP] for hr in range(3))
+    assert len(plan.jobs) == 9
+    assert len(plan.urls) == 6
+    assert plan.saved     == 3
+    assert [[plan.jobs[k].site.name for k in f] for f in plan.fanout[:2]] == [['JCMT', 'SMA'], ['JCMT', 'SMA']]
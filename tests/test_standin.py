@@ -0,0 +1,79 @@
+# Copyright (C) 2020 Chi-kwan Chan
+# Copyright (C) 2020 Steward Observatory
+#
+# This file is part of `ucast`.
+#
+# `Ucast` is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# `Ucast` is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with `ucast`.  If not, see <http://www.gnu.org/licenses/>.
+
+import asyncio
+import time
+
+from datetime import datetime
+
+import pytest
+import requests
+
+import ucast as uc
+from ucast.fetch import fetch, RetryBudget, CircuitBreaker
+from ucast.weather.gfs import nomads
+from ucast.weather.gfs.standin import StandIn
+
+cycle = datetime(2020, 7, 1, 6)
+
+def test_standin(monkeypatch):
+    server = StandIn().start()
+    monkeypatch.setattr(nomads, 'BASE_URL', server.url)
+
+    gfs = uc.gfs.GFS(uc.site.KP, cycle, 3)
+    assert len(gfs.T) == len(nomads.levels)
+    assert 200 < gfs.T[-1] < 320 and 0 <= gfs.RH[-1] <= 100
+
+    assert 384 in uc.gfs.available(cycle)
+
+    server.shutdown()
+
+def test_errors(monkeypatch):
+    server = StandIn(errors={503: 1.0}).start()
+    monkeypatch.setattr(nomads, 'BASE_URL', server.url)
+
+    urls = [nomads.data_url(uc.site.KP, cycle, h, 0.25) for h in range(4)]
+    # A local budget and breaker keep the global ones for other tests
+    out  = fetch(urls, rate=100, delay=0,
+                 budget=RetryBudget(), breaker=CircuitBreaker(trips=1))
+    assert all(isinstance(o, Exception) for o in out)
+
+    server.shutdown()
+
+def test_breaker():
+    loop    = asyncio.new_event_loop()
+    breaker = CircuitBreaker(window=1, cooldown=60, trips=2)
+    for _ in range(2):
+        breaker.failure()
+        breaker.until = 0 # skip the cool-down
+        loop.run_until_complete(breaker.wait()) # probe
+    breaker.failure()
+    assert breaker.broken
+
+    # Fail fast while down ...
+    with pytest.raises(requests.exceptions.RetryError):
+        loop.run_until_complete(breaker.wait())
+
+    # ... but keep probing after the maximum cool-down
+    assert breaker.until - time.monotonic() <= 120
+    breaker.until = 0
+    loop.run_until_complete(breaker.wait())
+    breaker.success()
+    assert not breaker.broken
+    loop.run_until_complete(breaker.wait())
+    loop.close()